@@ -1,3 +1,73 @@
+from db.category_tree import ensure_category_closure
+from db.fulltext import create_fulltext_index
+from media.blob_store import ensure_media_columns
+
+# Secondary indexes backing the app's hot lookups: (index name, table, columns).
+# Foreign key columns are included explicitly so both dialects get the same index set;
+# MySQL would otherwise create unnamed ones implicitly and SQLite none at all.
+APP_INDEXES = [
+    ("idx_recipe_name", "recipe", ("name",)),
+    ("idx_recipe_category_id", "recipe", ("category_id", "id")),
+    ("idx_recipe_created_at", "recipe", ("created_at", "id")),
+    ("idx_recipe_user_id", "recipe", ("user_id",)),
+    ("idx_recipe_ingredient_ingredient_id", "recipe_ingredient", ("ingredient_id", "recipe_id")),
+    ("idx_ingredient_name", "ingredient", ("name",)),
+    ("idx_review_recipe_id", "review", ("recipe_id",)),
+    ("idx_category_parent_category_id", "category", ("parent_category_id",)),
+    ("idx_category_closure_descendant", "category_closure", ("descendant_id", "depth")),
+    ("idx_recipe_minhash_band_recipe_id", "recipe_minhash_band", ("recipe_id",)),
+    ("idx_recipe_near_duplicate_duplicate_of", "recipe_near_duplicate", ("duplicate_of",)),
+    ("idx_etl_run_source", "etl_run", ("source", "chunk_size", "status")),
+]
+
+
+def create_app_indexes(conn, db_type="mysql"):
+    """
+    Creates the secondary indexes listed in APP_INDEXES, skipping the ones that exist.
+    MySQL has no CREATE INDEX IF NOT EXISTS, so there we look them up in information_schema first.
+    """
+    cursor = conn.cursor()
+    existing = set()
+    if db_type == "mysql":
+        cursor.execute("""
+            SELECT DISTINCT index_name
+            FROM information_schema.statistics
+            WHERE table_schema = DATABASE()
+        """)
+        existing = {row[0] for row in cursor.fetchall()}
+    for index_name, table, columns in APP_INDEXES:
+        if db_type == "mysql":
+            if index_name not in existing:
+                cursor.execute(f"CREATE INDEX {index_name} ON {table} ({', '.join(columns)})")
+        else:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(columns)})")
+    conn.commit()
+    cursor.close()
+
+
+def ensure_recipe_content_hash(conn, db_type="mysql"):
+    """
+    Adds recipe.content_hash and its unique index to databases created before the column existed.
+    ETL loads are upserts keyed on it (see db/bulk_load.py).
+    """
+    cursor = conn.cursor()
+    if db_type == "mysql":
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'recipe'
+        """)
+        if "content_hash" not in {row[0] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE recipe ADD COLUMN content_hash CHAR(32), ADD UNIQUE (content_hash)")
+    else:
+        cursor.execute("PRAGMA table_info(recipe)")
+        if "content_hash" not in {row[1] for row in cursor.fetchall()}:
+            # SQLite cannot add a UNIQUE column, but a unique index does the same
+            cursor.execute("ALTER TABLE recipe ADD COLUMN content_hash TEXT")
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_recipe_content_hash ON recipe (content_hash)")
+    conn.commit()
+    cursor.close()
+
+
 def create_app_tables(conn, db_type="mysql"):
     """
     Creates the core application tables for the Single Sauce of Truth.
@@ -61,6 +131,7 @@ def create_app_tables(conn, db_type="mysql"):
             category_id INT,
             user_id INT,
             recipe_story_id INT,
+            content_hash CHAR(32) UNIQUE,
             FOREIGN KEY (category_id) REFERENCES category(id),
             FOREIGN KEY (user_id) REFERENCES user(id)
         )
@@ -91,6 +162,69 @@ def create_app_tables(conn, db_type="mysql"):
         )
         """,
 
+        # Ingredient spellings seen in imports and the ingredient each resolved to (etl/ingredient_resolver.py)
+        """
+        CREATE TABLE IF NOT EXISTS ingredient_alias (
+            alias VARCHAR(255) PRIMARY KEY,
+            ingredient_id INT NOT NULL,
+            score FLOAT NOT NULL,
+            FOREIGN KEY (ingredient_id) REFERENCES ingredient(id) ON DELETE CASCADE
+        )
+        """,
+
+        # MinHash signatures of recipes and their LSH band keys, for near-duplicate lookups (etl/near_duplicates.py);
+        # a NULL signature marks a recipe without any text to compare
+        """
+        CREATE TABLE IF NOT EXISTS recipe_minhash (
+            recipe_id INT PRIMARY KEY,
+            signature BLOB,
+            FOREIGN KEY (recipe_id) REFERENCES recipe(id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipe_minhash_band (
+            band_key BIGINT NOT NULL,
+            recipe_id INT NOT NULL,
+            PRIMARY KEY (band_key, recipe_id),
+            FOREIGN KEY (recipe_id) REFERENCES recipe(id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipe_near_duplicate (
+            recipe_id INT NOT NULL,
+            duplicate_of INT NOT NULL,
+            similarity FLOAT NOT NULL,
+            PRIMARY KEY (recipe_id, duplicate_of),
+            FOREIGN KEY (recipe_id) REFERENCES recipe(id) ON DELETE CASCADE,
+            FOREIGN KEY (duplicate_of) REFERENCES recipe(id) ON DELETE CASCADE
+        )
+        """,
+
+        # ETL runs and their per-chunk checkpoints, so that a rerun skips completed chunks (etl/ledger.py)
+        """
+        CREATE TABLE IF NOT EXISTS etl_run (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            source VARCHAR(512) NOT NULL,
+            chunk_size INT NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            rows_loaded INT NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS etl_chunk (
+            run_id INT NOT NULL,
+            source_file VARCHAR(512) NOT NULL,
+            chunk_no INT NOT NULL,
+            content_hash CHAR(32) NOT NULL,
+            rows_loaded INT NOT NULL,
+            finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_id, source_file, chunk_no),
+            FOREIGN KEY (run_id) REFERENCES etl_run(id) ON DELETE CASCADE
+        )
+        """,
+
         # Cohort table
         """
         CREATE TABLE IF NOT EXISTS cohort (
@@ -141,6 +275,9 @@ def create_app_tables(conn, db_type="mysql"):
         CREATE TABLE IF NOT EXISTS photo (
             id INT AUTO_INCREMENT PRIMARY KEY,
             file MEDIUMBLOB,
+            sha256 CHAR(64),
+            size_bytes BIGINT,
+            content_type VARCHAR(100),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """,
@@ -161,6 +298,9 @@ def create_app_tables(conn, db_type="mysql"):
         CREATE TABLE IF NOT EXISTS video (
             id INT AUTO_INCREMENT PRIMARY KEY,
             file MEDIUMBLOB,
+            sha256 CHAR(64),
+            size_bytes BIGINT,
+            content_type VARCHAR(100),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """,
@@ -175,6 +315,18 @@ def create_app_tables(conn, db_type="mysql"):
             PRIMARY KEY (recipe_id, video_id)
         )
         """,
+
+        # Category closure table: one row per (ancestor, descendant) pair, incl. depth-0 self links
+        """
+        CREATE TABLE IF NOT EXISTS category_closure (
+            ancestor_id INT NOT NULL,
+            descendant_id INT NOT NULL,
+            depth INT NOT NULL,
+            FOREIGN KEY (ancestor_id) REFERENCES category(id),
+            FOREIGN KEY (descendant_id) REFERENCES category(id),
+            PRIMARY KEY (ancestor_id, descendant_id)
+        )
+        """,
     ]
 
     # Define statements for SQLite
@@ -224,6 +376,7 @@ def create_app_tables(conn, db_type="mysql"):
             category_id INTEGER,
             user_id INTEGER,
             recipe_story_id INTEGER,
+            content_hash TEXT UNIQUE,
             FOREIGN KEY (category_id) REFERENCES category(id),
             FOREIGN KEY (user_id) REFERENCES user(id)
         );
@@ -254,6 +407,69 @@ def create_app_tables(conn, db_type="mysql"):
         );
         """,
 
+        # Ingredient spellings seen in imports and the ingredient each resolved to (etl/ingredient_resolver.py)
+        """
+        CREATE TABLE IF NOT EXISTS ingredient_alias (
+            alias TEXT PRIMARY KEY,
+            ingredient_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            FOREIGN KEY (ingredient_id) REFERENCES ingredient(id) ON DELETE CASCADE
+        );
+        """,
+
+        # MinHash signatures of recipes and their LSH band keys, for near-duplicate lookups (etl/near_duplicates.py);
+        # a NULL signature marks a recipe without any text to compare
+        """
+        CREATE TABLE IF NOT EXISTS recipe_minhash (
+            recipe_id INTEGER PRIMARY KEY,
+            signature BLOB,
+            FOREIGN KEY (recipe_id) REFERENCES recipe(id) ON DELETE CASCADE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipe_minhash_band (
+            band_key INTEGER NOT NULL,
+            recipe_id INTEGER NOT NULL,
+            PRIMARY KEY (band_key, recipe_id),
+            FOREIGN KEY (recipe_id) REFERENCES recipe(id) ON DELETE CASCADE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipe_near_duplicate (
+            recipe_id INTEGER NOT NULL,
+            duplicate_of INTEGER NOT NULL,
+            similarity REAL NOT NULL,
+            PRIMARY KEY (recipe_id, duplicate_of),
+            FOREIGN KEY (recipe_id) REFERENCES recipe(id) ON DELETE CASCADE,
+            FOREIGN KEY (duplicate_of) REFERENCES recipe(id) ON DELETE CASCADE
+        );
+        """,
+
+        # ETL runs and their per-chunk checkpoints, so that a rerun skips completed chunks (etl/ledger.py)
+        """
+        CREATE TABLE IF NOT EXISTS etl_run (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            rows_loaded INTEGER NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS etl_chunk (
+            run_id INTEGER NOT NULL,
+            source_file TEXT NOT NULL,
+            chunk_no INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            rows_loaded INTEGER NOT NULL,
+            finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_id, source_file, chunk_no),
+            FOREIGN KEY (run_id) REFERENCES etl_run(id) ON DELETE CASCADE
+        );
+        """,
+
         # Cohort table
         """
         CREATE TABLE IF NOT EXISTS cohort (
@@ -304,6 +520,9 @@ def create_app_tables(conn, db_type="mysql"):
         CREATE TABLE IF NOT EXISTS photo (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             file BLOB,
+            sha256 TEXT,
+            size_bytes INTEGER,
+            content_type TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """,
@@ -324,6 +543,9 @@ def create_app_tables(conn, db_type="mysql"):
         CREATE TABLE IF NOT EXISTS video (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             file BLOB,
+            sha256 TEXT,
+            size_bytes INTEGER,
+            content_type TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """,
@@ -338,6 +560,18 @@ def create_app_tables(conn, db_type="mysql"):
             PRIMARY KEY (recipe_id, video_id)
         );
         """,
+
+        # Category closure table
+        """
+        CREATE TABLE IF NOT EXISTS category_closure (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            FOREIGN KEY (ancestor_id) REFERENCES category(id),
+            FOREIGN KEY (descendant_id) REFERENCES category(id),
+            PRIMARY KEY (ancestor_id, descendant_id)
+        );
+        """,
     ]
 
     # Execute the statements in order
@@ -350,4 +584,9 @@ def create_app_tables(conn, db_type="mysql"):
 
     conn.commit()
     cursor.close()
+    ensure_recipe_content_hash(conn, db_type)
+    create_app_indexes(conn, db_type)
+    create_fulltext_index(conn, db_type)
+    ensure_category_closure(conn, db_type)
+    ensure_media_columns(conn, db_type)
     print("Application tables created successfully.")
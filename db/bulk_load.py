@@ -0,0 +1,264 @@
+import logging
+import os
+import tempfile
+import time
+
+import mysql.connector
+import pandas as pd
+
+from db.db import _column_values, db_configuration, max_rows_per_statement, recipe_ingredient_rows
+
+# Columns of 'recipe' we know how to fill from a transformed DataFrame
+RECIPE_LOAD_COLUMNS = (
+    "name", "name_es", "instructions", "cooking_time_minutes", "difficulty",
+    "source", "category_id", "user_id", "recipe_story_id",
+)
+# Columns that must always be present, because they are NOT NULL in the schema
+REQUIRED_COLUMNS = ("name", "instructions")
+INTEGER_COLUMNS = ("id", "cooking_time_minutes", "category_id", "user_id", "recipe_story_id")
+
+# Directory for the LOAD DATA spool files; the client only allows LOCAL INFILE from there
+SPOOL_DIR = db_configuration["allow_local_infile_in_path"]
+
+logger = logging.getLogger("data")
+
+
+def _load_columns(df, explicit_ids=False):
+    columns = [c for c in RECIPE_LOAD_COLUMNS if c in REQUIRED_COLUMNS or c in df.columns]
+    if "content_hash" in df.columns:
+        columns.append("content_hash")
+    return ["id"] + columns if explicit_ids else columns
+
+
+def _escape_for_load_data(df, column):
+    """
+    Renders one column in the format LOAD DATA expects with the default
+    FIELDS ESCAPED BY '\\': NULL as \\N, and backslash, tab and newlines escaped.
+    Like the executemany path, NULLs in REQUIRED_COLUMNS are written as empty strings.
+    Works on the whole column at once instead of row by row.
+    """
+    if column not in df.columns:
+        return pd.Series([""] * len(df), index=df.index)
+    if column in INTEGER_COLUMNS:
+        series = pd.to_numeric(df[column], errors="coerce").round().astype("Int64")
+        return series.astype(str).where(series.notna(), "\\N")
+    series = df[column]
+    text = series.astype(str)
+    for raw, escaped in (("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r"), ("\0", "\\0")):
+        text = text.str.replace(raw, escaped, regex=False)
+    return text.where(series.notna(), "" if column in REQUIRED_COLUMNS else "\\N")
+
+
+def spool_for_load_data(df, columns, spool_dir=SPOOL_DIR):
+    """
+    Writes 'columns' of 'df' to a tab-separated temp file and returns its path.
+    The caller is responsible for deleting the file.
+    """
+    escaped = [_escape_for_load_data(df, column) for column in columns]
+    lines = escaped[0].str.cat(escaped[1:], sep="\t") if len(escaped) > 1 else escaped[0]
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=".tsv",
+                                     prefix="recipe_load_", dir=spool_dir, delete=False) as f:
+        if len(lines):
+            f.write("\n".join(lines.tolist()))
+            f.write("\n")
+        return f.name
+
+
+def _load_data_infile(conn, df, columns, strict=False):
+    """
+    LOAD DATA of 'columns' of 'df'. By default rows whose content_hash is already loaded are
+    skipped (IGNORE). With strict=True every row has to go in: the server turns duplicate keys
+    and bad values of a LOCAL load into warnings, so a short row count or any warning rolls
+    the load back and raises IntegrityError.
+    """
+    path = spool_for_load_data(df, columns)
+    try:
+        cursor = conn.cursor()
+        ignore = "" if strict else "IGNORE "
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s {ignore}INTO TABLE recipe CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({', '.join(columns)})",
+            (path,)
+        )
+        rows, warnings = cursor.rowcount, cursor.warning_count
+        cursor.close()
+        if strict and (rows != len(df) or warnings):
+            conn.rollback()
+            raise mysql.connector.errors.IntegrityError(
+                f"LOAD DATA inserted {rows} of {len(df)} recipes with {warnings} warnings: "
+                f"an explicit id is taken or a value does not fit.")
+        conn.commit()
+        return rows
+    finally:
+        os.remove(path)
+
+
+def _executemany_insert(conn, df, columns, db_type, upsert=False):
+    placeholder = "%s" if db_type == "mysql" else "?"
+    insert_sql = (
+        f"INSERT INTO recipe ({', '.join(columns)}) "
+        f"VALUES ({', '.join([placeholder] * len(columns))})"
+    )
+    if upsert:
+        # Recipes already loaded (same content_hash) are left as they are
+        if db_type == "mysql":
+            insert_sql += " ON DUPLICATE KEY UPDATE content_hash = content_hash"
+        else:
+            insert_sql += " ON CONFLICT (content_hash) DO NOTHING"
+    values = list(zip(*[
+        _column_values(df, column, "" if column in REQUIRED_COLUMNS else None) for column in columns
+    ]))
+    cursor = conn.cursor()
+    try:
+        if db_type == "sqlite" and not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        # The same SQL text for every row: SQLite prepares it once from its statement cache,
+        # Connector/Python rewrites it into multi-row INSERTs
+        cursor.executemany(insert_sql, values)
+        rows = cursor.rowcount if upsert and cursor.rowcount >= 0 else len(values)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return rows
+
+
+def _max_recipe_id(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM recipe")
+    max_id = cursor.fetchall()[0][0]
+    cursor.close()
+    return max_id
+
+
+def _loaded_recipe_ids(conn, df, after_id, db_type):
+    """
+    The ids the rows of 'df' were just loaded as (None for rows that were not inserted).
+    LOAD DATA does not report generated ids, so they are read back by name: the ETL drops
+    duplicate names before loading (see etl.transform and etl.streaming.NameDeduplicator).
+    """
+    placeholder = "%s" if db_type == "mysql" else "?"
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id, name FROM recipe WHERE id > {placeholder} ORDER BY id", (after_id,))
+    recipe_ids = {}
+    for recipe_id, name in cursor.fetchall():
+        recipe_ids.setdefault(name, recipe_id)
+    cursor.close()
+    return [recipe_ids.get(name) for name in _column_values(df, "name", "")]
+
+
+def _recipe_ids_by_hash(conn, df, db_type):
+    """
+    The ids of the rows of 'df' by their content_hash: the rows just inserted as well as the
+    ones loaded before, which an upsert skipped.
+    """
+    placeholder = "%s" if db_type == "mysql" else "?"
+    hashes = _column_values(df, "content_hash")
+    distinct = sorted({h for h in hashes if h is not None})
+    step = max_rows_per_statement(db_type, 1)
+    recipe_ids = {}
+    cursor = conn.cursor()
+    for start in range(0, len(distinct), step):
+        batch = distinct[start:start + step]
+        cursor.execute(f"SELECT id, content_hash FROM recipe "
+                       f"WHERE content_hash IN ({', '.join([placeholder] * len(batch))})", batch)
+        recipe_ids.update((content_hash, recipe_id) for recipe_id, content_hash in cursor.fetchall())
+    cursor.close()
+    return [recipe_ids.get(h) for h in hashes]
+
+
+def _insert_recipe_ingredients(conn, df, recipe_ids, db_type):
+    """
+    Inserts the recipe_ingredient rows of the recipes just loaded from 'ingredients_info'.
+    Rows that exist already are skipped, so a chunk can be loaded again after a crash.
+    """
+    placeholder = "%s" if db_type == "mysql" else "?"
+    rows = []
+    for recipe_id, ingredients_info in zip(recipe_ids, _column_values(df, "ingredients_info")):
+        if recipe_id is not None:
+            rows.extend(recipe_ingredient_rows(recipe_id, ingredients_info))
+    cursor = conn.cursor()
+    try:
+        if db_type == "sqlite" and not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        cursor.executemany(
+            "INSERT INTO recipe_ingredient (recipe_id, ingredient_id, quantity, unit, optional) "
+            f"VALUES ({', '.join([placeholder] * 5)}) "
+            + ("ON DUPLICATE KEY UPDATE recipe_id = recipe_id" if db_type == "mysql"
+               else "ON CONFLICT (recipe_id, ingredient_id) DO NOTHING"),
+            rows
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(rows)
+
+
+def bulk_load_recipes(conn, df, db_type="mysql", use_infile=True, explicit_ids=False):
+    """
+    Loads a transformed DataFrame into the 'recipe' table as fast as the dialect allows:
+      - MySQL: spools the frame to a temp file and runs LOAD DATA LOCAL INFILE
+        (needs local_infile on the server and allow_local_infile_in_path on the client)
+      - SQLite, or MySQL when LOAD DATA is refused: one executemany inside a single transaction
+    Frames with 'content_hash' (see etl/transform.py) are upserted on it: recipes loaded before
+    are skipped (their 'recipe_ids' entry is the existing id), and 'rows' counts the new ones only.
+    If the frame has resolved 'ingredients_info' lists (see etl/ingredient_resolver.py), their
+    recipe_ingredient rows are inserted afterwards.
+    Returns a dict with the method used, the number of rows, the elapsed seconds and rows/second,
+    the number of recipe_ingredient rows, and - for frames with 'ingredients_info' or 'minhash'
+    (see etl/near_duplicates.py) - 'recipe_ids', the id of every row (None if not inserted).
+    With explicit_ids=True the rows are inserted with the ids in the frame's 'id' column instead
+    of auto-increment ones, so that loads running in parallel assign the same ids as a serial
+    one (see etl/parallel.py). Recipes loaded before are then looked up by content_hash and left
+    out up front, and everything else is inserted strictly: an id taken by another recipe raises
+    IntegrityError instead of dropping the row.
+    """
+    columns = _load_columns(df, explicit_ids)
+    started = time.perf_counter()
+    with_ingredients = "ingredients_info" in df.columns and len(df) > 0
+    track_ids = with_ingredients or ("minhash" in df.columns and len(df) > 0)
+    by_hash = "content_hash" in df.columns
+    after_id = _max_recipe_id(conn) if track_ids and not (explicit_ids or by_hash) else None
+    new = df
+    if explicit_ids and by_hash and len(df):
+        new = df[[recipe_id is None for recipe_id in _recipe_ids_by_hash(conn, df, db_type)]]
+    upsert = by_hash and not explicit_ids
+    method = None
+    rows = 0
+    if db_type == "mysql" and use_infile and len(new):
+        try:
+            rows = _load_data_infile(conn, new, columns, strict=explicit_ids)
+            method = "load_data_infile"
+        except mysql.connector.IntegrityError:
+            raise
+        except mysql.connector.Error as err:
+            # Typically local_infile disabled on the server or not allowed by the client
+            logger.warning(f"LOAD DATA LOCAL INFILE unavailable ({err}); falling back to executemany.")
+            conn.rollback()
+    if method is None:
+        rows = _executemany_insert(conn, new, columns, db_type, upsert=upsert)
+        method = "executemany"
+    if not track_ids:
+        recipe_ids = None
+    elif by_hash:
+        recipe_ids = _recipe_ids_by_hash(conn, df, db_type)
+    elif explicit_ids:
+        recipe_ids = _column_values(df, "id")
+    else:
+        recipe_ids = _loaded_recipe_ids(conn, df, after_id, db_type)
+    ingredient_rows = _insert_recipe_ingredients(conn, df, recipe_ids, db_type) if with_ingredients else 0
+    elapsed = time.perf_counter() - started
+    return {
+        "method": method,
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed if elapsed > 0 else float(rows),
+        "ingredient_rows": ingredient_rows,
+        "recipe_ids": recipe_ids,
+    }
@@ -0,0 +1,293 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+# Read-through cache for rarely changing lists (recipes, ingredients, categories).
+# Entries live in a namespace that write paths invalidate as a whole; every namespace
+# also has a generation number, so a load that raced with a write is never stored.
+CACHE_TTL = float(os.environ.get("APP_CACHE_TTL", "300"))
+# Table fingerprints are re-read this often, bounding how long writes by other apps go unnoticed
+FINGERPRINT_TTL = float(os.environ.get("APP_FINGERPRINT_TTL", "2"))
+CACHE_MAX_ENTRIES = int(os.environ.get("APP_CACHE_MAX_ENTRIES", "256"))
+# Private (0700) directory of the app's local data; never a world-writable one such as /tmp
+APP_DATA_DIR = os.environ.get("APP_DATA_DIR", os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "singlesauce"))
+# File shared by all Flask worker processes on a host; created on first use, not on import
+SHARED_CACHE_PATH = os.environ.get("APP_CACHE_PATH", os.path.join(APP_DATA_DIR, "cache.sqlite"))
+
+
+def private_directory(path):
+    """
+    Creates 'path' readable by the current user only, or checks that an existing one is ours
+    and tightens its mode. Raises PermissionError if another user owns it: anyone who can write
+    to the directory could plant or swap the files we read back.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise PermissionError(f"{path} belongs to another user; refusing to keep cache files in it.")
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def _encode(value):
+    # Tagged JSON for the types list reads return besides JSON's own: tuples, dates, DECIMAL
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    return value
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        key, value = next(iter(obj.items()))
+        if key == "__tuple__":
+            return tuple(value)
+        if key == "__datetime__":
+            return datetime.fromisoformat(value)
+        if key == "__date__":
+            return date.fromisoformat(value)
+        if key == "__decimal__":
+            return Decimal(value)
+    return obj
+
+
+def dumps(value):
+    return json.dumps(_encode(value), separators=(",", ":"))
+
+
+def loads(text):
+    return json.loads(text, object_hook=_decode)
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU store (an OrderedDict in access order) with per-entry expiry; used by Kivy.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        """
+        Returns (True, value) for a live entry, (False, None) otherwise.
+        """
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[(namespace, key)]
+                return False, None
+            self._entries.move_to_end((namespace, key))
+            return True, value
+
+    def generation(self, namespace):
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def set(self, namespace, key, value, ttl, generation):
+        """
+        Stores 'value' unless 'namespace' was invalidated since 'generation' was read.
+        """
+        with self._lock:
+            if self._generations.get(namespace, 0) != generation:
+                return False
+            self._entries[(namespace, key)] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def invalidate(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            for entry_key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[entry_key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """
+    LRU store in a local SQLite file, so that several Flask worker processes share
+    entries and see each other's invalidations. Values are stored as JSON (see dumps), never
+    pickled, and the file lives in a directory only this user can write to (private_directory);
+    it is opened, and created if need be, on first use.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, touch_interval=1.0):
+        self.path = path
+        self.max_entries = max_entries
+        # Don't write last_used back on every hit; LRU order only needs to be roughly right
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._schema_ready = False
+
+    def _conn(self):
+        # One autocommit connection per thread, reopened in forked worker processes
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            private_directory(os.path.dirname(os.path.abspath(self.path)))
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                self._create_schema(conn)
+                self._schema_ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entry (
+                namespace TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (namespace, cache_key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entry_last_used ON cache_entry (last_used)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_generation (
+                namespace TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            )
+        """)
+
+    def get(self, namespace, key):
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires_at, last_used FROM cache_entry WHERE namespace = ? AND cache_key = ?",
+                           (namespace, repr(key))).fetchone()
+        if row is None:
+            return False, None
+        value, expires_at, last_used = row
+        now = time.time()
+        if now >= expires_at:
+            return False, None
+        if now - last_used >= self.touch_interval:
+            conn.execute("UPDATE cache_entry SET last_used = ? WHERE namespace = ? AND cache_key = ?",
+                         (now, namespace, repr(key)))
+        try:
+            return True, loads(value)
+        except (TypeError, ValueError):
+            # Written by an older version (pickled) or damaged: treat it as a miss, never unpickle
+            return False, None
+
+    def generation(self, namespace):
+        row = self._conn().execute("SELECT generation FROM cache_generation WHERE namespace = ?",
+                                   (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def set(self, namespace, key, value, ttl, generation):
+        conn = self._conn()
+        now = time.time()
+        blob = dumps(value)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.generation(namespace) != generation:
+                conn.rollback()
+                return False
+            conn.execute("INSERT OR REPLACE INTO cache_entry VALUES (?, ?, ?, ?, ?)",
+                         (namespace, repr(key), blob, now + ttl, now))
+            excess = conn.execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0] - self.max_entries
+            if excess > 0:
+                # Expired entries go first, then the least recently used
+                conn.execute("""
+                    DELETE FROM cache_entry WHERE rowid IN (
+                        SELECT rowid FROM cache_entry ORDER BY expires_at > ?, last_used LIMIT ?
+                    )
+                """, (now, excess))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return True
+
+    def invalidate(self, namespace):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            INSERT INTO cache_generation (namespace, generation) VALUES (?, 1)
+            ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1
+        """, (namespace,))
+        conn.execute("DELETE FROM cache_entry WHERE namespace = ?", (namespace,))
+        conn.commit()
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0]
+
+
+class ReadThroughCache:
+    """
+    get_or_load() returns the cached value or calls 'loader' and caches its result.
+    Loader exceptions propagate and nothing is cached. Cached values are shared:
+    treat them as read-only. Hit/miss counters are per process.
+    """
+
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _count(self, namespace, field):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0})
+            counters[field] += 1
+
+    def get_or_load(self, namespace, key, loader, ttl=None):
+        """
+        'ttl' overrides the cache-wide TTL for this entry.
+        """
+        found, value = self.backend.get(namespace, key)
+        if found:
+            self._count(namespace, "hits")
+            return value
+        self._count(namespace, "misses")
+        generation = self.backend.generation(namespace)
+        value = loader()
+        self.backend.set(namespace, key, value, self.ttl if ttl is None else ttl, generation)
+        return value
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.invalidate(namespace)
+
+    def stats(self):
+        with self._lock:
+            namespaces = {name: dict(counters) for name, counters in self._counters.items()}
+        hits = sum(c["hits"] for c in namespaces.values())
+        misses = sum(c["misses"] for c in namespaces.values())
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            "namespaces": namespaces,
+        }
@@ -0,0 +1,242 @@
+import os
+import time
+
+# Seconds before an app-held CategoryTree is reloaded, to pick up changes made by other processes
+CATEGORY_TREE_TTL = float(os.environ.get("CATEGORY_TREE_TTL", "600"))
+
+
+def _placeholder(db_type):
+    return "%s" if db_type == "mysql" else "?"
+
+
+def rebuild_category_closure(conn, db_type="mysql"):
+    """
+    Recomputes category_closure from the parent_category_id adjacency list.
+    Only needed once for existing data; afterwards add_category / move_category keep it current.
+    """
+    p = _placeholder(db_type)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, parent_category_id FROM category")
+    parents = dict(cursor.fetchall())
+    rows = []
+    for category_id in parents:
+        # Walk up to the root; 'seen' guards against cycles in hand-edited data
+        depth, current, seen = 0, category_id, set()
+        while current is not None and current not in seen:
+            seen.add(current)
+            rows.append((current, category_id, depth))
+            current = parents.get(current)
+            depth += 1
+    cursor.execute("DELETE FROM category_closure")
+    if rows:
+        cursor.executemany(
+            f"INSERT INTO category_closure (ancestor_id, descendant_id, depth) VALUES ({p}, {p}, {p})", rows)
+    conn.commit()
+    cursor.close()
+    return len(rows)
+
+
+def ensure_category_closure(conn, db_type="mysql"):
+    """
+    Fills category_closure if it is empty but categories exist (e.g. a database created before the closure table).
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT (SELECT COUNT(*) FROM category), (SELECT COUNT(*) FROM category_closure)")
+    categories, links = cursor.fetchall()[0]
+    cursor.close()
+    if categories and not links:
+        rebuild_category_closure(conn, db_type)
+
+
+def add_category(conn, name, parent_category_id=None, db_type="mysql"):
+    """
+    Inserts a category and its closure rows: a self link plus one link per ancestor of the parent.
+    Returns the new category id.
+    """
+    p = _placeholder(db_type)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"INSERT INTO category (name, parent_category_id) VALUES ({p}, {p})",
+                       (name, parent_category_id))
+        category_id = cursor.lastrowid
+        cursor.execute(f"INSERT INTO category_closure (ancestor_id, descendant_id, depth) VALUES ({p}, {p}, 0)",
+                       (category_id, category_id))
+        if parent_category_id is not None:
+            cursor.execute(f"""
+                INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+                SELECT ancestor_id, {p}, depth + 1
+                FROM category_closure
+                WHERE descendant_id = {p}
+            """, (category_id, parent_category_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return category_id
+
+
+def move_category(conn, category_id, new_parent_id, db_type="mysql"):
+    """
+    Re-parents a category together with its whole subtree (new_parent_id=None makes it a root).
+    Only the links between the subtree and its old ancestors are dropped and re-created
+    for the new ancestors; links inside the subtree stay untouched.
+    """
+    p = _placeholder(db_type)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT descendant_id FROM category_closure WHERE ancestor_id = {p}", (category_id,))
+        subtree = [row[0] for row in cursor.fetchall()]
+        if new_parent_id in subtree:
+            raise ValueError(f"Cannot move category {category_id} below its own descendant {new_parent_id}")
+        cursor.execute(f"SELECT ancestor_id FROM category_closure WHERE descendant_id = {p} AND depth > 0",
+                       (category_id,))
+        old_ancestors = [row[0] for row in cursor.fetchall()]
+        if old_ancestors:
+            cursor.execute(f"""
+                DELETE FROM category_closure
+                WHERE descendant_id IN ({", ".join([p] * len(subtree))})
+                  AND ancestor_id IN ({", ".join([p] * len(old_ancestors))})
+            """, (*subtree, *old_ancestors))
+        if new_parent_id is not None:
+            cursor.execute(f"""
+                INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+                SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1
+                FROM category_closure above, category_closure below
+                WHERE above.descendant_id = {p} AND below.ancestor_id = {p}
+            """, (new_parent_id, category_id))
+        cursor.execute(f"UPDATE category SET parent_category_id = {p} WHERE id = {p}", (new_parent_id, category_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def fetch_subtree_recipes(conn, category_id, limit=50, after_id=None, db_type="mysql"):
+    """
+    Recipes in a category or any of its subcategories, keyset-paginated on recipe.id.
+    One query: the closure primary key yields the subtree, idx_recipe_category_id the recipes.
+    """
+    p = _placeholder(db_type)
+    after = f"AND r.id > {p}" if after_id is not None else ""
+    params = (category_id, after_id, limit) if after_id is not None else (category_id, limit)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT r.id, r.name, r.category_id
+        FROM category_closure cc
+        JOIN recipe r ON r.category_id = cc.descendant_id
+        WHERE cc.ancestor_id = {p} {after}
+        ORDER BY r.id
+        LIMIT {p}
+    """, params)
+    rows = [{"id": rid, "name": name, "category_id": cid} for rid, name, cid in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+
+def fetch_breadcrumb(conn, category_id, db_type="mysql"):
+    """
+    The path from the root down to 'category_id', as [{'id', 'name'}, ...], in one query.
+    """
+    p = _placeholder(db_type)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT c.id, c.name
+        FROM category_closure cc
+        JOIN category c ON c.id = cc.ancestor_id
+        WHERE cc.descendant_id = {p}
+        ORDER BY cc.depth DESC
+    """, (category_id,))
+    rows = [{"id": cid, "name": name} for cid, name in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+
+def fetch_subtree_recipe_counts(conn, category_id=None, db_type="mysql"):
+    """
+    Number of recipes per category including all its subcategories: {category_id: count}.
+    Without 'category_id' this covers every category in one grouped query.
+    """
+    p = _placeholder(db_type)
+    where = f"WHERE cc.ancestor_id = {p}" if category_id is not None else ""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT cc.ancestor_id, COUNT(r.id)
+        FROM category_closure cc
+        JOIN recipe r ON r.category_id = cc.descendant_id
+        {where}
+        GROUP BY cc.ancestor_id
+    """, (category_id,) if category_id is not None else ())
+    counts = dict(cursor.fetchall())
+    cursor.close()
+    return counts
+
+
+class CategoryTree:
+    """
+    In-memory copy of the category hierarchy for the UI: names, parents and children,
+    so that menus, breadcrumbs and subtree lookups need no query at all.
+    Categories change rarely; the app reloads it after writes or when older than CATEGORY_TREE_TTL.
+    """
+
+    def __init__(self, rows):
+        self.names = {}
+        self.parents = {}
+        self.children = {}
+        for category_id, name, parent_id in rows:
+            self.names[category_id] = name
+            self.parents[category_id] = parent_id
+            self.children.setdefault(parent_id, []).append(category_id)
+        for ids in self.children.values():
+            ids.sort(key=lambda cid: self.names[cid])
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def from_db(cls, conn):
+        """
+        Loads the whole hierarchy with one query; the category table is small.
+        """
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name, parent_category_id FROM category")
+        rows = cursor.fetchall()
+        cursor.close()
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.names)
+
+    def roots(self):
+        return list(self.children.get(None, []))
+
+    def breadcrumb(self, category_id):
+        path = []
+        current = category_id
+        while current is not None and current in self.names and len(path) <= len(self.names):
+            path.append({"id": current, "name": self.names[current]})
+            current = self.parents.get(current)
+        return list(reversed(path))
+
+    def subtree_ids(self, category_id):
+        ids = []
+        seen = set()
+        stack = [category_id]
+        while stack:
+            current = stack.pop()
+            # Rows written around the closure table can form a parent cycle; visit each id once
+            if current in seen:
+                continue
+            seen.add(current)
+            ids.append(current)
+            stack.extend(self.children.get(current, []))
+        return ids
+
+    def walk(self, category_id=None, depth=0):
+        """
+        Yields (depth, category_id, name) in display order, e.g. for an indented category menu.
+        """
+        for child in self.children.get(category_id, []):
+            yield depth, child, self.names[child]
+            yield from self.walk(child, depth + 1)
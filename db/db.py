@@ -1,6 +1,8 @@
 import os
-import mysql.connector
-import pandas as pd
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
 
 # Configuration for MySQL
 db_configuration = {
@@ -8,110 +10,228 @@ db_configuration = {
     "user": os.environ.get("MyDB_USER", "singleuser"),  # default user
     "password": os.environ.get("MyDB_PASSWORD", "singlepass"),  # default pass
     "database": "singlesauce",
-    "use_pure": True
+    "use_pure": True,
+    # TIMESTAMP values are read and written in UTC whatever the server's default time zone is
+    "time_zone": "+00:00",
+    # LOAD DATA LOCAL INFILE is only allowed for files spooled into this directory
+    "allow_local_infile_in_path": os.environ.get("MyDB_LOCAL_INFILE_DIR", tempfile.gettempdir()),
 }
 
 
-def bulk_insert_recipes_with_ingredients(conn, recipes_df, db_type="mysql", batch_size=1000):
+class AdaptiveBatchSizer:
+    """
+    Tunes the number of rows per batch from measured timings.
+    Every batch costs roughly 'round_trip + rows * per_row'. We want the fixed
+    round-trip part to be a small fraction ('overhead_ratio') of each batch, without
+    building statements so large that a failed batch throws away lots of work.
+    """
+
+    def __init__(self, initial=1000, min_size=50, max_size=20000, round_trip=None, overhead_ratio=0.05):
+        self.batch_size = max(min_size, min(initial, max_size))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.round_trip = round_trip
+        self.overhead_ratio = overhead_ratio
+        self.per_row = None
+
+    def record(self, rows, seconds):
+        """
+        Feeds back how long a batch of 'rows' took and adjusts batch_size for the next one.
+        """
+        if rows <= 0:
+            return self.batch_size
+        round_trip = self.round_trip or 0.0
+        per_row = max((seconds - round_trip) / rows, 1e-7)
+        # Exponential smoothing so that one slow fsync doesn't collapse the batch size
+        self.per_row = per_row if self.per_row is None else 0.7 * self.per_row + 0.3 * per_row
+        if round_trip > 0:
+            target = round_trip * (1 - self.overhead_ratio) / (self.overhead_ratio * self.per_row)
+        else:
+            target = self.batch_size * 2
+        # Never more than double or halve at once
+        target = max(self.batch_size / 2, min(target, self.batch_size * 2))
+        self.batch_size = int(max(self.min_size, min(target, self.max_size)))
+        return self.batch_size
+
+
+def measure_round_trip(conn, samples=3):
+    """
+    Measures the client/server round-trip latency with a trivial query (best of 'samples').
+    """
+    cursor = conn.cursor()
+    best = None
+    for _ in range(samples):
+        started = time.perf_counter()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    cursor.close()
+    return best
+
+
+def max_rows_per_statement(db_type, column_count):
+    """
+    Upper bound on rows in one multi-row INSERT, so we stay below SQLite's bound
+    variable limit and MySQL's max_allowed_packet with typical recipe sizes.
+    """
+    if db_type == "sqlite":
+        max_vars = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+        return max(1, max_vars // column_count)
+    return 5000
+
+
+def _column_values(df, column, default=None):
+    """
+    Returns a plain Python list for a DataFrame column, with NaN turned into None.
+    """
+    if column not in df.columns:
+        return [default] * len(df)
+    series = df[column].astype(object)
+    return series.where(series.notna(), default).tolist()
+
+
+def recipe_ingredient_rows(recipe_id, ingredients_info):
+    """
+    recipe_ingredient rows (recipe_id, ingredient_id, quantity, unit, optional) for one recipe's
+    'ingredients_info' list. (recipe_id, ingredient_id) is the primary key, so unresolved entries
+    are skipped and an ingredient listed twice (or two spellings of one) is kept once.
+    """
+    rows = []
+    if not isinstance(ingredients_info, list):
+        return rows
+    seen = set()
+    for ing in ingredients_info:
+        ingredient_id = ing.get("ingredient_id")
+        if ingredient_id is None or ingredient_id in seen:
+            continue
+        seen.add(ingredient_id)
+        rows.append((recipe_id, ingredient_id, ing.get("quantity", ""), ing.get("unit", ""), ing.get("optional", False)))
+    return rows
+
+
+def bulk_insert_recipes_with_ingredients(conn, recipes_df, db_type="mysql", batch_size=1000, adaptive=True):
     """
     Bulk insert to handle large volumes of recipe data AND their ingredient references.
     Expecting 'recipes_df' to have columns at least for:
       - name, instructions, cooking_time_minutes, etc. (for recipe)
       - some representation of ingredients (e.g. 'ingredients_info'), which might be
         a list of dicts or a string we can parse.
-    We'll:
-      1) Insert the 'recipe' row
-      2) Retrieve the newly generated recipe.id
-      3) Parse 'ingredients_info' to insert bridging rows into 'recipe_ingredient'
-    """
-    recipe_insert_sql_mysql = """
-        INSERT INTO recipe (
-            name, instructions, cooking_time_minutes
-        )
-        VALUES (%s, %s, %s)
-    """
-    recipe_insert_sql_sqlite = """
-        INSERT INTO recipe (
-            name, instructions, cooking_time_minutes
-        )
-        VALUES (?, ?, ?)
+    Recipes are upserted on 'content_hash' like db.bulk_load.bulk_load_recipes does (frames
+    without one get it from etl.transform.add_content_hashes), so inserting the same frame
+    again adds nothing.
+    For every batch we:
+      1) Insert all its 'recipe' rows with one multi-row INSERT, skipping the ones already stored
+      2) Read the ids of the batch back by content_hash, inserted now or before
+      3) Insert the bridging rows of the batch into 'recipe_ingredient', skipping existing ones
+      4) Commit once, so a batch costs one transaction instead of one per recipe
+    With adaptive=True, 'batch_size' is only the starting point and gets tuned from the
+    measured round-trip latency. Returns the recipe ids in DataFrame order.
     """
+    if "content_hash" not in recipes_df.columns:
+        from etl.transform import add_content_hashes
+
+        recipes_df = add_content_hashes(recipes_df.copy())
+    columns = ("name", "instructions", "cooking_time_minutes", "content_hash")
+    placeholder = "%s" if db_type == "mysql" else "?"
+    row_placeholders = "(" + ", ".join([placeholder] * len(columns)) + ")"
+    if db_type == "mysql":
+        skip_stored = "ON DUPLICATE KEY UPDATE content_hash = content_hash"
+        skip_bridging = "ON DUPLICATE KEY UPDATE recipe_id = recipe_id"
+    else:
+        skip_stored = "ON CONFLICT (content_hash) DO NOTHING"
+        skip_bridging = "ON CONFLICT (recipe_id, ingredient_id) DO NOTHING"
     # For bridging table
-    recipe_ingredient_insert_sql_mysql = """
-        INSERT INTO recipe_ingredient (
-            recipe_id, ingredient_id,
-            quantity, unit, optional
-        )
-        VALUES (%s, %s, %s, %s, %s)
-    """
-    recipe_ingredient_insert_sql_sqlite = """
+    recipe_ingredient_insert_sql = f"""
         INSERT INTO recipe_ingredient (
             recipe_id, ingredient_id,
             quantity, unit, optional
         )
-        VALUES (?, ?, ?, ?, ?)
+        VALUES ({", ".join([placeholder] * 5)})
+        {skip_bridging}
     """
-    # Deciding which queries to use depending on db_type
-    if db_type == "mysql":
-        recipe_insert_sql = recipe_insert_sql_mysql
-        recipe_ingredient_insert_sql = recipe_ingredient_insert_sql_mysql
-    else:
-        recipe_insert_sql = recipe_insert_sql_sqlite
-        recipe_ingredient_insert_sql = recipe_ingredient_insert_sql_sqlite
+    recipe_rows = list(zip(
+        _column_values(recipes_df, "name", ""),
+        _column_values(recipes_df, "instructions", ""),
+        _column_values(recipes_df, "cooking_time_minutes", None),
+        _column_values(recipes_df, "content_hash", None),
+    ))
+    ingredients_column = _column_values(recipes_df, "ingredients_info", None)
+    max_rows = max_rows_per_statement(db_type, len(columns))
+    sizer = None
+    if adaptive and recipe_rows:
+        sizer = AdaptiveBatchSizer(initial=batch_size, max_size=max_rows, round_trip=measure_round_trip(conn))
     cursor = conn.cursor()
-    recipe_data_buffer = []
-    bridging_data_buffer = []
-    count = 0
-    for _, row in recipes_df.iterrows():
-        recipe_name = row.get("name", "")
-        recipe_instructions = row.get("instructions", "")
-        recipe_time = row.get("cooking_time_minutes", None)
-        # 1) Inserting the recipe
-        cursor.execute(recipe_insert_sql, (recipe_name, recipe_instructions, recipe_time))
-        conn.commit()  # Committing so we can retrieve the new primary key
-        # 2) Retrieving the newly generated recipe.id
-        new_recipe_id = cursor.lastrowid
-        # 3) Suppose the row has 'ingredients_info' describing the bridging data
-        # e.g. a list of dicts or a string. We'll do a minimal example:
-        ingredients_info = row.get("ingredients_info", "")
-        # If it's a string like "ingredient_id=3,quantity=2 tbsp; ingredient_id=7,quantity=100 g"
-        # we'd parse it. Or if it's a Python list (when read from JSON), we will handle that logic here.
-        # PLACEHOLDER for handling Python-list logic here
-        # Let's assume it's a list of dicts for demonstration:
-        # e.g. row["ingredients_info"] = [
-        #   {"ingredient_id":3, "quantity":"2", "unit":"tbsp", "optional":False},
-        #   {"ingredient_id":7, "quantity":"100", "unit":"g", "optional":True}
-        # ]
-        if isinstance(ingredients_info, list):
-            for ing in ingredients_info:
-                ingredient_id = ing.get("ingredient_id")
-                quantity = ing.get("quantity", "")
-                unit = ing.get("unit", "")
-                optional = ing.get("optional", False)
-                bridging_data_buffer.append((
-                    new_recipe_id,
-                    ingredient_id,
-                    quantity,
-                    unit,
-                    optional
-                ))
-        # If bridging_data_buffer grows large, flush it
-        if len(bridging_data_buffer) >= batch_size:
-            cursor.executemany(recipe_ingredient_insert_sql, bridging_data_buffer)
+    new_ids = []
+    inserted = 0
+    batches = 0
+    position = 0
+    while position < len(recipe_rows):
+        size = min(sizer.batch_size if sizer else batch_size, max_rows)
+        batch = recipe_rows[position:position + size]
+        started = time.perf_counter()
+        try:
+            if db_type == "sqlite" and not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            # 1) Inserting the recipes of this batch
+            cursor.execute(
+                f"INSERT INTO recipe ({', '.join(columns)}) VALUES "
+                + ", ".join([row_placeholders] * len(batch)) + f" {skip_stored}",
+                [value for row in batch for value in row]
+            )
+            # MySQL counts a row the upsert left alone as 0, SQLite does not count it
+            inserted += max(cursor.rowcount, 0)
+            # 2) Skipped rows leave gaps, so the ids are looked up rather than derived from lastrowid
+            hashes = sorted({row[3] for row in batch})
+            cursor.execute(f"SELECT id, content_hash FROM recipe "
+                           f"WHERE content_hash IN ({', '.join([placeholder] * len(hashes))})", hashes)
+            ids_by_hash = {content_hash: recipe_id for recipe_id, content_hash in cursor.fetchall()}
+            batch_ids = [ids_by_hash[row[3]] for row in batch]
+            # 3) Bridging rows, e.g. row["ingredients_info"] = [
+            #   {"ingredient_id":3, "quantity":"2", "unit":"tbsp", "optional":False},
+            #   {"ingredient_id":7, "quantity":"100", "unit":"g", "optional":True}
+            # ]
+            bridging_rows = []
+            for recipe_id, ingredients_info in zip(batch_ids, ingredients_column[position:position + size]):
+                bridging_rows.extend(recipe_ingredient_rows(recipe_id, ingredients_info))
+            if bridging_rows:
+                cursor.executemany(recipe_ingredient_insert_sql, bridging_rows)
+            # 4) One commit per batch
             conn.commit()
-            bridging_data_buffer = []
-        count += 1
-    # After loop ends, we flush any remaining bridging rows
-    if bridging_data_buffer:
-        cursor.executemany(recipe_ingredient_insert_sql, bridging_data_buffer)
-        conn.commit()
-    print(f"Bulk insert complete: {count} recipes inserted (plus bridging data).")
+        except Exception:
+            conn.rollback()
+            cursor.close()
+            raise
+        if sizer:
+            sizer.record(len(batch), time.perf_counter() - started)
+        new_ids.extend(batch_ids)
+        position += len(batch)
+        batches += 1
+    print(f"Bulk insert complete: {inserted} of {len(new_ids)} recipes inserted (plus bridging data) "
+          f"in {batches} batches.")
     cursor.close()
+    return new_ids
+
+
+RECIPE_FETCH_COLUMNS = (
+    "id", "name", "name_es", "instructions", "cooking_time_minutes", "difficulty",
+    "source", "created_at", "category_id", "user_id", "recipe_story_id",
+)
 
 
-def fetch_recipes_with_ingredients(conn, limit=10):
+def fetch_recipes_with_ingredients(conn, limit=10, after_id=None, db_type="mysql", fetch_size=500,
+                                   columns=RECIPE_FETCH_COLUMNS, with_ingredients=True,
+                                   order_by="id", after_created_at=None):
     """
-    Fetch recipes and their ingredient bridging info, returning a nested structure.
+    Fetch one page of recipes and their ingredient bridging info, returning a nested structure.
+    Pages are keyset-paginated on recipe.id: pass the id of the last recipe of the previous
+    page as 'after_id' to get the next one. 'limit' counts recipes, not joined rows, so a
+    recipe is never cut off in the middle of its ingredient list.
+    With order_by="created_at" pages follow (created_at, id) instead (served by
+    idx_recipe_created_at); pass the last recipe's created_at as 'after_created_at' as well.
+    Recipes without created_at are skipped in that order.
+    'columns' limits the recipe columns read (id, and created_at when ordering by it, are
+    always included); with_ingredients=False skips the second query and the 'ingredients' key.
     Example return:
     [
       {
@@ -139,76 +259,153 @@ def fetch_recipes_with_ingredients(conn, limit=10):
       ...
     ]
     """
-    cursor = conn.cursor(dictionary=True)
-    # We'll do a 3-way LEFT JOIN because we want
-    #  - all columns from recipe
-    #  - bridging data from recipe_ingredient
-    #  - ingredient name from ingredient
-    query = """
+    placeholder = "%s" if db_type == "mysql" else "?"
+    if order_by not in ("id", "created_at"):
+        raise ValueError(f"Unsupported recipe order: {order_by}")
+    required = ("id", "created_at") if order_by == "created_at" else ("id",)
+    unknown = set(columns) - set(RECIPE_FETCH_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown recipe columns: {sorted(unknown)}")
+    columns = list(required) + [c for c in columns if c not in required]
+    cursor = conn.cursor()
+    # Phase 1: the page of recipes, walking the primary key (or created_at, id) from the last one seen
+    if order_by == "created_at":
+        where = "WHERE created_at IS NOT NULL"
+        params = ()
+        if after_created_at is not None:
+            where += f" AND (created_at > {placeholder} OR (created_at = {placeholder} AND id > {placeholder}))"
+            params = (after_created_at, after_created_at, after_id if after_id is not None else 0)
+        order = "created_at, id"
+    else:
+        where = f"WHERE id > {placeholder}" if after_id is not None else ""
+        params = (after_id,) if after_id is not None else ()
+        order = "id"
+    cursor.execute(f"""
+        SELECT {", ".join(columns)}
+        FROM recipe
+        {where}
+        ORDER BY {order}
+        LIMIT {placeholder}
+    """, params + (limit,))
+    recipe_dict = {}
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        for row in rows:
+            recipe = dict(zip(columns, row))
+            if with_ingredients:
+                recipe["ingredients"] = []
+            recipe_dict[recipe["id"]] = recipe
+    if not recipe_dict or not with_ingredients:
+        cursor.close()
+        return list(recipe_dict.values())
+    # Phase 2: bridging data + ingredient names for exactly these recipes, in one IN-list query.
+    # Rows are streamed with fetchmany, so memory is bounded by the page, not by the table.
+    cursor.execute(f"""
         SELECT
-            r.id AS recipe_id,
-            r.name AS recipe_name,
-            r.name_es,
-            r.instructions,
-            r.cooking_time_minutes,
-            r.difficulty,
-            r.source,
-            r.created_at,
-            r.category_id,
-            r.user_id,
-            r.recipe_story_id,
+            ri.recipe_id,
             ri.ingredient_id,
             ri.quantity,
             ri.unit,
             ri.optional,
             ing.name AS ingredient_name
-        FROM recipe r
-        LEFT JOIN recipe_ingredient ri ON r.id = ri.recipe_id
+        FROM recipe_ingredient ri
         LEFT JOIN ingredient ing ON ri.ingredient_id = ing.id
-        LIMIT %s
-    """
-    cursor.execute(query, (limit,))
-    rows = cursor.fetchall()
-    cursor.close()
-    # We'll group the rows by recipe_id
-    recipe_dict = {}
-    for row in rows:
-        rid = row["recipe_id"]
-        if rid not in recipe_dict:
-            # Create a new recipe entry in the grouping structure
-            recipe_dict[rid] = {
-                "id": rid,
-                "name": row["recipe_name"],
-                "name_es": row["name_es"],
-                "instructions": row["instructions"],
-                "cooking_time_minutes": row["cooking_time_minutes"],
-                "difficulty": row["difficulty"],
-                "source": row["source"],
-                "created_at": row["created_at"],
-                "category_id": row["category_id"],
-                "user_id": row["user_id"],
-                "recipe_story_id": row["recipe_story_id"],
-                "ingredients": []
-            }
-        # If ingredient_id is None, it means no bridging row
-        if row["ingredient_id"] is not None:
-            recipe_dict[rid]["ingredients"].append({
-                "ingredient_id": row["ingredient_id"],
-                "ingredient_name": row["ingredient_name"],
-                "quantity": row["quantity"],
-                "unit": row["unit"],
-                "optional": bool(row["optional"]) if row["optional"] is not None else False
+        WHERE ri.recipe_id IN ({", ".join([placeholder] * len(recipe_dict))})
+        ORDER BY ri.recipe_id, ri.ingredient_id
+    """, tuple(recipe_dict))
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        for recipe_id, ingredient_id, quantity, unit, optional, ingredient_name in rows:
+            recipe_dict[recipe_id]["ingredients"].append({
+                "ingredient_id": ingredient_id,
+                "ingredient_name": ingredient_name,
+                "quantity": quantity,
+                "unit": unit,
+                "optional": bool(optional) if optional is not None else False
             })
-    # Converting the dict to a list
+    cursor.close()
+    # Dicts keep insertion order, which is the id order of phase 1
     recipe_list = list(recipe_dict.values())
     return recipe_list
 
 
+def iter_recipes_with_ingredients(conn, after_id=None, db_type="mysql", page_size=500, **kwargs):
+    """
+    Yields recipes page by page through fetch_recipes_with_ingredients, for exports of any size:
+    memory holds one page, never the whole result. Accepts the same ordering/column arguments.
+    """
+    after_created_at = kwargs.pop("after_created_at", None)
+    while True:
+        page = fetch_recipes_with_ingredients(conn, limit=page_size, after_id=after_id, db_type=db_type,
+                                              after_created_at=after_created_at, **kwargs)
+        yield from page
+        if len(page) < page_size:
+            return
+        after_id = page[-1]["id"]
+        after_created_at = page[-1].get("created_at")
+
+
+# Tables the generic keyset reader may page through, with the columns it may return
+KEYSET_TABLES = {
+    "ingredient": ("id", "name", "description", "flavor_profile_id", "health_data_id"),
+    "category": ("id", "name", "parent_category_id"),
+}
+
+
+def fetch_rows_after(conn, table, columns=None, after_id=None, limit=100, db_type="mysql"):
+    """
+    One keyset page of a simple table (see KEYSET_TABLES) as dicts, in id order.
+    """
+    allowed = KEYSET_TABLES[table]
+    columns = ["id"] + [c for c in (columns or allowed) if c != "id"]
+    unknown = set(columns) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown {table} columns: {sorted(unknown)}")
+    placeholder = "%s" if db_type == "mysql" else "?"
+    where = f"WHERE id > {placeholder}" if after_id is not None else ""
+    params = (after_id, limit) if after_id is not None else (limit,)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY id LIMIT {placeholder}", params)
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+
+def table_fingerprint(conn, table="recipe", db_type="mysql"):
+    """
+    Version of a table with an 'id' column that is in SYNC_TABLES: (seq, changed_at, max id).
+    seq and changed_at belong to the table's newest sync_change_log entry, which the change-log
+    triggers (see sync/change_log.py, install_change_log) write on every insert, update and delete,
+    whichever process makes it. MAX(id) keeps the version from going back to an earlier one
+    once prune_change_log has removed the table's entries. Both are one index descent, so reading
+    it costs the same at any table size. changed_at is a naive UTC datetime, or None.
+    """
+    p = "%s" if db_type == "mysql" else "?"
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT seq, changed_at FROM sync_change_log WHERE table_name = {p} ORDER BY seq DESC LIMIT 1",
+                   (table,))
+    rows = cursor.fetchall()
+    seq, changed_at = rows[0] if rows else (None, None)
+    cursor.execute(f"SELECT MAX(id) FROM {table}")
+    max_id = cursor.fetchall()[0][0]
+    cursor.close()
+    if isinstance(changed_at, str):
+        # SQLite keeps it as text
+        changed_at = datetime.fromisoformat(changed_at)
+    return seq, changed_at, max_id
+
+
 def fetch_data_from_csv(csvpath):
     """
     Simple CSV loader using pandas.
     """
     if os.path.exists(csvpath):
+        import pandas as pd
+
         return pd.read_csv(csvpath)
     else:
         print(f"File {csvpath} not found.")
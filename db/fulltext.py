@@ -0,0 +1,202 @@
+import html
+import logging
+import re
+import sqlite3
+
+# Columns covered by the full-text index, with their BM25 weights (a hit in the name counts most)
+FULLTEXT_COLUMNS = ("name", "name_es", "instructions")
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+SNIPPET_WORDS = 12
+
+# Private-use markers around matches; swapped for <mark> after HTML-escaping the text
+# (or for [b] after escaping Kivy markup)
+_OPEN, _CLOSE = "\x02", "\x03"
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Kivy markup escapes, as kivy.utils.escape_markup; '&' first
+_KIVY_ESCAPES = (("&", "&amp;"), ("[", "&bl;"), ("]", "&br;"))
+
+logger = logging.getLogger("data")
+
+sqlite_fulltext_statements = [
+    # External-content FTS5 table: the text lives only in 'recipe', FTS5 keeps the inverted index
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS recipe_fts USING fts5(
+        name, name_es, instructions,
+        content='recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS recipe_fts_ai AFTER INSERT ON recipe BEGIN
+        INSERT INTO recipe_fts (rowid, name, name_es, instructions)
+        VALUES (new.id, new.name, new.name_es, new.instructions);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS recipe_fts_ad AFTER DELETE ON recipe BEGIN
+        INSERT INTO recipe_fts (recipe_fts, rowid, name, name_es, instructions)
+        VALUES ('delete', old.id, old.name, old.name_es, old.instructions);
+    END;
+    """,
+    # Also fires when a recipe is renumbered (sync gives offline-created recipes their remote id);
+    # dropped first so databases with the older trigger pick that up
+    "DROP TRIGGER IF EXISTS recipe_fts_au;",
+    """
+    CREATE TRIGGER IF NOT EXISTS recipe_fts_au AFTER UPDATE OF id, name, name_es, instructions ON recipe BEGIN
+        INSERT INTO recipe_fts (recipe_fts, rowid, name, name_es, instructions)
+        VALUES ('delete', old.id, old.name, old.name_es, old.instructions);
+        INSERT INTO recipe_fts (rowid, name, name_es, instructions)
+        VALUES (new.id, new.name, new.name_es, new.instructions);
+    END;
+    """,
+]
+
+
+def create_fulltext_index(conn, db_type="mysql"):
+    """
+    Sets up full-text search over recipe.name, name_es and instructions:
+      - SQLite: an FTS5 table kept in sync by triggers (filled from existing rows on creation)
+      - MySQL: a FULLTEXT index on the recipe table
+    Returns False if the SQLite build has no FTS5; search_recipes then falls back to LIKE.
+    """
+    cursor = conn.cursor()
+    if db_type == "mysql":
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'recipe' AND index_name = 'ft_recipe_text'
+        """)
+        if cursor.fetchall()[0][0] == 0:
+            cursor.execute(f"ALTER TABLE recipe ADD FULLTEXT INDEX ft_recipe_text ({', '.join(FULLTEXT_COLUMNS)})")
+    else:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'recipe_fts'")
+        existed = cursor.fetchone() is not None
+        try:
+            for statement in sqlite_fulltext_statements:
+                cursor.execute(statement.strip())
+        except sqlite3.OperationalError as err:
+            logger.warning(f"Full-text search unavailable in this SQLite build ({err}); searches will use LIKE.")
+            cursor.close()
+            return False
+        if not existed:
+            cursor.execute("INSERT INTO recipe_fts (recipe_fts) VALUES ('rebuild')")
+    conn.commit()
+    cursor.close()
+    return True
+
+
+def _terms(query):
+    return _TOKEN_RE.findall(query.lower())
+
+
+def _fts5_query(terms):
+    # Every term quoted, so user input can't inject FTS5 syntax; the last one as a prefix
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _render_snippet(marked, markup="html"):
+    """
+    Escapes a snippet that carries _OPEN/_CLOSE markers and turns those into highlight tags:
+    <mark> for markup='html', [b] for markup='kivy' (a Label with markup=True).
+    """
+    if markup == "kivy":
+        for raw, escaped in _KIVY_ESCAPES:
+            marked = marked.replace(raw, escaped)
+        return marked.replace(_OPEN, "[b]").replace(_CLOSE, "[/b]")
+    return html.escape(marked).replace(_OPEN, "<mark>").replace(_CLOSE, "</mark>")
+
+
+def highlight_snippet(text, terms, words=SNIPPET_WORDS):
+    """
+    Python counterpart of FTS5's snippet(): a window of about 'words' words around the first
+    match in 'text', matches wrapped in markers. Used where the database cannot do it (MySQL).
+    """
+    if not text:
+        return ""
+    tokens = text.split()
+    lowered = [_TOKEN_RE.findall(token.lower()) for token in tokens]
+
+    def is_hit(parts):
+        return any(part.startswith(term) for part in parts for term in terms)
+
+    first = next((i for i, parts in enumerate(lowered) if is_hit(parts)), 0)
+    start = max(0, first - words // 3)
+    end = min(len(tokens), start + words)
+    window = [
+        f"{_OPEN}{token}{_CLOSE}" if is_hit(lowered[i]) else token
+        for i, token in enumerate(tokens[start:end], start)
+    ]
+    return ("…" if start > 0 else "") + " ".join(window) + ("…" if end < len(tokens) else "")
+
+
+def search_recipes(conn, query, db_type="mysql", limit=20, offset=0, markup="html"):
+    """
+    Full-text search over recipe names and instructions, best matches first.
+    Returns a list of dicts: {'id', 'name', 'name_es', 'score', 'snippet'}, where 'snippet'
+    is HTML-safe text with the matched words wrapped in <mark> (with markup='kivy': Kivy
+    markup with them in [b]). Higher score = better match.
+    Page through results with 'limit' and 'offset'.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    cursor = conn.cursor()
+    if db_type == "mysql":
+        # InnoDB FULLTEXT relevance is a TF-IDF (BM25-like) score
+        match = f"MATCH ({', '.join(FULLTEXT_COLUMNS)}) AGAINST (%s IN BOOLEAN MODE)"
+        boolean_query = " ".join(term + "*" for term in terms)
+        cursor.execute(f"""
+            SELECT id, name, name_es, instructions, {match} AS score
+            FROM recipe
+            WHERE {match}
+            ORDER BY score DESC, id
+            LIMIT %s OFFSET %s
+        """, (boolean_query, boolean_query, limit, offset))
+        rows = [
+            (rid, name, name_es, score, highlight_snippet(instructions or name, terms))
+            for rid, name, name_es, instructions, score in cursor.fetchall()
+        ]
+    else:
+        weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+        fts_query = _fts5_query(terms)
+        try:
+            # Rank first; SQLite would otherwise build a snippet for every match before sorting
+            cursor.execute(f"""
+                SELECT rowid, -bm25(recipe_fts, {weights}) AS score
+                FROM recipe_fts
+                WHERE recipe_fts MATCH ?
+                ORDER BY bm25(recipe_fts, {weights}), rowid
+                LIMIT ? OFFSET ?
+            """, (fts_query, limit, offset))
+            ranked = cursor.fetchall()
+            rows = []
+            if ranked:
+                # ... then fetch names and snippets for just this page
+                cursor.execute(f"""
+                    SELECT r.id, r.name, r.name_es,
+                           snippet(recipe_fts, -1, '{_OPEN}', '{_CLOSE}', '…', {SNIPPET_WORDS})
+                    FROM recipe_fts
+                    JOIN recipe r ON r.id = recipe_fts.rowid
+                    WHERE recipe_fts MATCH ? AND recipe_fts.rowid IN ({", ".join("?" * len(ranked))})
+                """, (fts_query, *[rid for rid, _ in ranked]))
+                details = {rid: (name, name_es, snippet) for rid, name, name_es, snippet in cursor.fetchall()}
+                rows = [(rid, *details[rid][:2], score, details[rid][2]) for rid, score in ranked if rid in details]
+        except sqlite3.OperationalError:
+            # No FTS5 table (e.g. SQLite built without FTS5): unranked LIKE scan
+            like = "%" + "%".join(terms) + "%"
+            cursor.execute("""
+                SELECT id, name, name_es, 0.0, instructions
+                FROM recipe
+                WHERE name LIKE ? OR name_es LIKE ? OR instructions LIKE ?
+                ORDER BY id
+                LIMIT ? OFFSET ?
+            """, (like, like, like, limit, offset))
+            rows = [(rid, name, name_es, score, highlight_snippet(text or name, terms))
+                    for rid, name, name_es, score, text in cursor.fetchall()]
+    cursor.close()
+    return [
+        {"id": rid, "name": name, "name_es": name_es, "score": float(score),
+         "snippet": _render_snippet(snippet or "", markup)}
+        for rid, name, name_es, score, snippet in rows
+    ]
@@ -1,19 +1,374 @@
+import logging
 import os
-import mysql.connector
+import queue
 import sqlite3
+import threading
+import time
+import weakref
 
+# Pool tuning, overridable per deployment through the environment
+POOL_SIZE = int(os.environ.get("MyDB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.environ.get("MyDB_POOL_MAX_OVERFLOW", "5"))
+POOL_TIMEOUT = float(os.environ.get("MyDB_POOL_TIMEOUT", "30"))
+POOL_MAX_LIFETIME = float(os.environ.get("MyDB_POOL_MAX_LIFETIME", "1800"))
+POOL_PING_AFTER = float(os.environ.get("MyDB_POOL_PING_AFTER", "30"))
 
-def get_db_connection(db_type, db_config):
+_pools = {}
+_pools_lock = threading.Lock()
+
+logger = logging.getLogger("data")
+
+
+def _mysql_connect(**config):
+    import mysql.connector
+
+    return mysql.connector.connect(**config)
+
+
+def _release_leaked(pool, raw):
+    logger.warning(f"A {type(pool).__name__} connection was dropped without close(); returning it to the pool.")
+    pool.release(raw)
+
+
+class PooledConnection:
     """
-    Returns a database connection object based on db_type.
+    Thin proxy around a raw DB-API connection handed out by a pool.
+    Everything (cursor, commit, rollback, ...) is delegated to the raw connection,
+    except close(), which gives the connection back to its pool instead of
+    tearing down the socket. Existing 'conn.close()' call sites therefore keep working.
+    A proxy garbage-collected without close() gives its connection back too, with a warning,
+    so a forgotten close() costs a log line rather than a pool slot.
+    """
+
+    def __init__(self, raw, pool):
+        self._raw = raw
+        self._pool = pool
+        # Holds the pool and the raw connection, not the proxy, so the proxy can still be collected
+        self._leak_guard = weakref.finalize(self, _release_leaked, pool, raw)
+        # A checkout still open at interpreter exit is not a leak worth reporting
+        self._leak_guard.atexit = False
+
+    def __getattr__(self, item):
+        if self._raw is None:
+            raise self._pool.closed_error("Connection already returned to the pool.")
+        return getattr(self._raw, item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._leak_guard.detach()
+            self._pool.release(raw)
+
+
+class MySQLConnectionPool:
+    """
+    Bounded pool of MySQL connections.
+      - keeps up to 'pool_size' idle connections around, and allows 'max_overflow'
+        extra ones under bursts (they are closed instead of pooled when released)
+      - blocks up to 'timeout' seconds when everything is checked out
+      - recycles connections older than 'max_lifetime' seconds
+      - pings connections that sat idle longer than 'ping_after' seconds before handing them out
+    """
+
+    def __init__(self, db_config, pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                 timeout=POOL_TIMEOUT, max_lifetime=POOL_MAX_LIFETIME,
+                 ping_after=POOL_PING_AFTER, connect=None):
+        self.db_config = dict(db_config)
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        # MySQL Connector is imported with the first connection, not with this module
+        self._connect = connect or _mysql_connect
+        # LIFO so the warmest connections get reused and the cold ones can age out
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # Bookkeeping per raw connection: id(raw) -> (created_at, last_released_at)
+        self._meta = {}
+        self._open = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._discarded = 0
+
+    @staticmethod
+    def closed_error(message):
+        """
+        The error for using a connection after close(), of the driver's own kind.
+        """
+        import mysql.connector
+
+        return mysql.connector.errors.OperationalError(message)
+
+    def _new_connection(self):
+        raw = self._connect(**self.db_config)
+        now = time.monotonic()
+        with self._lock:
+            self._meta[id(raw)] = (now, now)
+            self._created += 1
+        return raw
+
+    def _drop(self, raw, recycled=False):
+        with self._lock:
+            self._meta.pop(id(raw), None)
+            self._open -= 1
+            if recycled:
+                self._recycled += 1
+            else:
+                self._discarded += 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _usable(self, raw):
+        created_at, released_at = self._meta.get(id(raw), (0.0, 0.0))
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            self._drop(raw, recycled=True)
+            return False
+        if now - released_at > self.ping_after:
+            try:
+                # is_connected() pings the server without reconnecting
+                if not raw.is_connected():
+                    self._drop(raw)
+                    return False
+            except Exception:
+                self._drop(raw)
+                return False
+        return True
+
+    def acquire(self):
+        """
+        Checks a connection out of the pool, opening a new one if there is room.
+        Raises mysql.connector.errors.PoolError if none becomes available within 'timeout'.
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            raw = None
+            try:
+                raw = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._open < self.pool_size + self.max_overflow
+                    if can_open:
+                        self._open += 1
+                if can_open:
+                    try:
+                        raw = self._new_connection()
+                    except Exception:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        with self._lock:
+                            self._timeouts += 1
+                        import mysql.connector
+
+                        raise mysql.connector.errors.PoolError(
+                            f"No MySQL connection available within {self.timeout} seconds.")
+                    try:
+                        raw = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        continue
+                    if not self._usable(raw):
+                        continue
+            else:
+                if not self._usable(raw):
+                    continue
+            waited = time.monotonic() - start
+            with self._lock:
+                self._in_use += 1
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return PooledConnection(raw, self)
+
+    def release(self, raw):
+        """
+        Puts a connection back into the pool. Open transactions are rolled back,
+        just like closing a plain connection would discard them.
+        """
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if getattr(raw, "in_transaction", False):
+                raw.rollback()
+        except Exception:
+            self._drop(raw)
+            return
+        created_at, _ = self._meta.get(id(raw), (0.0, 0.0))
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            self._drop(raw, recycled=True)
+        elif self._idle.qsize() >= self.pool_size:
+            # Overflow connection: not worth keeping around once the burst is over
+            self._drop(raw)
+        else:
+            with self._lock:
+                self._meta[id(raw)] = (created_at, now)
+            self._idle.put(raw)
+
+    def close(self):
+        while True:
+            try:
+                raw = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._drop(raw)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "db_type": "mysql",
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "wait_total_s": self._wait_total,
+                "wait_avg_s": self._wait_total / self._checkouts if self._checkouts else 0.0,
+                "wait_max_s": self._wait_max,
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "discarded": self._discarded,
+            }
+
+
+class SQLiteConnectionManager:
+    """
+    Hands out one reusable SQLite connection per thread for a given database file.
+    SQLite connections are cheap to keep but not safe to share across threads,
+    so every thread keeps its own and gets it back on each checkout. Nested checkouts in one
+    thread therefore share the connection: only the outermost release rolls back what is left
+    uncommitted, so closing an inner one does not discard the outer caller's transaction.
     """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        # Open checkouts per connection, id(raw) -> count. Not thread-local: a leaked checkout
+        # may be collected, and so released, on another thread
+        self._depth = {}
+        self._checkouts = 0
+        self._in_use = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self):
+        start = time.monotonic()
+        raw = getattr(self._local, "conn", None)
+        if raw is None:
+            raw = sqlite3.connect(self.db_path)
+            # Enabling foreign key constraints:
+            raw.execute("PRAGMA foreign_keys = ON")
+            self._local.conn = raw
+            with self._lock:
+                self._connections.append(raw)
+        waited = time.monotonic() - start
+        with self._lock:
+            self._depth[id(raw)] = self._depth.get(id(raw), 0) + 1
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return PooledConnection(raw, self)
+
+    @staticmethod
+    def closed_error(message):
+        return sqlite3.ProgrammingError(message)
+
+    def release(self, raw):
+        with self._lock:
+            self._in_use -= 1
+            depth = self._depth[id(raw)] = self._depth.get(id(raw), 1) - 1
+        # Only the owning thread may touch the connection; its own next outermost release rolls back instead
+        if depth == 0 and getattr(self._local, "conn", None) is raw and raw.in_transaction:
+            raw.rollback()
+
+    def close(self):
+        # Only the owning thread may close its connection; the rest are dropped with their threads
+        raw = getattr(self._local, "conn", None)
+        if raw is not None:
+            self._local.conn = None
+            with self._lock:
+                self._connections.remove(raw)
+                self._depth.pop(id(raw), None)
+            raw.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "db_type": "sqlite",
+                "db_path": self.db_path,
+                "open": len(self._connections),
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "wait_total_s": self._wait_total,
+                "wait_avg_s": self._wait_total / self._checkouts if self._checkouts else 0.0,
+                "wait_max_s": self._wait_max,
+            }
+
+
+def _get_pool(db_type, db_config):
     if db_type == "mysql":
-        return mysql.connector.connect(**db_config)
+        key = ("mysql",) + tuple(sorted(db_config.items()))
+        factory = lambda: MySQLConnectionPool(db_config)
     elif db_type == "sqlite":
         db_path = os.environ.get("LOCAL_DB_PATH", "local_recipes.sqlite")
-        conn = sqlite3.connect(db_path)
-        # Enabling foreign key constraints:
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+        key = ("sqlite", os.path.abspath(db_path) if db_path != ":memory:" else db_path)
+        factory = lambda: SQLiteConnectionManager(db_path)
     else:
         raise ValueError(f"Unsupported DB type: {db_type}")
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = factory()
+    return pool
+
+
+def get_db_connection(db_type, db_config):
+    """
+    Returns a database connection object based on db_type.
+    Connections come from a shared pool (MySQL) or a per-thread cache (SQLite);
+    calling close() on them hands them back instead of disconnecting.
+    """
+    return _get_pool(db_type, db_config).acquire()
+
+
+def get_pool_stats():
+    """
+    Returns checkout-wait and usage statistics for every pool created so far.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+def close_all_pools():
+    """
+    Closes the idle connections of every pool, e.g. before forking or at shutdown.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,283 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from db.db import recipe_ingredient_rows
+
+# Seconds before an app-held index is rebuilt, to pick up inserts made by other processes
+INGREDIENT_INDEX_TTL = float(os.environ.get("INGREDIENT_INDEX_TTL", "300"))
+
+# Bit positions set in each byte value, for turning bitmaps back into id lists
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def _bitmap_to_ids(bitmap):
+    """
+    Returns the positions of the set bits of an int bitmap, ascending.
+    """
+    ids = []
+    raw = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for position, byte in enumerate(raw):
+        if byte:
+            base = position * 8
+            ids.extend(base + bit for bit in _BYTE_BITS[byte])
+    return ids
+
+
+def _ids_to_bitmap(ids, nbits):
+    raw = bytearray((nbits + 7) // 8)
+    for recipe_id in ids:
+        raw[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(raw, "little")
+
+
+def _bit(raw, recipe_id):
+    position = recipe_id >> 3
+    return raw[position] >> (recipe_id & 7) & 1 if position < len(raw) else 0
+
+
+class IngredientIndex:
+    """
+    In-process inverted index: ingredient_id -> set of recipe ids using it.
+    Each posting list is stored in whichever form is smaller:
+      - a sorted array('I') of recipe ids for rare ingredients (4 bytes per recipe)
+      - an int bitmap over the recipe id space for common ones (1 bit per recipe id)
+    AND / OR are plain big-int bitwise operations. For "what can I cook" queries the
+    per-recipe counts are kept bit-sliced (one bitmap per bit of the count), so
+    matching, subtracting and comparing counts for every recipe at once is a handful
+    of bitwise operations instead of a Python loop over recipes.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        # recipe_id -> number of ingredients, plain and bit-sliced
+        self._sizes = array("H")
+        self._size_planes = []
+        self._nbits = 0
+        self._lock = threading.RLock()
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def from_db(cls, conn, fetch_size=10000):
+        """
+        Builds the index from recipe_ingredient in one streamed pass.
+        The ORDER BY is served by idx_recipe_ingredient_ingredient_id.
+        """
+        index = cls()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT ingredient_id, recipe_id
+            FROM recipe_ingredient
+            ORDER BY ingredient_id, recipe_id
+        """)
+        grouped = {}
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for ingredient_id, recipe_id in rows:
+                grouped.setdefault(ingredient_id, array("I")).append(recipe_id)
+        cursor.close()
+        index._load(grouped)
+        return index
+
+    def _load(self, grouped):
+        max_id = max((ids[-1] for ids in grouped.values() if ids), default=0)
+        self._nbits = max_id + 1
+        sizes = array("H", bytes(2 * self._nbits))
+        for ids in grouped.values():
+            for recipe_id in ids:
+                sizes[recipe_id] += 1
+        self._sizes = sizes
+        self._postings = {ingredient_id: self._compact(ids) for ingredient_id, ids in grouped.items()}
+        self._size_planes = self._slice_sizes()
+
+    def _compact(self, ids):
+        # A sorted array costs 32 bits per entry, a bitmap one bit per possible recipe id
+        if len(ids) * 32 < self._nbits:
+            return ids
+        return _ids_to_bitmap(ids, self._nbits)
+
+    def _slice_sizes(self):
+        width = max(self._sizes, default=0).bit_length()
+        members = [[] for _ in range(width)]
+        for recipe_id, size in enumerate(self._sizes):
+            while size:
+                bit = size.bit_length() - 1
+                members[bit].append(recipe_id)
+                size ^= 1 << bit
+        return [_ids_to_bitmap(ids, self._nbits) for ids in members]
+
+    def _bitmap(self, ingredient_id):
+        posting = self._postings.get(ingredient_id)
+        if posting is None:
+            return 0
+        if isinstance(posting, int):
+            return posting
+        return _ids_to_bitmap(posting, self._nbits)
+
+    def __len__(self):
+        return len(self._postings)
+
+    def add(self, recipe_id, ingredient_ids):
+        """
+        Registers newly inserted recipe_ingredient rows, keeping the index current without a rebuild.
+        """
+        with self._lock:
+            if recipe_id >= self._nbits:
+                self._sizes.extend([0] * (recipe_id + 1 - self._nbits))
+                self._nbits = recipe_id + 1
+            added = 0
+            for ingredient_id in ingredient_ids:
+                posting = self._postings.get(ingredient_id)
+                if posting is None:
+                    self._postings[ingredient_id] = array("I", [recipe_id])
+                elif isinstance(posting, int):
+                    if posting >> recipe_id & 1:
+                        continue
+                    self._postings[ingredient_id] = posting | (1 << recipe_id)
+                else:
+                    position = bisect_left(posting, recipe_id)
+                    if position < len(posting) and posting[position] == recipe_id:
+                        continue
+                    posting.insert(position, recipe_id)
+                    if len(posting) * 32 >= self._nbits:
+                        self._postings[ingredient_id] = _ids_to_bitmap(posting, self._nbits)
+                added += 1
+            if added:
+                old_size = self._sizes[recipe_id]
+                new_size = old_size + added
+                self._sizes[recipe_id] = new_size
+                while len(self._size_planes) < new_size.bit_length():
+                    self._size_planes.append(0)
+                flip = 1 << recipe_id
+                for bit, plane in enumerate(self._size_planes):
+                    if (old_size ^ new_size) >> bit & 1:
+                        self._size_planes[bit] = plane ^ flip
+
+    def add_loaded(self, recipe_ids, ingredients_column):
+        """
+        Registers the recipes of a bulk load: the 'recipe_ids' db.bulk_load.bulk_load_recipes
+        returns (None for rows that were not inserted) with their resolved 'ingredients_info' lists.
+        Recipes that were loaded before are already in the index and stay as they are.
+        """
+        for recipe_id, ingredients_info in zip(recipe_ids, ingredients_column):
+            if recipe_id is not None:
+                self.add(recipe_id, [row[1] for row in recipe_ingredient_rows(recipe_id, ingredients_info)])
+
+    def recipes_with_all(self, ingredient_ids):
+        """
+        AND query: ids of recipes that use every one of 'ingredient_ids'.
+        """
+        with self._lock:
+            ingredient_ids = list(ingredient_ids)
+            if not ingredient_ids:
+                return []
+            # Intersect the smallest posting lists first; stop as soon as nothing is left
+            ordered = sorted(ingredient_ids, key=self._cardinality)
+            smallest = self._postings.get(ordered[0])
+            if smallest is None:
+                return []
+            if isinstance(smallest, int):
+                result = smallest
+                for ingredient_id in ordered[1:]:
+                    if not result:
+                        break
+                    result &= self._bitmap(ingredient_id)
+                return _bitmap_to_ids(result)
+            # A rare ingredient drives the query: probe its few ids instead of building bitmaps
+            result = list(smallest)
+            for ingredient_id in ordered[1:]:
+                if not result:
+                    break
+                posting = self._postings.get(ingredient_id)
+                if posting is None:
+                    return []
+                if isinstance(posting, int):
+                    raw = posting.to_bytes((posting.bit_length() + 7) // 8, "little")
+                    result = [recipe_id for recipe_id in result if _bit(raw, recipe_id)]
+                else:
+                    members = set(posting)
+                    result = [recipe_id for recipe_id in result if recipe_id in members]
+            return result
+
+    def recipes_with_any(self, ingredient_ids):
+        """
+        OR query: ids of recipes that use at least one of 'ingredient_ids'.
+        """
+        with self._lock:
+            result = 0
+            for ingredient_id in ingredient_ids:
+                result |= self._bitmap(ingredient_id)
+            return _bitmap_to_ids(result)
+
+    def _cardinality(self, ingredient_id):
+        posting = self._postings.get(ingredient_id)
+        if posting is None:
+            return 0
+        if isinstance(posting, int):
+            return posting.bit_count()
+        return len(posting)
+
+    def what_can_i_cook(self, ingredient_ids, max_missing=0, limit=50):
+        """
+        Recipes that use at least one of the given ingredients and need at most 'max_missing'
+        ingredients beyond them, ranked by coverage (share of the recipe's ingredients on hand).
+        Returns dicts: {'recipe_id', 'matched', 'missing', 'coverage'}.
+        """
+        with self._lock:
+            candidates = 0
+            matched_planes = []
+            for ingredient_id in set(ingredient_ids):
+                bitmap = self._bitmap(ingredient_id)
+                if not bitmap:
+                    continue
+                candidates |= bitmap
+                # Bit-sliced increment: add 1 to the matched count of every recipe in 'bitmap'
+                carry = bitmap
+                for bit in range(len(matched_planes)):
+                    plane = matched_planes[bit]
+                    matched_planes[bit] = plane ^ carry
+                    carry &= plane
+                    if not carry:
+                        break
+                if carry:
+                    matched_planes.append(carry)
+            if not candidates:
+                return []
+            # missing = size - matched, computed for all recipes at once
+            missing_planes = []
+            borrow = 0
+            for bit in range(max(len(self._size_planes), len(matched_planes))):
+                a = self._size_planes[bit] if bit < len(self._size_planes) else 0
+                b = matched_planes[bit] if bit < len(matched_planes) else 0
+                missing_planes.append(a ^ b ^ borrow)
+                borrow = (~a & b) | (~(a ^ b) & borrow)
+            # Recipes whose missing count exceeds max_missing, by comparing from the top bit down
+            greater = 0
+            equal = candidates
+            for bit in reversed(range(len(missing_planes))):
+                plane = missing_planes[bit]
+                if max_missing >> bit & 1:
+                    equal &= plane
+                else:
+                    greater |= equal & plane
+                    equal &= ~plane
+            if max_missing >> len(missing_planes):
+                greater = 0
+            hits = _bitmap_to_ids(candidates & ~greater)
+            missing_raw = [plane.to_bytes((self._nbits + 7) // 8, "little") for plane in missing_planes]
+            results = []
+            for recipe_id in hits:
+                missing = sum(_bit(raw, recipe_id) << bit for bit, raw in enumerate(missing_raw))
+                size = self._sizes[recipe_id]
+                results.append({
+                    "recipe_id": recipe_id,
+                    "matched": size - missing,
+                    "missing": missing,
+                    "coverage": (size - missing) / size,
+                })
+            results.sort(key=lambda r: (-r["coverage"], r["missing"], r["recipe_id"]))
+            return results[:limit] if limit else results
@@ -0,0 +1,63 @@
+import importlib.util
+import sys
+import threading
+import types
+
+# One lock per lazily imported module: the first attribute access may come from several worker
+# threads at once (Kivy's BackgroundTasks, Flask's threaded server), and only one may execute it
+_LOAD_LOCKS = {}
+# Modules being executed; an attribute they miss while running their own code is not there yet
+_LOADING = set()
+
+
+class _LazyModule(types.ModuleType):
+    """
+    A module registered by lazy_import() that has not been executed yet. __getattr__ only runs
+    for attributes the module does not have, so __name__, __spec__ and friends stay cheap.
+    """
+
+    def __getattr__(self, attr):
+        with _LOAD_LOCKS[self.__name__]:
+            if self.__name__ in _LOADING:
+                raise AttributeError(f"partially initialized module {self.__name__!r} has no attribute {attr!r}")
+            # Another thread may have loaded the module while this one waited for the lock
+            if type(self) is _LazyModule:
+                _LOADING.add(self.__name__)
+                try:
+                    self.__spec__.loader.exec_module(self)
+                finally:
+                    _LOADING.discard(self.__name__)
+                # Only now do other threads see the module as loaded, and stop taking the lock
+                self.__class__ = types.ModuleType
+        return getattr(self, attr)
+
+
+def lazy_import(name):
+    """
+    Registers module 'name' without executing it: the real import runs on the first attribute
+    access, once, even if several threads get there together. Later 'import name' statements,
+    here or in any other module, get the same object, so a heavy dependency only needed by some
+    actions (ETL, the first query) costs nothing at startup.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    module = importlib.util.module_from_spec(spec)
+    _LOAD_LOCKS[name] = threading.RLock()
+    module.__class__ = _LazyModule
+    sys.modules[name] = module
+    # 'import a.b' binds 'a' and expects 'b' as its attribute, as a regular import would set it
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def is_loaded(name):
+    """
+    True once module 'name' has actually been executed; a lazy_import() placeholder does not count.
+    """
+    # The placeholder turns into a plain module when it loads
+    return type(sys.modules.get(name)) is types.ModuleType
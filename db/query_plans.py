@@ -0,0 +1,147 @@
+# The app's hot queries, plus helpers to check via EXPLAIN / EXPLAIN QUERY PLAN that
+# each of them is answered from an index instead of a full table scan.
+# Queries use '{p}' where the dialect's placeholder goes.
+# name -> (SQL, example parameters, index that should serve it; PRIMARY for the primary key)
+HOT_QUERIES = {
+    "recipe_by_name": (
+        "SELECT id FROM recipe WHERE name = {p}",
+        ("recipe 42",),
+        "idx_recipe_name",
+    ),
+    "recipes_by_category": (
+        "SELECT id, name FROM recipe WHERE category_id = {p} AND id > {p} ORDER BY id LIMIT 50",
+        (3, 0),
+        "idx_recipe_category_id",
+    ),
+    "recent_recipes": (
+        "SELECT id, name FROM recipe ORDER BY created_at DESC, id DESC LIMIT 50",
+        (),
+        "idx_recipe_created_at",
+    ),
+    "recipes_created_keyset": (
+        """
+        SELECT id, name FROM recipe
+        WHERE created_at IS NOT NULL AND (created_at > {p} OR (created_at = {p} AND id > {p}))
+        ORDER BY created_at, id LIMIT 50
+        """,
+        ("2024-06-01 12:00:00", "2024-06-01 12:00:00", 100),
+        "idx_recipe_created_at",
+    ),
+    "recipes_by_user": (
+        "SELECT id FROM recipe WHERE user_id = {p}",
+        (1,),
+        "idx_recipe_user_id",
+    ),
+    "recipe_page": (
+        "SELECT id, name, instructions FROM recipe WHERE id > {p} ORDER BY id LIMIT 50",
+        (100,),
+        "PRIMARY",
+    ),
+    "page_ingredients": (
+        """
+        SELECT ri.recipe_id, ri.ingredient_id, ri.quantity, ri.unit, ri.optional, ing.name
+        FROM recipe_ingredient ri
+        LEFT JOIN ingredient ing ON ri.ingredient_id = ing.id
+        WHERE ri.recipe_id IN ({p}, {p}, {p})
+        ORDER BY ri.recipe_id, ri.ingredient_id
+        """,
+        (1, 2, 3),
+        "PRIMARY",
+    ),
+    "recipes_with_ingredient": (
+        "SELECT recipe_id FROM recipe_ingredient WHERE ingredient_id = {p}",
+        (7,),
+        "idx_recipe_ingredient_ingredient_id",
+    ),
+    "ingredient_by_name": (
+        "SELECT id FROM ingredient WHERE name = {p}",
+        ("ingredient 7",),
+        "idx_ingredient_name",
+    ),
+    "reviews_for_recipe": (
+        "SELECT id, rating, comment FROM review WHERE recipe_id = {p}",
+        (42,),
+        "idx_review_recipe_id",
+    ),
+    "subcategories": (
+        "SELECT id, name FROM category WHERE parent_category_id = {p}",
+        (1,),
+        "idx_category_parent_category_id",
+    ),
+    "category_subtree": (
+        "SELECT descendant_id FROM category_closure WHERE ancestor_id = {p}",
+        (1,),
+        "PRIMARY",
+    ),
+    "category_breadcrumb": (
+        """
+        SELECT c.id, c.name
+        FROM category_closure cc
+        JOIN category c ON c.id = cc.ancestor_id
+        WHERE cc.descendant_id = {p}
+        ORDER BY cc.depth DESC
+        """,
+        (42,),
+        "idx_category_closure_descendant",
+    ),
+    "subtree_recipe_count": (
+        """
+        SELECT COUNT(r.id)
+        FROM category_closure cc
+        JOIN recipe r ON r.category_id = cc.descendant_id
+        WHERE cc.ancestor_id = {p}
+        """,
+        (1,),
+        "idx_recipe_category_id",
+    ),
+}
+
+
+def render(sql, db_type="mysql"):
+    """
+    Fills in the placeholder style of the dialect.
+    """
+    return sql.format(p="%s" if db_type == "mysql" else "?")
+
+
+def explain(conn, sql, params=(), db_type="mysql"):
+    """
+    Returns the query plan rows for 'sql' (already rendered for the dialect).
+    SQLite: the 'detail' strings of EXPLAIN QUERY PLAN. MySQL: EXPLAIN rows as dicts.
+    """
+    cursor = conn.cursor()
+    if db_type == "mysql":
+        cursor.execute("EXPLAIN " + sql, params)
+        names = [d[0] for d in cursor.description]
+        plan = [dict(zip(names, row)) for row in cursor.fetchall()]
+    else:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        plan = [row[-1] for row in cursor.fetchall()]
+    cursor.close()
+    return plan
+
+
+def uses_index(plan, index, db_type="mysql"):
+    """
+    True if some step of the plan reads through 'index' (or the primary key for "PRIMARY").
+    """
+    if db_type == "mysql":
+        return any(step.get("key") == index for step in plan)
+    if index == "PRIMARY":
+        return any("PRIMARY KEY" in detail or "sqlite_autoindex" in detail for detail in plan)
+    return any(f"INDEX {index}" in detail for detail in plan)
+
+
+def full_scans(plan, db_type="mysql"):
+    """
+    Returns the plan steps that read a whole table or sort without an index; empty when the plan is fine.
+    """
+    if db_type == "mysql":
+        return [step for step in plan if step.get("type") == "ALL" or "filesort" in (step.get("Extra") or "")]
+    bad = []
+    for detail in plan:
+        if detail.startswith("SCAN") and "INDEX" not in detail:
+            bad.append(detail)
+        elif "TEMP B-TREE" in detail:
+            bad.append(detail)
+    return bad
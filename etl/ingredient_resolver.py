@@ -0,0 +1,245 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from db.db import max_rows_per_statement
+
+# Minimum Dice similarity of the name trigrams for two spellings to count as one ingredient:
+# 'tomatoe' / 'tomato' scores 0.77, 'roma tomato' / 'tomato' 0.75, 'olive oil' / 'oil' 0.5
+RESOLVER_THRESHOLD = float(os.environ.get("INGREDIENT_MATCH_THRESHOLD", "0.75"))
+# Seconds before an app-held resolver is reloaded, to pick up ingredients added elsewhere
+RESOLVER_TTL = float(os.environ.get("INGREDIENT_RESOLVER_TTL", "300"))
+# Candidates per name that get an exact similarity score, out of those sharing the most trigrams
+RESOLVER_CANDIDATES = int(os.environ.get("INGREDIENT_RESOLVER_CANDIDATES", "20"))
+ALIAS_MAX_LENGTH = 255
+
+_WORD = re.compile(r"[^\W\d_]+")
+
+
+def _singular(word):
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "sses", "xes", "zes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize_name(name):
+    """
+    The comparison key of an ingredient name: lower case, letters only, words in singular
+    ('Tomatoes' and 'tomato' share the key 'tomato').
+    """
+    return " ".join(_singular(word) for word in _WORD.findall(str(name).lower()))[:ALIAS_MAX_LENGTH]
+
+
+def _trigrams(key):
+    padded = f" {key} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class IngredientResolver:
+    """
+    Maps ingredient names from imports to ingredient ids without a query per name.
+    The ingredient table is held in memory as a blocking index (trigram -> names containing it):
+    a name is only compared with the names sharing its rarest trigrams, scored by Dice
+    similarity. Names without a close enough match become new ingredients, inserted in bulk.
+    Every spelling resolved once is stored in ingredient_alias, so later chunks and later
+    runs (in any process) get it with a dictionary lookup.
+    """
+
+    def __init__(self, threshold=RESOLVER_THRESHOLD, candidates=RESOLVER_CANDIDATES):
+        self.threshold = threshold
+        self.candidates = candidates
+        self._ids = []
+        self._grams = []
+        self._by_key = {}
+        self._postings = {}
+        self._aliases = {}
+        self._lock = threading.Lock()
+        self.built_at = time.monotonic()
+        self.stats = Counter()
+
+    @classmethod
+    def from_db(cls, conn, **kwargs):
+        resolver = cls(**kwargs)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name FROM ingredient ORDER BY id")
+        for ingredient_id, name in cursor.fetchall():
+            resolver._add(normalize_name(name), ingredient_id)
+        cursor.execute("SELECT alias, ingredient_id FROM ingredient_alias")
+        known = set(resolver._ids)
+        # Aliases of deleted ingredients are resolved again
+        resolver._aliases = {alias: ingredient_id for alias, ingredient_id in cursor.fetchall()
+                             if ingredient_id in known}
+        cursor.close()
+        return resolver
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _add(self, key, ingredient_id):
+        if not key or key in self._by_key:
+            return
+        position = len(self._ids)
+        grams = _trigrams(key)
+        self._ids.append(ingredient_id)
+        self._grams.append(grams)
+        self._by_key[key] = position
+        for gram in grams:
+            self._postings.setdefault(gram, []).append(position)
+
+    def match(self, key):
+        """
+        Returns (position, score) of the most similar known name, or (None, 0.0).
+        """
+        position = self._by_key.get(key)
+        if position is not None:
+            return position, 1.0
+        grams = _trigrams(key)
+        # Prefix filtering: a name with Dice similarity >= threshold shares at least
+        # len(grams) * t / (2 - t) trigrams with this one, so it must contain one of the
+        # len(grams) - that + 1 rarest ones. Frequent trigrams such as ' sa' are never scanned.
+        t = self.threshold
+        prefix = len(grams) - math.ceil(len(grams) * t / (2 - t)) + 1
+        postings = sorted((self._postings.get(g, ()) for g in grams), key=len)[:max(prefix, 1)]
+        shared = Counter()
+        for posting in postings:
+            shared.update(posting)
+        best, best_score = None, 0.0
+        for candidate, _ in shared.most_common(self.candidates):
+            other = self._grams[candidate]
+            score = 2 * len(grams & other) / (len(grams) + len(other))
+            if score > best_score:
+                best, best_score = candidate, score
+        return best, best_score
+
+    def resolve(self, conn, names, db_type="mysql"):
+        """
+        Returns the ingredient id of every name in 'names', in order (None for names without
+        letters), inserting the ingredients not known yet. The whole batch costs at most one
+        INSERT per statement-sized slice of new ingredients, one SELECT for their ids and one
+        alias upsert, however many names it has.
+        """
+        keys = [normalize_name(name) if name is not None else "" for name in names]
+        # How each key was written, so that new ingredients get a readable name, not the key
+        spellings = {}
+        for name, key in zip(names, keys):
+            if key:
+                spellings.setdefault(key, Counter())[" ".join(str(name).split())] += 1
+        with self._lock:
+            resolved = {}
+            aliases = []
+            unmatched = Counter()
+            for key, count in Counter(k for k in keys if k).items():
+                if key in self._aliases:
+                    resolved[key] = self._aliases[key]
+                    self.stats["cached"] += 1
+                    continue
+                position, score = self.match(key)
+                if position is not None and score >= self.threshold:
+                    resolved[key] = self._ids[position]
+                    aliases.append((key, self._ids[position], score))
+                    self.stats["exact" if score == 1.0 else "fuzzy"] += 1
+                else:
+                    unmatched[key] = count
+            if unmatched:
+                aliases.extend(self._insert_new(conn, db_type, unmatched, resolved, spellings))
+            if aliases:
+                self._store_aliases(conn, db_type, aliases)
+            for key, ingredient_id, _ in aliases:
+                self._aliases[key] = ingredient_id
+        return [resolved.get(key) for key in keys]
+
+    def _insert_new(self, conn, db_type, unmatched, resolved, spellings):
+        """
+        Inserts one ingredient per group of similar new names: the most frequent key starts the
+        group, and later ones that match it become its aliases. The ingredient is named after
+        the most frequent original spelling of that key ('Olive Oil', not 'olive oil');
+        the keys are only used for matching and aliases. Returns the alias rows.
+        """
+        pending = {}
+        new_keys = []
+        for key, _ in unmatched.most_common():
+            position, score = self.match(key)
+            if position is not None and score >= self.threshold and self._ids[position] is None:
+                pending[key] = (position, score)
+                continue
+            self._add(key, None)
+            pending[key] = (self._by_key[key], 1.0)
+            new_keys.append(key)
+        new_names = {key: spellings[key].most_common(1)[0][0][:ALIAS_MAX_LENGTH] for key in new_keys}
+        p = "%s" if db_type == "mysql" else "?"
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM ingredient")
+            before = cursor.fetchall()[0][0]
+            step = max_rows_per_statement(db_type, 1)
+            for start in range(0, len(new_keys), step):
+                batch = [new_names[key] for key in new_keys[start:start + step]]
+                cursor.execute(f"INSERT INTO ingredient (name) VALUES {', '.join([f'({p})'] * len(batch))}", batch)
+            cursor.execute(f"SELECT id, name FROM ingredient WHERE id > {p} ORDER BY id", (before,))
+            inserted = {}
+            for ingredient_id, name in cursor.fetchall():
+                inserted.setdefault(name, ingredient_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # The placeholders would otherwise stay in the index
+            for key in new_keys:
+                self._remove_pending(key)
+            raise
+        finally:
+            cursor.close()
+        for key in new_keys:
+            # Keys differ, so their spellings differ too
+            self._ids[self._by_key[key]] = inserted[new_names[key]]
+        self.stats["new"] += len(new_keys)
+        aliases = []
+        for key, (position, score) in pending.items():
+            resolved[key] = self._ids[position]
+            aliases.append((key, self._ids[position], score))
+            if score < 1.0:
+                self.stats["fuzzy"] += 1
+        return aliases
+
+    def _remove_pending(self, key):
+        position = self._by_key.pop(key)
+        for gram in self._grams[position]:
+            self._postings[gram].remove(position)
+        self._grams[position] = frozenset()
+
+    def _store_aliases(self, conn, db_type, aliases):
+        cursor = conn.cursor()
+        if db_type == "mysql":
+            sql = ("INSERT INTO ingredient_alias (alias, ingredient_id, score) VALUES (%s, %s, %s) "
+                   "ON DUPLICATE KEY UPDATE ingredient_id = VALUES(ingredient_id), score = VALUES(score)")
+        else:
+            sql = "INSERT OR REPLACE INTO ingredient_alias (alias, ingredient_id, score) VALUES (?, ?, ?)"
+        try:
+            cursor.executemany(sql, aliases)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def resolve_chunk(self, conn, df, column="ingredients_info", db_type="mysql"):
+        """
+        Fills in 'ingredient_id' of every entry of the per-recipe lists in 'column'
+        (see etl/ingredients.py) with one resolve() call for the whole chunk.
+        """
+        if column not in df.columns:
+            return df
+        entries = [entry for info in df[column] if isinstance(info, list) for entry in info]
+        ids = self.resolve(conn, [entry.get("name") for entry in entries], db_type=db_type)
+        for entry, ingredient_id in zip(entries, ids):
+            entry["ingredient_id"] = ingredient_id
+        return df
@@ -0,0 +1,153 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Canonical unit -> spellings found in recipe sources (matched case-insensitively, with or without a dot)
+UNIT_ALIASES = {
+    "tsp": ("teaspoons", "teaspoon", "tsps", "tsp", "ts"),
+    "tbsp": ("tablespoons", "tablespoon", "tbsps", "tbsp", "tbs", "tbl"),
+    "cup": ("cups", "cup", "c"),
+    "ml": ("milliliters", "milliliter", "millilitres", "millilitre", "ml"),
+    "cl": ("centiliters", "centiliter", "centilitres", "centilitre", "cl"),
+    "dl": ("deciliters", "deciliter", "decilitres", "decilitre", "dl"),
+    "l": ("liters", "liter", "litres", "litre", "l"),
+    "mg": ("milligrams", "milligram", "mg"),
+    "g": ("grams", "gram", "gr", "g"),
+    "kg": ("kilograms", "kilogram", "kgs", "kg"),
+    "oz": ("ounces", "ounce", "oz"),
+    "fl oz": ("fluid ounces", "fluid ounce", "fl oz"),
+    "lb": ("pounds", "pound", "lbs", "lb"),
+    "pinch": ("pinches", "pinch"),
+    "dash": ("dashes", "dash"),
+    "clove": ("cloves", "clove"),
+    "slice": ("slices", "slice"),
+    "piece": ("pieces", "piece", "pcs", "pc"),
+    "can": ("cans", "can", "tins", "tin"),
+    "package": ("packages", "package", "packets", "packet", "pkgs", "pkg"),
+    "bunch": ("bunches", "bunch"),
+    "sprig": ("sprigs", "sprig"),
+    "stick": ("sticks", "stick"),
+    "handful": ("handfuls", "handful"),
+}
+_UNIT_LOOKUP = {alias: unit for unit, aliases in UNIT_ALIASES.items() for alias in aliases}
+
+# Words that describe how an ingredient is prepared, not which one it is
+PREPARATION_WORDS = (
+    "chopped", "finely", "roughly", "coarsely", "diced", "minced", "sliced", "thinly", "grated", "crushed",
+    "peeled", "fresh", "freshly", "ground", "melted", "softened", "beaten", "shredded", "large", "medium",
+    "small", "halved", "quartered", "cubed", "drained", "rinsed", "packed", "heaped", "level",
+)
+_FRACTIONS = {"½": " 1/2", "⅓": " 1/3", "⅔": " 2/3", "¼": " 1/4", "¾": " 3/4", "⅛": " 1/8"}
+
+# Lines of one recipe are separated by newlines or semicolons
+_LINE_SPLIT = r"\s*[\n;]\s*"
+_NUMBER = r"(?:\d+/\d+|\d+(?:\.\d+)?(?:\s+\d+/\d+)?)(?![\d/.])"
+# Longest alias first, so that 'tbsp' is not read as 't' + 'bsp'
+_UNIT = "|".join(re.escape(alias) for alias in sorted(_UNIT_LOOKUP, key=len, reverse=True))
+_LINE = re.compile(
+    rf"^(?:(?P<quantity>(?:{_NUMBER})(?:\s*(?:-|to)\s*(?:{_NUMBER}))?|\ban?\b(?=\s))\s*)?"
+    rf"(?:(?P<unit>{_UNIT})\.?(?:\s+of)?(?:\s+|$))?"
+    r"(?P<name>.*)$"
+)
+_OPTIONAL = re.compile(r"\(?\boptional\b\)?|\bto taste\b|\bif desired\b")
+_AMOUNT = re.compile(r"^(?P<whole>\d+(?:\.\d+)?)?\s*(?:(?P<num>\d+)/(?P<den>\d+))?$")
+_PREPARATION = re.compile(rf"\b(?:{'|'.join(PREPARATION_WORDS)})\b")
+# Trailing clauses such as ', cut into cubes' or '(about 200 g)'
+_NAME_NOISE = re.compile(r"\([^)]*\)|,.*$")
+_SPACES = re.compile(r"\s+")
+
+
+def split_ingredient_lines(values):
+    """
+    Explodes a column of ingredient lists into one row per non-empty line. A cell can be a string
+    with one line per newline / semicolon, or an already split list. The index keeps pointing at
+    the row the line came from.
+    """
+    split = values.str.split(_LINE_SPLIT, regex=True)
+    # Lists are kept as they are; .str.split gives NaN for them
+    split = split.where(split.notna(), values)
+    lines = split.explode()
+    lines = lines[lines.notna()].astype(str).str.strip()
+    return lines[lines != ""]
+
+
+def _quantities(text):
+    """
+    Normalises quantities to decimal strings ('1 1/2' -> '1.5', 'a' -> '1'); ranges such as
+    '2-3' keep their two normalised ends.
+    """
+    text = text.fillna("").str.replace(r"^an?$", "1", regex=True)
+    ends = text.str.split(r"\s*(?:-|to)\s*", n=1, regex=True, expand=True).reindex(columns=[0, 1]).fillna("")
+    normalised = []
+    for column in (0, 1):
+        parts = ends[column].str.extract(_AMOUNT)
+        whole = pd.to_numeric(parts["whole"], errors="coerce")
+        fraction = pd.to_numeric(parts["num"], errors="coerce") / pd.to_numeric(parts["den"], errors="coerce")
+        value = whole.fillna(0) + fraction.fillna(0)
+        value = value.where(whole.notna() | fraction.notna()).round(3)
+        rendered = value.astype(str).str.replace(r"\.0$", "", regex=True)
+        # What does not parse as a number is kept verbatim
+        normalised.append(rendered.where(value.notna(), ends[column]))
+    return normalised[0].where(ends[1] == "", normalised[0] + "-" + normalised[1])
+
+
+def _parse_distinct(text):
+    optional = text.str.contains(_OPTIONAL)
+    text = text.str.replace(_OPTIONAL, "", regex=True)
+    parts = text.str.extract(_LINE)
+    name = parts["name"].fillna("").str.replace(_NAME_NOISE, "", regex=True)
+    name = name.str.replace(_PREPARATION, "", regex=True).str.replace(_SPACES, " ", regex=True)
+    name = name.str.strip(" ,.-*").str.replace(r"^(?:of|and)\s+", "", regex=True)
+    # Far fewer distinct quantities than lines
+    quantity_codes, quantities = pd.factorize(parts["quantity"].fillna(""))
+    quantity = _quantities(pd.Series(quantities, dtype=object)).to_numpy()[quantity_codes]
+    return pd.DataFrame({
+        "quantity": quantity,
+        "unit": parts["unit"].map(_UNIT_LOOKUP).fillna(""),
+        "name": name,
+        "optional": optional,
+    })
+
+
+def parse_ingredient_lines(lines):
+    """
+    Splits ingredient lines such as '2 Tbsp. chopped tomato' or '1 ½ cups flour (optional)'
+    into quantity ('2', '1.5'), canonical unit ('tbsp', 'cup'; '' if none), ingredient name
+    ('tomato', 'flour') and an optional flag. Works on whole columns with precompiled patterns,
+    and every distinct line is parsed once: across a large import, most lines ('1 tsp salt')
+    repeat many times. Returns a DataFrame with the index of 'lines'.
+    """
+    text = lines.astype(str).str.lower()
+    for fraction, ascii_fraction in _FRACTIONS.items():
+        text = text.str.replace(fraction, ascii_fraction, regex=False)
+    codes, distinct = pd.factorize(text.str.strip())
+    parsed = _parse_distinct(pd.Series(distinct, dtype=object))
+    return parsed.take(codes).set_axis(lines.index)
+
+
+def add_ingredients_info(df, column="ingredients_list"):
+    """
+    Parses the raw ingredient lists in 'column' into 'ingredients_info', the per-recipe list of
+    {'ingredient_id', 'name', 'quantity', 'unit', 'optional'} dicts that
+    db.db.bulk_insert_recipes_with_ingredients expects. 'ingredient_id' stays None until the
+    names are resolved against the ingredient table. Lines without a name are dropped.
+    Returns a copy of 'df'; frames without 'column' are returned unchanged.
+    """
+    if column not in df.columns:
+        return df
+    values = df[column].reset_index(drop=True)
+    parsed = parse_ingredient_lines(split_ingredient_lines(values))
+    parsed = parsed[parsed["name"] != ""]
+    records = [
+        {"ingredient_id": None, "name": name, "quantity": quantity, "unit": unit, "optional": optional}
+        for name, quantity, unit, optional in zip(parsed["name"].tolist(), parsed["quantity"].tolist(),
+                                                  parsed["unit"].tolist(), parsed["optional"].tolist())
+    ]
+    # The lines are grouped by row already (explode keeps the order), so cutting the records at
+    # the running counts gives every row its list
+    counts = np.bincount(parsed.index.to_numpy(dtype=np.int64), minlength=len(df))
+    bounds = np.concatenate(([0], np.cumsum(counts))).tolist()
+    result = df.copy()
+    result["ingredients_info"] = [records[start:end] for start, end in zip(bounds, bounds[1:])]
+    return result
@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import threading
+from collections import deque
+
+import pandas as pd
+
+logger = logging.getLogger("etl")
+
+
+def chunk_content_hash(chunk):
+    """
+    128-bit hash of a raw source chunk (column names and values), to tell whether the chunk a
+    rerun reads at some position is the one an earlier attempt completed there.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\x1f".join(map(str, chunk.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(chunk, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class ETLLedger:
+    """
+    The etl_run / etl_chunk bookkeeping of one ETL run over 'source'. Every loaded chunk is
+    checkpointed with the hash of its raw content. A run over the same source and chunk size
+    that did not finish (crashed, failed or cancelled) is resumed instead of started over: its
+    completed chunks are skipped as long as their content is unchanged, so a restart costs
+    reading the finished part of the file and redoing only the unfinished work.
+    A chunk loaded but not checkpointed before a crash is loaded again; recipe loads are
+    upserts on the recipe content hash (see etl/transform.py), so that adds nothing twice.
+    """
+
+    def __init__(self, connect, source, chunk_size, db_type="mysql"):
+        self.connect = connect
+        self.source = source
+        self.chunk_size = chunk_size
+        self.db_type = db_type
+        self.run_id = None
+        self.resumed = False
+        self.completed = {}
+        self.skipped = 0
+        self.failed = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def _execute(self, *statements):
+        """
+        Runs (sql, params) statements in one transaction on a connection of its own; returns the
+        rows and lastrowid of the last one.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            for sql, params in statements:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall() if cursor.description else None
+                last_id = cursor.lastrowid
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+        return rows, last_id
+
+    def start(self):
+        """
+        Resumes the latest unfinished run over the same source, or records a new one.
+        """
+        p = "%s" if self.db_type == "mysql" else "?"
+        rows, _ = self._execute((
+            f"SELECT id FROM etl_run WHERE source = {p} AND chunk_size = {p} AND status <> 'done' "
+            f"ORDER BY id DESC LIMIT 1", (self.source, self.chunk_size)))
+        if rows:
+            self.run_id = rows[0][0]
+            self.resumed = True
+            chunks, _ = self._execute(
+                (f"UPDATE etl_run SET status = 'running', finished_at = NULL WHERE id = {p}", (self.run_id,)),
+                (f"SELECT source_file, chunk_no, content_hash FROM etl_chunk WHERE run_id = {p}", (self.run_id,)))
+            self.completed = {(source_file, chunk_no): content_hash for source_file, chunk_no, content_hash in chunks}
+            logger.info(f"Resuming ETL run {self.run_id} over {self.source}: {len(self.completed)} chunks completed.")
+        else:
+            _, self.run_id = self._execute((
+                f"INSERT INTO etl_run (source, chunk_size, status) VALUES ({p}, {p}, 'running')",
+                (self.source, self.chunk_size)))
+        return self
+
+    def completed_chunks(self, source_file=None):
+        """
+        {chunk_no: content hash} of the chunks of 'source_file' (default: the run's source) completed so far.
+        """
+        source_file = source_file or self.source
+        return {chunk_no: content_hash for (path, chunk_no), content_hash in self.completed.items()
+                if path == source_file}
+
+    def pending(self, chunks, source_file=None, on_skip=None):
+        """
+        Yields the chunks of 'chunks' that are not completed yet, in order; completed ones are
+        counted in 'skipped' and passed to 'on_skip'. The loader reports every yielded chunk,
+        in the same order, with chunk_loaded().
+        """
+        source_file = source_file or self.source
+        for chunk_no, chunk in enumerate(chunks):
+            content_hash = chunk_content_hash(chunk)
+            if self.completed.get((source_file, chunk_no)) == content_hash:
+                self.skipped += 1
+                if on_skip is not None:
+                    on_skip(chunk)
+                continue
+            self._pending.append((source_file, chunk_no, content_hash))
+            yield chunk
+
+    def chunk_loaded(self, rows_loaded, key=None):
+        """
+        Checkpoints the oldest chunk yielded by pending(), or the (source_file, chunk_no,
+        content_hash) 'key', as completed with 'rows_loaded' new rows. None means the load
+        failed: the chunk is not checkpointed, and the run will not be marked done.
+        """
+        source_file, chunk_no, content_hash = key or self._pending.popleft()
+        if rows_loaded is None:
+            with self._lock:
+                self.failed += 1
+            return
+        p = "%s" if self.db_type == "mysql" else "?"
+        if self.db_type == "mysql":
+            upsert = (f"INSERT INTO etl_chunk (run_id, source_file, chunk_no, content_hash, rows_loaded) "
+                      f"VALUES ({p}, {p}, {p}, {p}, {p}) "
+                      f"ON DUPLICATE KEY UPDATE content_hash = VALUES(content_hash), rows_loaded = VALUES(rows_loaded)")
+        else:
+            upsert = (f"INSERT OR REPLACE INTO etl_chunk (run_id, source_file, chunk_no, content_hash, rows_loaded) "
+                      f"VALUES ({p}, {p}, {p}, {p}, {p})")
+        self._execute((upsert, (self.run_id, source_file, chunk_no, content_hash, rows_loaded)),
+                      (f"UPDATE etl_run SET rows_loaded = rows_loaded + {p} WHERE id = {p}",
+                       (rows_loaded, self.run_id)))
+        with self._lock:
+            self.completed[(source_file, chunk_no)] = content_hash
+
+    def finish(self, status=None):
+        """
+        Closes the run: 'done' unless a chunk failed (then 'failed'), or the given status
+        ('failed', 'cancelled'). Only 'done' runs are never resumed.
+        """
+        status = status or ("failed" if self.failed else "done")
+        p = "%s" if self.db_type == "mysql" else "?"
+        self._execute((f"UPDATE etl_run SET status = {p}, finished_at = CURRENT_TIMESTAMP WHERE id = {p}",
+                       (status, self.run_id)))
+        return status
@@ -0,0 +1,409 @@
+import os
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from db.db import max_rows_per_statement
+from etl.ingredient_resolver import normalize_name
+
+# Estimated Jaccard similarity of two recipes' shingle sets from which one counts as a copy of the other
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+# Signature layout. Stored signatures and band keys depend on all three, so changing one
+# means rebuilding them: python -m scripts.find_near_duplicates --rebuild
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16
+MINHASH_SEED = 1
+# Words per instruction shingle
+SHINGLE_WORDS = 3
+
+# 16 bands of 8 rows: pairs at similarity 0.8 become candidates with probability 0.95,
+# pairs at 0.5 with 0.06, so few candidates need an exact comparison
+_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_SHIFT = np.uint64(32)
+_random = np.random.RandomState(MINHASH_SEED)
+# Multiply-shift hashing: odd 64-bit multipliers, the high 32 bits of a * x + b are the hash
+_A = _random.randint(1, 1 << 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_B = _random.randint(0, 1 << 63, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+# Odd multipliers per band and row for the band keys
+_BAND_COEFFS = _random.randint(1, 1 << 62, size=(LSH_BANDS, _ROWS), dtype=np.uint64) | np.uint64(1)
+# Hashed features per block when computing signatures: an 8 MB matrix stays in cache, and
+# is twice as fast as hashing a whole chunk at once
+_BLOCK_FEATURES = 8192
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def recipe_features(instructions, ingredient_names=()):
+    """
+    The shingle set of one recipe as 32-bit hashes: overlapping SHINGLE_WORDS-word runs of the
+    lower-cased instructions plus every normalised ingredient name. Lightly edited copies
+    (punctuation, case, a reworded sentence, 'tomatoes' for 'tomato') keep most of their shingles.
+    """
+    words = _TOKEN.findall(instructions.lower()) if isinstance(instructions, str) else []
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+    shingles.discard("")
+    shingles.update(f"ingredient:{key}" for key in map(normalize_name, ingredient_names) if key)
+    # crc32 rather than hash(): signatures are stored, so they must not change between processes
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signatures(feature_sets):
+    """
+    MinHash signatures of a list of feature arrays (see recipe_features), as an
+    (n, MINHASH_PERMUTATIONS) uint32 array. The features of many recipes are hashed with all
+    permutations in a few in-place numpy operations per block, and reduced per recipe with
+    minimum.reduceat (about 40,000 recipes a second with ~70 shingles each).
+    Rows of empty sets are all-ones and must not be compared; the second return value marks
+    the rows that have features.
+    """
+    signatures = np.full((len(feature_sets), MINHASH_PERMUTATIONS), _MAX_HASH, dtype=np.uint64)
+    present = np.array([len(features) > 0 for features in feature_sets], dtype=bool)
+    rows = np.flatnonzero(present)
+    buffer = np.empty((_BLOCK_FEATURES, MINHASH_PERMUTATIONS), dtype=np.uint64)
+    start = 0
+    while start < len(rows):
+        # Whole recipes per block, at least one
+        end, total = start, 0
+        while end < len(rows) and (end == start or total + len(feature_sets[rows[end]]) <= _BLOCK_FEATURES):
+            total += len(feature_sets[rows[end]])
+            end += 1
+        block = rows[start:end]
+        features = np.concatenate([feature_sets[row] for row in block])
+        # uint64 wraps around on purpose; a single recipe may exceed the buffer
+        if len(features) <= _BLOCK_FEATURES:
+            hashed = buffer[:len(features)]
+        else:
+            hashed = np.empty((len(features), MINHASH_PERMUTATIONS), dtype=np.uint64)
+        np.multiply(features[:, None], _A, out=hashed)
+        hashed += _B
+        hashed >>= _SHIFT
+        bounds = np.cumsum([0] + [len(feature_sets[row]) for row in block[:-1]])
+        signatures[block] = np.minimum.reduceat(hashed, bounds, axis=0)
+        start = end
+    return signatures.astype(np.uint32), present
+
+
+def frame_signatures(df):
+    """
+    Signatures of the recipes of a transformed chunk, from 'instructions' and the ingredient
+    names in 'ingredients_info' (see etl/ingredients.py).
+    """
+    instructions = df["instructions"].tolist() if "instructions" in df.columns else [None] * len(df)
+    infos = df["ingredients_info"].tolist() if "ingredients_info" in df.columns else [None] * len(df)
+    return minhash_signatures([
+        recipe_features(text, [entry.get("name") for entry in info] if isinstance(info, list) else ())
+        for text, info in zip(instructions, infos)
+    ])
+
+
+def band_keys(signatures):
+    """
+    The LSH bucket of every band of every signature, as an (n, LSH_BANDS) int64 array.
+    Each band has its own multipliers, so equal rows in different bands give different keys
+    and one column of keys can serve all bands.
+    """
+    bands = signatures.astype(np.uint64).reshape(len(signatures), LSH_BANDS, _ROWS)
+    return (bands * _BAND_COEFFS).sum(axis=2, dtype=np.uint64).view(np.int64)
+
+
+def encode_signature(signature):
+    return signature.astype("<u4").tobytes()
+
+
+def decode_signature(blob):
+    return np.frombuffer(bytes(blob), dtype="<u4").astype(np.uint32)
+
+
+def add_signatures(df):
+    """
+    Returns a copy of 'df' with the 'minhash' column NearDuplicateFilter adds, without dropping
+    anything, so that the hashing can run in worker processes (see etl/parallel.py).
+    """
+    signatures, present = frame_signatures(df)
+    result = df.copy()
+    result["minhash"] = [encode_signature(signature) if has_features else None
+                         for signature, has_features in zip(signatures, present)]
+    return result
+
+
+class LSHIndex:
+    """
+    In-memory LSH index: signatures are bucketed by band key, and a query only compares the
+    signatures sharing at least one bucket with it, not every signature seen so far.
+    Holds about 1 KB per recipe (the signature and its band keys).
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self._keys = []
+        self._signatures = []
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, signature, keys=None):
+        position = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        for band_key in (band_keys(signature[None])[0] if keys is None else keys).tolist():
+            self._buckets.setdefault(band_key, []).append(position)
+
+    def query(self, signature, keys=None):
+        """
+        Returns (key, similarity) of the most similar indexed signature at or above the
+        threshold, or (None, 0.0).
+        """
+        candidates = set()
+        for band_key in (band_keys(signature[None])[0] if keys is None else keys).tolist():
+            candidates.update(self._buckets.get(band_key, ()))
+        if not candidates:
+            return None, 0.0
+        candidates = sorted(candidates)
+        scores = (np.stack([self._signatures[c] for c in candidates]) == signature).mean(axis=1)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None, 0.0
+        return self._keys[candidates[best]], float(scores[best])
+
+
+class NearDuplicateFilter:
+    """
+    ETL stage: drops rows that are near-duplicates of an earlier row of the same run (an
+    edited copy from another source), within a chunk and across chunks, and adds the MinHash
+    signature of every row kept as 'minhash' so the loader can check it against the
+    recipes already stored and store it (see drop_stored_duplicates and store_signatures).
+    Chunks that already carry a 'minhash' column (signed by a worker process, see
+    etl/parallel.py) are not signed again.
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.index = LSHIndex(threshold)
+        self.dropped = 0
+
+    def filter(self, chunk):
+        if chunk.empty:
+            return chunk
+        if "minhash" in chunk.columns:
+            signatures, present = _column_signatures(chunk["minhash"].tolist())
+        else:
+            signatures, present = frame_signatures(chunk)
+        keys = band_keys(signatures)
+        keep = np.ones(len(chunk), dtype=bool)
+        for row in np.flatnonzero(present):
+            match, _ = self.index.query(signatures[row], keys[row])
+            if match is None:
+                self.index.add(len(self.index), signatures[row], keys[row])
+            else:
+                keep[row] = False
+        self.dropped += int((~keep).sum())
+        result = chunk[keep].copy()
+        result["minhash"] = [encode_signature(signature) if has_features else None
+                             for signature, has_features in zip(signatures[keep], present[keep])]
+        return result
+
+
+def _column_signatures(values):
+    present = np.array([value is not None and not isinstance(value, float) for value in values], dtype=bool)
+    signatures = np.full((len(values), MINHASH_PERMUTATIONS), 0xFFFFFFFF, dtype=np.uint32)
+    for row in np.flatnonzero(present):
+        signatures[row] = decode_signature(values[row])
+    return signatures, present
+
+
+def find_stored_duplicates(conn, signatures, present, db_type="mysql", threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    For every signature, the stored recipe it is a near-duplicate of: a list of
+    (recipe_id, similarity), (None, 0.0) where there is none. Costs one band-key query and
+    one signature query per statement-sized slice, for the whole batch.
+    """
+    matches = [(None, 0.0)] * len(signatures)
+    rows = np.flatnonzero(present)
+    if not len(rows):
+        return matches
+    keys = band_keys(signatures[rows])
+    p = "%s" if db_type == "mysql" else "?"
+    step = max_rows_per_statement(db_type, 1)
+    cursor = conn.cursor()
+    buckets = {}
+    distinct_keys = sorted(set(keys.ravel().tolist()))
+    for start in range(0, len(distinct_keys), step):
+        batch = distinct_keys[start:start + step]
+        cursor.execute(f"SELECT band_key, recipe_id FROM recipe_minhash_band "
+                       f"WHERE band_key IN ({', '.join([p] * len(batch))})", batch)
+        for band_key, recipe_id in cursor.fetchall():
+            buckets.setdefault(band_key, []).append(recipe_id)
+    index = LSHIndex(threshold)
+    candidate_ids = sorted({recipe_id for ids in buckets.values() for recipe_id in ids})
+    for start in range(0, len(candidate_ids), step):
+        batch = candidate_ids[start:start + step]
+        cursor.execute(f"SELECT recipe_id, signature FROM recipe_minhash "
+                       f"WHERE recipe_id IN ({', '.join([p] * len(batch))}) AND signature IS NOT NULL", batch)
+        for recipe_id, blob in cursor.fetchall():
+            index.add(recipe_id, decode_signature(blob))
+    cursor.close()
+    if len(index):
+        for row, row_keys in zip(rows, keys):
+            matches[row] = index.query(signatures[row], row_keys)
+    return matches
+
+
+def store_signatures(conn, recipe_ids, signatures, present, db_type="mysql"):
+    """
+    Stores (or replaces) the signatures and band keys of the given recipes; entries with a
+    None id are skipped. Recipes without features get a NULL signature and no band keys,
+    so they are marked as checked but never match.
+    """
+    rows = [(recipe_id, encode_signature(signature) if has_features else None, has_features, signature)
+            for recipe_id, signature, has_features in zip(recipe_ids, signatures, present)
+            if recipe_id is not None]
+    if not rows:
+        return 0
+    p = "%s" if db_type == "mysql" else "?"
+    signed = [row for row in rows if row[2]]
+    band_rows = []
+    if signed:
+        keys = band_keys(np.stack([row[3] for row in signed]))
+        band_rows = sorted({(band_key, row[0]) for row, row_keys in zip(signed, keys.tolist()) for band_key in row_keys})
+    if db_type == "mysql":
+        upsert = ("INSERT INTO recipe_minhash (recipe_id, signature) VALUES (%s, %s) "
+                  "ON DUPLICATE KEY UPDATE signature = VALUES(signature)")
+    else:
+        upsert = "INSERT OR REPLACE INTO recipe_minhash (recipe_id, signature) VALUES (?, ?)"
+    ids = [row[0] for row in rows]
+    step = max_rows_per_statement(db_type, 1)
+    cursor = conn.cursor()
+    try:
+        if db_type == "sqlite" and not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        # Band keys of replaced signatures are stale
+        for start in range(0, len(ids), step):
+            batch = ids[start:start + step]
+            cursor.execute(f"DELETE FROM recipe_minhash_band WHERE recipe_id IN ({', '.join([p] * len(batch))})", batch)
+        cursor.executemany(upsert, [row[:2] for row in rows])
+        cursor.executemany(f"INSERT INTO recipe_minhash_band (band_key, recipe_id) VALUES ({p}, {p})", band_rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(rows)
+
+
+def drop_stored_duplicates(conn, df, db_type="mysql", threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Load stage counterpart of NearDuplicateFilter: drops the rows whose 'minhash' matches a
+    recipe stored by an earlier run or added since. Returns (kept rows, number dropped).
+    """
+    if "minhash" not in df.columns or df.empty:
+        return df, 0
+    signatures, present = _column_signatures(df["minhash"].tolist())
+    matches = find_stored_duplicates(conn, signatures, present, db_type=db_type, threshold=threshold)
+    keep = np.array([recipe_id is None for recipe_id, _ in matches], dtype=bool)
+    return df[keep], int((~keep).sum())
+
+
+def store_frame_signatures(conn, recipe_ids, df, db_type="mysql"):
+    """
+    Stores the 'minhash' column of a loaded chunk under the recipe ids it was loaded as
+    (aligned with the rows, None for rows that were not inserted).
+    """
+    if "minhash" not in df.columns or recipe_ids is None:
+        return 0
+    signatures, present = _column_signatures(df["minhash"].tolist())
+    return store_signatures(conn, recipe_ids, signatures, present, db_type=db_type)
+
+
+def _unsigned_recipes(conn, after_id, limit, db_type):
+    """
+    The next page of recipes without a stored signature: [(id, instructions, [ingredient names])].
+    """
+    p = "%s" if db_type == "mysql" else "?"
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT r.id, r.instructions
+        FROM recipe r
+        LEFT JOIN recipe_minhash m ON m.recipe_id = r.id
+        WHERE m.recipe_id IS NULL AND r.id > {p}
+        ORDER BY r.id
+        LIMIT {p}
+    """, (after_id, limit))
+    recipes = {recipe_id: (recipe_id, instructions, []) for recipe_id, instructions in cursor.fetchall()}
+    if recipes:
+        cursor.execute(f"""
+            SELECT ri.recipe_id, ing.name
+            FROM recipe_ingredient ri
+            JOIN ingredient ing ON ing.id = ri.ingredient_id
+            WHERE ri.recipe_id IN ({", ".join([p] * len(recipes))})
+        """, tuple(recipes))
+        for recipe_id, name in cursor.fetchall():
+            recipes[recipe_id][2].append(name)
+    cursor.close()
+    return list(recipes.values())
+
+
+def _store_pairs(conn, pairs, db_type):
+    if db_type == "mysql":
+        sql = ("INSERT INTO recipe_near_duplicate (recipe_id, duplicate_of, similarity) VALUES (%s, %s, %s) "
+               "ON DUPLICATE KEY UPDATE similarity = VALUES(similarity)")
+    else:
+        sql = "INSERT OR REPLACE INTO recipe_near_duplicate (recipe_id, duplicate_of, similarity) VALUES (?, ?, ?)"
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(sql, pairs)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def detect_near_duplicates(conn, db_type="mysql", page_size=1000, rebuild=False,
+                           threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Batch job over the recipe table: every recipe without a stored signature is signed,
+    compared with the stored signatures (and the earlier recipes of its page), and recorded
+    in recipe_near_duplicate as a copy of the most similar older recipe. Only recipes added
+    since the last run are read, so it can run as often as needed; rebuild=True drops all
+    signatures and pairs first (after a change of the signature layout or of many recipes).
+    Returns Counter with the number of recipes signed and pairs found.
+    """
+    if rebuild:
+        cursor = conn.cursor()
+        for table in ("recipe_near_duplicate", "recipe_minhash_band", "recipe_minhash"):
+            cursor.execute(f"DELETE FROM {table}")
+        conn.commit()
+        cursor.close()
+    stats = Counter()
+    after_id = 0
+    while True:
+        page = _unsigned_recipes(conn, after_id, page_size, db_type)
+        if not page:
+            return stats
+        signatures, present = minhash_signatures([recipe_features(instructions, names)
+                                                  for _, instructions, names in page])
+        stored = find_stored_duplicates(conn, signatures, present, db_type=db_type, threshold=threshold)
+        local = LSHIndex(threshold)
+        keys = band_keys(signatures)
+        pairs = []
+        for row, (recipe_id, _, _) in enumerate(page):
+            if not present[row]:
+                continue
+            match, score = local.query(signatures[row], keys[row])
+            stored_match, stored_score = stored[row]
+            if stored_match is not None and stored_score >= score:
+                match, score = stored_match, stored_score
+            if match is not None:
+                pairs.append((recipe_id, match, score))
+            local.add(recipe_id, signatures[row], keys[row])
+        if pairs:
+            _store_pairs(conn, pairs, db_type)
+        store_signatures(conn, [recipe_id for recipe_id, _, _ in page], signatures, present, db_type=db_type)
+        stats["recipes"] += len(page)
+        stats["pairs"] += len(pairs)
+        after_id = page[-1][0]
@@ -0,0 +1,238 @@
+import glob
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from db.bulk_load import _max_recipe_id, bulk_load_recipes
+from db.db import db_configuration
+from db.get_connection import get_db_connection
+from etl.ledger import ETLLedger, chunk_content_hash
+from etl.near_duplicates import NearDuplicateFilter, add_signatures, drop_stored_duplicates, store_frame_signatures
+from etl.streaming import STREAM_CHUNK_SIZE, NameDeduplicator, iter_source_chunks
+from etl.transform import RENAME_MAP, transform_recipes
+
+# Processes running transform + MinHash signing; one chunk at a time each
+ETL_WORKERS = int(os.environ.get("ETL_WORKERS", str(os.cpu_count() or 1)))
+# Threads loading batches, each on its own pooled connection (keep below MyDB_POOL_SIZE + overflow)
+ETL_LOAD_WORKERS = int(os.environ.get("ETL_LOAD_WORKERS", "4"))
+# Rows per load batch
+ETL_LOAD_BATCH = int(os.environ.get("ETL_LOAD_BATCH", "10000"))
+SOURCE_EXTENSIONS = (".csv", ".json", ".jsonl", ".ndjson")
+
+logger = logging.getLogger("etl")
+
+
+def is_multi_source(source):
+    """
+    True if 'source' names a directory or a glob pattern rather than one file.
+    """
+    return os.path.isdir(source) or glob.has_magic(source)
+
+
+def discover_sources(source):
+    """
+    The source files named by 'source' - a directory (its CSV/JSON files, not recursive), a glob
+    pattern or a single file - in sorted order. The order decides which of two duplicates is
+    kept and which ids the recipes get, so it must not depend on the file system.
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    elif glob.has_magic(source):
+        paths = glob.glob(source, recursive=True)
+    else:
+        paths = [source]
+    return sorted(path for path in paths
+                  if os.path.isfile(path) and os.path.splitext(path)[1].lower() in SOURCE_EXTENSIONS)
+
+
+def transform_chunk(chunk, transform=transform_recipes):
+    """
+    Worker process side: transforms one raw chunk and adds its MinHash signatures.
+    """
+    return add_signatures(transform(chunk))
+
+
+def _source_chunks(paths, chunk_size):
+    """
+    Yields (path, chunk_no, raw chunk) for every chunk of every file, streamed, and
+    (path, None, None) once a file is exhausted.
+    """
+    for path in paths:
+        for chunk_no, chunk in enumerate(iter_source_chunks(path, chunk_size) or ()):
+            yield path, chunk_no, chunk
+        yield path, None, None
+
+
+def _in_order(items, ahead, submit):
+    """
+    Yields (item, submit(item)) in the order of 'items', calling submit() up to 'ahead' items
+    before they are consumed: enough to keep the workers busy, few enough that neither the
+    reading nor fast workers can pile up chunks in memory.
+    """
+    items = iter(items)
+    pending = deque()
+    for item in items:
+        pending.append((item, submit(item)))
+        if len(pending) >= ahead:
+            break
+    while pending:
+        item, result = pending.popleft()
+        next_item = next(items, None)
+        if next_item is not None:
+            pending.append((next_item, submit(next_item)))
+        yield item, result
+
+
+class ParallelETLRunner:
+    """
+    ETL over many source files (a directory or a glob), for backfills of hundreds of exports.
+      - the files are read chunk by chunk on the calling thread; transform, and the MinHash
+        signing of etl/near_duplicates.py, run in a process pool, one chunk per task, so that
+        the expensive part scales with the cores while at most a few chunks per worker are in
+        memory, however large the files
+      - the results are consumed in (file, chunk) order on the calling thread, the only place that
+        decides anything: duplicate names, near-duplicates, ingredient ids and recipe ids are
+        assigned there in (file, row) order, so a run gives the same ids whatever the number of
+        workers and whichever file finishes first
+      - recipes are loaded in batches of 'batch_size' rows by 'load_workers' threads, each on a
+        connection of its own from the pool, with the explicit ids (see bulk_load_recipes)
+    Ids continue from the largest one at the start of the run; recipes added by other writers
+    meanwhile would take the same ids, so a backfill should run while nothing else adds recipes.
+    With checkpoints=True every chunk of every file is checkpointed in the ETL ledger once all
+    its batches are loaded, and a rerun over the same source skips the completed chunks before
+    they are sent to a worker (see etl/ledger.py).
+    """
+
+    def __init__(self, connect=None, db_type="mysql", resolver=None, workers=None, load_workers=None,
+                 batch_size=None, chunk_size=None, transform=transform_recipes, checkpoints=True):
+        self.connect = connect or (lambda: get_db_connection(db_type, db_configuration))
+        self.db_type = db_type
+        self.resolver = resolver
+        self.workers = workers or ETL_WORKERS
+        self.load_workers = load_workers or ETL_LOAD_WORKERS
+        self.batch_size = batch_size or ETL_LOAD_BATCH
+        self.chunk_size = chunk_size or STREAM_CHUNK_SIZE
+        # Has to be a module-level function: it is pickled to the worker processes
+        self.transform = transform
+        self.checkpoints = checkpoints
+        self.ledger = None
+        # (source file, chunk_no, content hash) -> [batches still loading, rows loaded]
+        self._chunk_loads = {}
+
+    def _load(self, batch):
+        conn = self.connect()
+        try:
+            result = bulk_load_recipes(conn, batch, db_type=self.db_type, explicit_ids=True)
+            store_frame_signatures(conn, result["recipe_ids"], batch, db_type=self.db_type)
+        finally:
+            conn.close()
+        return result
+
+    def _chunk_done(self, key, rows_loaded):
+        if self.ledger is not None:
+            self.ledger.chunk_loaded(rows_loaded, key=key)
+
+    def _finish(self, load, stats):
+        key, future = load
+        result = future.result()
+        stats["batches"] += 1
+        stats["rows_loaded"] += result["rows"]
+        stats["ingredient_rows"] += result["ingredient_rows"]
+        # Batches are finished in submission order, so a chunk's last batch comes after its others
+        progress = self._chunk_loads[key]
+        progress[0] -= 1
+        progress[1] += result["rows"]
+        if progress[0] == 0:
+            del self._chunk_loads[key]
+            self._chunk_done(key, progress[1])
+
+    def run(self, source, progress=None):
+        """
+        Runs the ETL over every file of 'source' (see discover_sources).
+        'progress(stats)' is called after every file; returning False stops the run there
+        (files loaded so far stay loaded) and sets stats['cancelled'].
+        Returns a dict with file/chunk/row counts and the elapsed seconds.
+        """
+        paths = discover_sources(source)
+        stats = {"files": len(paths), "files_done": 0, "chunks": 0, "skipped_chunks": 0, "rows_in": 0,
+                 "rows_loaded": 0, "batches": 0, "duplicates": 0, "near_duplicates": 0, "stored_duplicates": 0,
+                 "ingredient_rows": 0, "seconds": 0.0, "cancelled": False, "run_id": None}
+        started = time.perf_counter()
+        deduplicator = NameDeduplicator()
+        near_duplicates = NearDuplicateFilter()
+        # Spawned, not forked: the calling process may hold threads and pooled connections
+        context = multiprocessing.get_context("spawn")
+        if self.checkpoints:
+            self.ledger = ETLLedger(self.connect, os.path.abspath(source), self.chunk_size, self.db_type).start()
+            stats["run_id"] = self.ledger.run_id
+        completed = self.ledger.completed if self.ledger is not None else {}
+        conn = self.connect()
+        try:
+            next_id = _max_recipe_id(conn) + 1
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as processes, \
+                    ThreadPoolExecutor(max_workers=self.load_workers, thread_name_prefix="etl-load") as loaders:
+                loads = deque()
+
+                def submit(item):
+                    path, chunk_no, chunk = item
+                    if chunk is None:
+                        return None
+                    content_hash = chunk_content_hash(chunk)
+                    if completed.get((os.path.abspath(path), chunk_no)) == content_hash:
+                        # Loaded by an earlier attempt: not transformed again, only its names are kept
+                        return content_hash, True, chunk.rename(columns=RENAME_MAP).filter(items=["name"])
+                    return content_hash, False, processes.submit(transform_chunk, chunk, self.transform)
+
+                for (path, chunk_no, _), result in _in_order(_source_chunks(paths, self.chunk_size),
+                                                             2 * self.workers, submit):
+                    if result is None:
+                        stats["files_done"] += 1
+                        logger.debug(f"Processed {path} ({stats['files_done']}/{stats['files']}).")
+                        if progress is not None and progress(dict(stats)) is False:
+                            stats["cancelled"] = True
+                            processes.shutdown(wait=False, cancel_futures=True)
+                            logger.info(f"Parallel ETL cancelled after {stats['files_done']} files.")
+                            break
+                        continue
+                    content_hash, done, chunk = result
+                    if done:
+                        # Its names still count as seen
+                        deduplicator.remember(chunk)
+                        stats["skipped_chunks"] += 1
+                        continue
+                    chunk = chunk.result()
+                    key = (os.path.abspath(path), chunk_no, content_hash)
+                    stats["chunks"] += 1
+                    stats["rows_in"] += len(chunk)
+                    chunk = deduplicator.filter(chunk)
+                    chunk = near_duplicates.filter(chunk)
+                    chunk, known = drop_stored_duplicates(conn, chunk, db_type=self.db_type)
+                    stats["stored_duplicates"] += known
+                    if chunk.empty:
+                        self._chunk_done(key, 0)
+                        continue
+                    if self.resolver is not None:
+                        self.resolver.resolve_chunk(conn, chunk, db_type=self.db_type)
+                    chunk = chunk.assign(id=range(next_id, next_id + len(chunk)))
+                    next_id += len(chunk)
+                    starts = range(0, len(chunk), self.batch_size)
+                    self._chunk_loads[key] = [len(starts), 0]
+                    for start in starts:
+                        # Bounded: a slow database holds back the reading instead of filling memory
+                        while len(loads) >= 2 * self.load_workers:
+                            self._finish(loads.popleft(), stats)
+                        loads.append((key, loaders.submit(self._load, chunk.iloc[start:start + self.batch_size])))
+                while loads:
+                    self._finish(loads.popleft(), stats)
+        finally:
+            conn.close()
+        # A run that raised stays open in the ledger, and the next run over the source resumes it
+        if self.ledger is not None:
+            self.ledger.finish("cancelled" if stats["cancelled"] else None)
+        stats["duplicates"] = deduplicator.dropped
+        stats["near_duplicates"] = near_duplicates.dropped
+        stats["seconds"] = time.perf_counter() - started
+        return stats
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import pandas as pd
+
+# Rows per chunk when streaming a source file
+STREAM_CHUNK_SIZE = int(os.environ.get("ETL_CHUNK_SIZE", "50000"))
+# How many transformed chunks may wait for the loader; bounds peak memory
+STREAM_QUEUE_SIZE = int(os.environ.get("ETL_QUEUE_SIZE", "2"))
+
+logger = logging.getLogger("etl")
+
+_DONE = object()
+
+
+def iter_source_chunks(source_path, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields DataFrames of at most 'chunk_size' rows from a CSV or JSON source file.
+    JSON has to be line-delimited (one record per line) to be streamed; a classic
+    JSON array can only be parsed as a whole, so it is read at once and sliced.
+    Returns None if the file is missing, empty, unreadable or in an unsupported format;
+    rows that turn out to be malformed later in the file raise while iterating.
+    """
+    if not os.path.exists(source_path):
+        logger.error(f"File not found: {source_path}")
+        return None
+    file_ext = os.path.splitext(source_path)[1].lower()
+    try:
+        if file_ext == ".csv":
+            return pd.read_csv(source_path, chunksize=chunk_size)
+        if file_ext in (".json", ".jsonl", ".ndjson"):
+            if _is_json_lines(source_path):
+                return pd.read_json(source_path, lines=True, chunksize=chunk_size)
+            logger.warning(f"{source_path} is not JSON lines; it cannot be streamed and is read at once.")
+            df = pd.read_json(source_path)
+            return (df.iloc[i:i + chunk_size] for i in range(0, len(df), chunk_size))
+    except (ValueError, OSError) as e:
+        # pandas' EmptyDataError and ParserError are ValueErrors too
+        logger.error(f"Cannot read {source_path}: {e}")
+        return None
+    logger.warning("Unsupported file format. Please use CSV or JSON.")
+    return None
+
+
+def _is_json_lines(source_path):
+    """
+    True if the first non-blank line of the file is a complete JSON object on its own, i.e. a
+    record. A JSON document starting with '{' that spreads over several lines, or a one-line
+    frame such as {"column": {"row": value}}, is read as a whole instead.
+    """
+    with open(source_path, "r", encoding="utf-8") as f:
+        while True:
+            ch = f.read(1)
+            if not ch or not ch.isspace():
+                break
+        if ch != "{":
+            return False
+        try:
+            record = json.loads(ch + f.readline())
+        except ValueError:
+            return False
+        if not isinstance(record, dict):
+            return False
+        if any(line.strip() for line in f):
+            return True
+        return not record or not all(isinstance(value, dict) for value in record.values())
+
+
+class NameDeduplicator:
+    """
+    Drops rows whose 'name' was already seen, within a chunk and across all earlier chunks.
+    Only 64-bit hashes of the names are remembered, so the state is a few dozen bytes
+    per distinct recipe rather than a copy of the data.
+    """
+
+    def __init__(self, column="name"):
+        self.column = column
+        self.seen = set()
+        self.dropped = 0
+
+    def filter(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        if self.column not in chunk.columns or chunk.empty:
+            return chunk
+        hashes = pd.util.hash_pandas_object(chunk[self.column], index=False)
+        # First occurrence inside the chunk, and not seen in any earlier chunk
+        keep = ~hashes.duplicated() & ~hashes.isin(self.seen)
+        self.seen.update(hashes[keep].tolist())
+        self.dropped += int((~keep).sum())
+        return chunk[keep.values]
+
+    def remember(self, chunk: pd.DataFrame):
+        """
+        Marks the names of 'chunk' as seen without filtering it, for chunks that an earlier
+        attempt of the run loaded already (see etl/ledger.py).
+        """
+        if self.column in chunk.columns and not chunk.empty:
+            self.seen.update(pd.util.hash_pandas_object(chunk[self.column], index=False).tolist())
+
+
+def run_pipeline(chunks, transform, load, queue_size=STREAM_QUEUE_SIZE, progress=None):
+    """
+    Runs extract + transform on a producer thread and load on the calling thread,
+    connected through a bounded queue: while chunk N is being loaded, chunk N+1 is
+    already being parsed and transformed, and never more than 'queue_size' chunks
+    are held in memory. An exception on either side stops both and is re-raised.
+    'progress(stats)' is called after every loaded chunk; returning False stops the
+    run there (chunks loaded so far stay loaded) and sets stats['cancelled'].
+    Returns a dict with chunk/row counts and timings.
+    """
+    handoff = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    stats = {"chunks": 0, "rows_in": 0, "rows_loaded": 0, "transform_s": 0.0, "load_s": 0.0, "cancelled": False}
+
+    def put(item):
+        # Wait for room without blocking forever if the consumer died
+        while not stop.is_set():
+            try:
+                handoff.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    return
+                started = time.perf_counter()
+                stats["rows_in"] += len(chunk)
+                transformed = transform(chunk)
+                stats["transform_s"] += time.perf_counter() - started
+                if not put(transformed):
+                    return
+            put(_DONE)
+        except BaseException as exc:
+            put(exc)
+
+    producer = threading.Thread(target=produce, name="etl-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = handoff.get()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            started = time.perf_counter()
+            load(item)
+            stats["load_s"] += time.perf_counter() - started
+            stats["chunks"] += 1
+            stats["rows_loaded"] += len(item)
+            logger.debug(f"Loaded chunk {stats['chunks']} ({len(item)} rows).")
+            if progress is not None and progress(dict(stats)) is False:
+                stats["cancelled"] = True
+                logger.info(f"Pipeline cancelled after {stats['chunks']} chunks.")
+                break
+    finally:
+        stop.set()
+        producer.join()
+    return stats
@@ -0,0 +1,51 @@
+import hashlib
+
+from db.bulk_load import RECIPE_LOAD_COLUMNS
+from etl.ingredients import add_ingredients_info
+
+# Source column -> recipe column
+RENAME_MAP = {
+    "recipe_name": "name",
+    "ingredients_list": "instructions",
+    "prep_time": "cooking_time_minutes",
+}
+
+
+def _ingredients_text(info):
+    if not isinstance(info, list):
+        return ""
+    return "\x1e".join(f"{e.get('name')}\x1f{e.get('quantity')}\x1f{e.get('unit')}\x1f{e.get('optional')}"
+                       for e in info)
+
+
+def add_content_hashes(df):
+    """
+    Sets 'content_hash', a 128-bit hash of everything a recipe row loads (the recipe columns
+    and the parsed ingredients). Loads are upserts keyed on it (see db/bulk_load.py), so loading
+    the same recipe again, e.g. when a crashed run is restarted, adds nothing.
+    """
+    columns = [c for c in RECIPE_LOAD_COLUMNS if c in df.columns]
+    # Column name and value, so that moving a value to another column changes the hash
+    parts = [f"{c}=" + df[c].astype(object).where(df[c].notna(), "").astype(str) for c in columns]
+    if "ingredients_info" in df.columns:
+        parts.append(df["ingredients_info"].map(_ingredients_text))
+    if not parts:
+        return df
+    text = parts[0].str.cat(parts[1:], sep="\x1d")
+    df["content_hash"] = [hashlib.blake2b(value.encode("utf-8"), digest_size=16).hexdigest() for value in text]
+    return df
+
+
+def transform_recipes(data):
+    """
+    Transforms extracted data to fit the recipe schema: parses the raw ingredient lines into
+    'ingredients_info' (see etl/ingredients.py), renames the source columns, drops rows with
+    a duplicate name and adds the content hash. A plain module function, so that worker
+    processes can run it (see etl/parallel.py); RecipeApp.transform_data wraps it with logging.
+    """
+    # The raw ingredient list itself still becomes the instructions text
+    transformed = add_ingredients_info(data.copy())
+    transformed.rename(columns=RENAME_MAP, inplace=True)
+    if "name" in transformed.columns:
+        transformed.drop_duplicates(subset=["name"], inplace=True)
+    return add_content_hashes(transformed)
@@ -1,36 +1,81 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
 import logging.config
-import mysql.connector
 import os
-import pandas as pd
-import yaml
+import threading
+import time
 
-from flask import Flask, request, redirect, url_for, render_template_string
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import TYPE_CHECKING
+from flask import (Blueprint, Flask, Response, abort, current_app, request, redirect, url_for, render_template_string,
+                   jsonify, make_response, send_file, stream_with_context)
+from werkzeug.http import is_resource_modified
+from werkzeug.local import LocalProxy
 
 ########################
 # IMPORT DB CONFIG & OPTIONAL TABLE CREATION
 ########################
-from db.db import db_configuration
+from db.cache import FINGERPRINT_TTL, ReadThroughCache, SQLiteCacheBackend
+from db.category_tree import CATEGORY_TREE_TTL, CategoryTree, add_category, fetch_subtree_recipes, move_category
+from db.db import (KEYSET_TABLES, RECIPE_FETCH_COLUMNS, db_configuration, fetch_recipes_with_ingredients,
+                   fetch_rows_after, iter_recipes_with_ingredients, table_fingerprint)
+from db.fulltext import search_recipes
+from db.ingredient_index import INGREDIENT_INDEX_TTL, IngredientIndex
+from media.blob_store import MEDIA_TABLES, BlobStore, add_media, get_media
+from media.derivatives import DerivativePipeline
+from sync.change_log import install_change_log
 
 # from db.app_tables import create_app_tables  # optional if we want to auto-create the schema
-# from db.get_connection import get_db_connection  # if we prefer a function-based approach
+from db.get_connection import get_db_connection, get_pool_stats
+from db.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Importing this module must stay cheap: every pre-forked worker and every test pays for it.
+# pandas and the ETL modules are imported by the ETL methods that use them, MySQL Connector
+# loads with the first database call (see db/lazy.py), and nothing is configured or opened
+# until create_app() runs.
+mysql_connector = lazy_import("mysql.connector")
 
 ########################
 # LOGGING SETUP
 ########################
-try:
-    with open("logging.yaml", "r") as f:
-        config = yaml.safe_load(f)
-    logging.config.dictConfig(config)
-except FileNotFoundError:
-    logging.basicConfig(level=logging.DEBUG)
-    logging.warning("logging.yaml not found, using basicConfig at DEBUG level.")
+_logging_configured = False
+
+
+def configure_logging(path="logging.yaml"):
+    """
+    Applies the logging configuration once per process; create_app() calls it.
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    import yaml
+
+    try:
+        with open(path, "r") as f:
+            config = yaml.safe_load(f)
+        logging.config.dictConfig(config)
+    except FileNotFoundError:
+        logging.basicConfig(level=logging.DEBUG)
+        logging.warning(f"{path} not found, using basicConfig at DEBUG level.")
+
 
 logger = logging.getLogger("app")
 
 ########################
 # FLASK APP SETUP
 ########################
-app = Flask(__name__)
+# Routes are registered on a blueprint; create_app() builds the application around it
+bp = Blueprint("recipes", __name__)
+# The RecipeApp of the application handling the current request
+recipe_app = LocalProxy(lambda: current_app.extensions["recipe_app"])
 
 
 ########################
@@ -45,6 +90,19 @@ class RecipeApp:
         self.db_config = db_config
         self.logger = logging.getLogger("app")
         self.logger.debug("Initializing RecipeApp with given DB config.")
+        self._ingredient_index = None
+        self._ingredient_index_lock = threading.Lock()
+        self._category_tree = None
+        self._category_tree_lock = threading.Lock()
+        self._ingredient_resolver = None
+        self._ingredient_resolver_lock = threading.Lock()
+        self._change_log_installed = False
+        # Shared by all worker processes on this host, so one worker's writes invalidate the others' reads
+        self.cache = ReadThroughCache(SQLiteCacheBackend())
+        # Media directories are opened with the first media request (get_blob_store, get_derivatives)
+        self._blob_store = None
+        self._derivatives = None
+        self._media_lock = threading.Lock()
         self.initialize_database()
 
     def initialize_database(self):
@@ -59,18 +117,110 @@ class RecipeApp:
         # conn.close()
         self.logger.info("Database is ready or already set up.")
 
-    def run_etl_flow(self, source_path, load_type="historic"):
+    def run_etl_flow(self, source_path, load_type="historic", streaming=False, chunk_size=None):
         """
         Executes an ETL flow to migrate recipes into the database.
+        With streaming=True the file is processed in chunks of 'chunk_size' rows,
+        so memory stays flat regardless of the file size.
+        A directory or glob as 'source_path' runs the multi-file ETL (run_parallel_etl_flow)
+        and returns its statistics.
         """
+        from etl.parallel import is_multi_source
+
         self.logger.info(f"Running {load_type} ETL flow with source: {source_path}")
+        if is_multi_source(source_path):
+            return self.run_parallel_etl_flow(source_path, load_type, chunk_size)
+        if streaming:
+            return self.run_streaming_etl_flow(source_path, load_type, chunk_size)
         data = self.extract_data(source_path)
         if data is not None:
-            transformed_data = self.transform_data(data)
+            from etl.near_duplicates import NearDuplicateFilter
+
+            near_duplicates = NearDuplicateFilter()
+            transformed_data = near_duplicates.filter(self.transform_data(data))
+            self.logger.info(f"Dropped {near_duplicates.dropped} near-duplicate recipes.")
             self.load_data(transformed_data, load_type)
         else:
             self.logger.error(f"Failed to extract data from {source_path}")
 
+    def run_streaming_etl_flow(self, source_path, load_type="historic", chunk_size=None):
+        """
+        Chunked ETL: a producer thread reads and transforms chunk N+1 while chunk N is
+        being loaded. Duplicate names and near-duplicate recipes (etl/near_duplicates.py) are
+        dropped across the whole file, not just per chunk.
+        'chunk_size' defaults to STREAM_CHUNK_SIZE (ETL_CHUNK_SIZE).
+        Every loaded chunk is checkpointed in the ETL ledger, and running the flow again after
+        a crash or failure skips the chunks completed before (see etl/ledger.py).
+        Returns the pipeline statistics, or None if the flow failed.
+        """
+        from etl.ledger import ETLLedger
+        from etl.near_duplicates import NearDuplicateFilter
+        from etl.streaming import STREAM_CHUNK_SIZE, NameDeduplicator, iter_source_chunks, run_pipeline
+        from etl.transform import RENAME_MAP
+
+        chunk_size = chunk_size or STREAM_CHUNK_SIZE
+        chunks = iter_source_chunks(source_path, chunk_size)
+        if chunks is None:
+            self.logger.error(f"Failed to extract data from {source_path}")
+            return
+        deduplicator = NameDeduplicator()
+        near_duplicates = NearDuplicateFilter()
+        ledger = ETLLedger(lambda: get_db_connection("mysql", self.db_config), os.path.abspath(source_path), chunk_size)
+        try:
+            ledger.start()
+            stats = run_pipeline(
+                # Chunks completed by an earlier attempt are skipped, but their names still count as seen
+                ledger.pending(chunks, on_skip=lambda chunk: deduplicator.remember(chunk.rename(columns=RENAME_MAP))),
+                transform=lambda chunk: near_duplicates.filter(deduplicator.filter(self.transform_data(chunk))),
+                load=lambda chunk: ledger.chunk_loaded(self.load_data(chunk, load_type)),
+            )
+            status = ledger.finish("cancelled" if stats["cancelled"] else None)
+        except Exception as e:
+            # The run stays open in the ledger; running the flow again resumes it
+            self.logger.exception(f"Streaming ETL flow failed: {e}")
+            return None
+        stats.update(run_id=ledger.run_id, status=status, skipped_chunks=ledger.skipped)
+        self.logger.info(
+            f"Streamed {stats['rows_in']} rows in {stats['chunks']} chunks from {source_path}"
+            f"{f' (skipped {ledger.skipped} chunks completed before)' if ledger.skipped else ''}; "
+            f"loaded {stats['rows_loaded']}, dropped {deduplicator.dropped} duplicates by 'name' "
+            f"and {near_duplicates.dropped} near-duplicates "
+            f"(transform {stats['transform_s']:.1f}s, load {stats['load_s']:.1f}s)."
+        )
+        return stats
+
+    def run_parallel_etl_flow(self, source, load_type="historic", chunk_size=None, workers=None):
+        """
+        Multi-file ETL over a directory or glob of source files: the files are streamed chunk by
+        chunk, transform runs in a process pool ('workers' defaults to ETL_WORKERS), loads in
+        batches on pooled connections, and duplicates are dropped and ids assigned in file order
+        (see etl/parallel.py).
+        Returns the run statistics, or None if the flow failed.
+        """
+        from etl.parallel import ParallelETLRunner
+
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                resolver = self.get_ingredient_resolver(conn)
+            runner = ParallelETLRunner(lambda: get_db_connection("mysql", self.db_config), db_type="mysql",
+                                       resolver=resolver, workers=workers, chunk_size=chunk_size)
+            stats = runner.run(source)
+        except Exception as e:
+            self.logger.exception(f"Parallel ETL flow failed: {e}")
+            return None
+        finally:
+            # Even a partial load changes the lists
+            self.cache.invalidate("recipes", "ingredients")
+            self._ingredient_index = None
+        self.logger.info(
+            f"{load_type.capitalize()} ETL over {stats['files_done']} of {stats['files']} files from {source}: "
+            f"loaded {stats['rows_loaded']} of {stats['rows_in']} rows in {stats['batches']} batches, "
+            f"dropped {stats['duplicates']} duplicates by 'name' and "
+            f"{stats['near_duplicates'] + stats['stored_duplicates']} near-duplicates ({stats['seconds']:.1f}s)"
+            f"{' before being cancelled' if stats['cancelled'] else ''}."
+        )
+        return stats
+
     def extract_data(self, source_path):
         """
         Extracts data from a given source file (CSV or JSON).
@@ -79,6 +229,8 @@ class RecipeApp:
         if not os.path.exists(source_path):
             self.logger.error(f"File not found: {source_path}")
             return None
+        import pandas as pd
+
         file_ext = os.path.splitext(source_path)[1].lower()
         try:
             if file_ext == ".csv":
@@ -98,65 +250,260 @@ class RecipeApp:
         """
         Transforms extracted data to fit the centralized recipe repository schema.
         """
-        self.logger.debug("Transforming data...")
-        transformed_data = data.copy()
-        # Example rename
-        rename_map = {
-            "recipe_name": "name",
-            "ingredients_list": "instructions",  # or "ingredients"
-            "prep_time": "cooking_time_minutes",
-        }
-        transformed_data.rename(columns=rename_map, inplace=True)
-
-        # Example dedup
-        if "name" in transformed_data.columns:
-            old_count = len(transformed_data)
-            transformed_data.drop_duplicates(subset=["name"], inplace=True)
-            new_count = len(transformed_data)
-            self.logger.debug(f"Removed {old_count - new_count} duplicates by 'name'.")
+        from etl.transform import transform_recipes
 
+        self.logger.debug("Transforming data...")
+        transformed_data = transform_recipes(data)
+        self.logger.debug(f"Removed {len(data) - len(transformed_data)} duplicates by 'name'.")
         self.logger.info("Data transformation complete.")
         return transformed_data
 
     def load_data(self, data: pd.DataFrame, load_type: str):
         """
         Loads transformed data into the 'recipe' table.
+        Uses LOAD DATA LOCAL INFILE when the server allows it and a single-transaction
+        executemany otherwise (see db/bulk_load.py). Recipes loaded before (same content hash)
+        are skipped. Returns the number of new recipes, or None if the load failed.
         """
+        from db.bulk_load import bulk_load_recipes
+        from etl.near_duplicates import drop_stored_duplicates, store_frame_signatures
+
         self.logger.info(f"Loading data into the 'recipe' table for {load_type} flow.")
         try:
-            conn = mysql.connector.connect(**self.db_config)
-            cursor = conn.cursor()
-            insert_sql = """
-                INSERT INTO recipe (name, instructions, cooking_time_minutes)
-                VALUES (%s, %s, %s)
-            """
-            count = 0
-            for _, row in data.iterrows():
-                name = row.get("name", "")
-                instructions = row.get("instructions", "")
-                cooking_time = row.get("cooking_time_minutes", None)
-                cursor.execute(insert_sql, (name, instructions, cooking_time))
-                count += 1
-            conn.commit()
-            self.logger.info(f"{load_type.capitalize()} load complete. Inserted {count} rows.")
-        except mysql.connector.Error as err:
+            conn = get_db_connection("mysql", self.db_config)
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error during data loading: {err}")
+            return
+        with_ingredients = "ingredients_info" in data.columns
+        loaded = None
+        try:
+            # Copies of recipes loaded by earlier runs; the ETL stage only knows this run
+            data, known = drop_stored_duplicates(conn, data, db_type="mysql")
+            if known:
+                self.logger.info(f"Skipped {known} near-duplicates of stored recipes.")
+            if with_ingredients:
+                self.get_ingredient_resolver(conn).resolve_chunk(conn, data)
+            result = bulk_load_recipes(conn, data, db_type="mysql")
+            store_frame_signatures(conn, result["recipe_ids"], data, db_type="mysql")
+            if with_ingredients:
+                with self._ingredient_index_lock:
+                    if self._ingredient_index is not None:
+                        self._ingredient_index.add_loaded(result["recipe_ids"], data["ingredients_info"])
+            self.logger.info(
+                f"{load_type.capitalize()} load complete. Inserted {result['rows']} rows "
+                f"via {result['method']} ({result['rows_per_second']:.0f} rows/s) "
+                f"and {result['ingredient_rows']} recipe_ingredient rows."
+            )
+            loaded = result["rows"]
+        except mysql_connector.Error as err:
             self.logger.exception(f"Error during data loading: {err}")
         finally:
-            cursor.close()
             conn.close()
+            # Even a partial load changes the recipe list
+            self.cache.invalidate("recipes")
+            if with_ingredients:
+                self.cache.invalidate("ingredients")
+                if loaded is None:
+                    # What a failed load committed is unknown: rebuild on the next query
+                    self._ingredient_index = None
+        return loaded
 
+    def get_ingredient_resolver(self, conn):
+        """
+        Returns the ingredient name resolver, loading it from the ingredient and ingredient_alias
+        tables on first use and again once it is older than RESOLVER_TTL. It lives across ETL
+        chunks and runs, so every spelling is matched only once per process.
+        """
+        from etl.ingredient_resolver import RESOLVER_TTL, IngredientResolver
 
-########################
-# INSTANTIATE THE RECIPE APP
-########################
-recipe_app = RecipeApp(db_configuration)
+        with self._ingredient_resolver_lock:
+            resolver = self._ingredient_resolver
+            if resolver is None or time.monotonic() - resolver.built_at > RESOLVER_TTL:
+                resolver = IngredientResolver.from_db(conn)
+                self._ingredient_resolver = resolver
+                self.logger.info(f"Loaded ingredient resolver over {len(resolver)} ingredients.")
+            return resolver
+
+    def list_recipes(self, limit=50):
+        """
+        Returns up to 'limit' recipes as dicts, read through the shared cache.
+        Entries are keyed by the table version, so changes made by other apps show up within FINGERPRINT_TTL.
+        """
+        def load():
+            with get_db_connection("mysql", self.db_config) as conn:
+                cursor = conn.cursor(dictionary=True)
+                # photo_id: the recipe's first photo, if any (served by the recipe_photo primary key)
+                cursor.execute("""
+                    SELECT id, name, instructions, cooking_time_minutes,
+                           (SELECT MIN(rp.photo_id) FROM recipe_photo rp WHERE rp.recipe_id = recipe.id) AS photo_id
+                    FROM recipe
+                    LIMIT %s
+                """, (limit,))
+                rows = cursor.fetchall()
+                cursor.close()
+            return rows
+
+        try:
+            etag, _ = self.recipes_version()
+            return self.cache.get_or_load("recipes", (limit, etag), load)
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error fetching recipes: {err}")
+        return []
+
+    def recipes_version(self):
+        """
+        Returns (etag, last_modified) for the recipe table, or (None, None) if the database is unreachable.
+        The version comes from the sync change log, which sees every write to the table (see
+        db.db.table_fingerprint); the log is installed with the first lookup of this process.
+        The fingerprint is cached for FINGERPRINT_TTL seconds and dropped at once by this app's own writes.
+        """
+        def load():
+            with get_db_connection("mysql", self.db_config) as conn:
+                if not self._change_log_installed:
+                    install_change_log(conn, db_type="mysql")
+                    self._change_log_installed = True
+                return table_fingerprint(conn, "recipe", db_type="mysql")
+
+        try:
+            fingerprint = self.cache.get_or_load("recipes", "fingerprint", load, ttl=FINGERPRINT_TTL)
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error reading the recipe fingerprint: {err}")
+            return None, None
+        etag = hashlib.sha1(repr(fingerprint).encode()).hexdigest()[:20]
+        last_modified = fingerprint[1]
+        if last_modified is not None:
+            # HTTP dates have whole seconds; a fractional one would never compare as unmodified
+            last_modified = last_modified.replace(microsecond=0)
+            # TIMESTAMP columns come back as naive datetimes in the session's time zone, set to UTC in db_configuration
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return etag, last_modified
+
+    def search_recipes(self, query, page=1, per_page=20):
+        """
+        Full-text search over recipe names and instructions (see db/fulltext.py).
+        Returns a list of {'id', 'name', 'name_es', 'score', 'snippet'} dicts, best match first.
+        """
+        rows = []
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                rows = search_recipes(conn, query, db_type="mysql", limit=per_page, offset=(page - 1) * per_page)
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error searching recipes: {err}")
+        return rows
+
+    def get_blob_store(self):
+        """
+        Returns the blob store, created with the first media access rather than at startup.
+        """
+        with self._media_lock:
+            if self._blob_store is None:
+                self._blob_store = BlobStore()
+            return self._blob_store
+
+    def get_derivatives(self):
+        """
+        Returns the thumbnail pipeline, created with the first media access rather than at
+        startup; its cache counts the derivative directory in the background (see media/derivatives.py).
+        """
+        blob_store = self.get_blob_store()
+        with self._media_lock:
+            if self._derivatives is None:
+                self._derivatives = DerivativePipeline(blob_store)
+            return self._derivatives
+
+    def get_ingredient_index(self):
+        """
+        Returns the in-memory ingredient index, building it from recipe_ingredient on first
+        use and again once it is older than INGREDIENT_INDEX_TTL (other processes may insert too).
+        """
+        with self._ingredient_index_lock:
+            index = self._ingredient_index
+            if index is None or time.monotonic() - index.built_at > INGREDIENT_INDEX_TTL:
+                with get_db_connection("mysql", self.db_config) as conn:
+                    index = IngredientIndex.from_db(conn)
+                self._ingredient_index = index
+                self.logger.info(f"Built ingredient index over {len(index)} ingredients.")
+            return index
+
+    def find_recipes_by_ingredients(self, ingredient_ids, mode="all", max_missing=0, limit=50):
+        """
+        mode='all': ids of recipes using every given ingredient,
+        mode='any': ids of recipes using at least one of them,
+        mode='cook': recipes cookable with them, missing at most 'max_missing' ingredients,
+        ranked by coverage (see IngredientIndex.what_can_i_cook).
+        """
+        try:
+            index = self.get_ingredient_index()
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error building ingredient index: {err}")
+            return []
+        if mode == "all":
+            return index.recipes_with_all(ingredient_ids)[:limit]
+        if mode == "any":
+            return index.recipes_with_any(ingredient_ids)[:limit]
+        if mode == "cook":
+            return index.what_can_i_cook(ingredient_ids, max_missing=max_missing, limit=limit)
+        raise ValueError(f"Unsupported ingredient search mode: {mode}")
+
+    def get_category_tree(self):
+        """
+        Returns the in-memory category hierarchy (see db/category_tree.py), loaded on first
+        use and again after category writes or once older than CATEGORY_TREE_TTL.
+        """
+        with self._category_tree_lock:
+            tree = self._category_tree
+            if tree is None or time.monotonic() - tree.built_at > CATEGORY_TREE_TTL:
+                with get_db_connection("mysql", self.db_config) as conn:
+                    tree = CategoryTree.from_db(conn)
+                self._category_tree = tree
+            return tree
+
+    def add_category(self, name, parent_category_id=None):
+        """
+        Inserts a category below 'parent_category_id' (None for a top-level one) and returns its id.
+        """
+        category_id = None
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                category_id = add_category(conn, name, parent_category_id, db_type="mysql")
+            self._category_tree = None
+            self.cache.invalidate("categories")
+            self.logger.info(f"Inserted new category: {name}")
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error inserting new category: {err}")
+        return category_id
+
+    def move_category(self, category_id, new_parent_id):
+        """
+        Moves a category, with all its subcategories, below 'new_parent_id'.
+        """
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                move_category(conn, category_id, new_parent_id, db_type="mysql")
+            self._category_tree = None
+            self.cache.invalidate("categories")
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error moving category {category_id}: {err}")
+
+    def list_category_recipes(self, category_id, limit=50, after_id=None):
+        """
+        Recipes in a category or any of its subcategories, one page at a time:
+        pass the last id of the previous page as 'after_id'.
+        """
+        rows = []
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                rows = fetch_subtree_recipes(conn, category_id, limit=limit, after_id=after_id, db_type="mysql")
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error fetching recipes of category {category_id}: {err}")
+        return rows
 
 
 ########################
 # FLASK ROUTES
 ########################
 
-@app.route("/")
+@bp.route("/")
 def main_menu():
     """
     Displays a simple menu to the user. This acts like a 'home page.'
@@ -164,38 +511,54 @@ def main_menu():
     return render_template_string("""
     <h1>Single Sauce of Truth</h1>
     <ul>
-      <li><a href="{{ url_for('list_recipes') }}">List Recipes</a></li>
-      <li><a href="{{ url_for('add_recipe') }}">Add a New Recipe</a></li>
-      <li><a href="{{ url_for('run_etl') }}">Run ETL Flow (Example)</a></li>
+      <li><a href="{{ url_for('.list_recipes') }}">List Recipes</a></li>
+      <li><a href="{{ url_for('.search') }}">Search Recipes</a></li>
+      <li><a href="{{ url_for('.list_categories') }}">Browse Categories</a></li>
+      <li><a href="{{ url_for('.add_recipe') }}">Add a New Recipe</a></li>
+      <li><a href="{{ url_for('.run_etl') }}">Run ETL Flow (Example)</a></li>
     </ul>
     """)
 
 
-@app.route("/recipes")
+@bp.route("/recipes")
 def list_recipes():
     """
     Shows a simple list of recipes from the 'recipe' table.
+    Supports conditional GET: unchanged data is answered with 304 and an empty body, and the
+    rendered table is cached per table version, so refreshes cost one cached fingerprint lookup.
     """
     logger.debug("User requested to list recipes.")
-    try:
-        conn = mysql.connector.connect(**db_configuration)
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, name, instructions, cooking_time_minutes FROM recipe LIMIT 50")
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-    except mysql.connector.Error as err:
-        logger.exception(f"Error fetching recipes: {err}")
-        rows = []
+    etag, last_modified = recipe_app.recipes_version()
+    if etag is None:
+        return render_recipe_list()
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response("", 304)
+    else:
+        response = make_response(recipe_app.cache.get_or_load("recipes", ("html", etag), render_recipe_list))
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Browsers may keep the page but must revalidate it on every use
+    response.cache_control.no_cache = True
+    return response
+
+
+def render_recipe_list():
+    rows = recipe_app.list_recipes(limit=50)
 
     # Basic HTML rendering
     html = """
     <h2>Recipe List (showing up to 50)</h2>
     <a href="/">Back to Main Menu</a>
     <table border="1">
-      <tr><th>ID</th><th>Name</th><th>Instructions</th><th>Cooking Time (min)</th></tr>
+      <tr><th></th><th>ID</th><th>Name</th><th>Instructions</th><th>Cooking Time (min)</th></tr>
       {% for row in rows %}
       <tr>
+        <td>
+          {% if row.photo_id %}
+          <img src="{{ url_for('.serve_thumbnail', kind='photos', media_id=row.photo_id, width=64) }}"
+               width="64" loading="lazy" alt="">
+          {% endif %}
+        </td>
         <td>{{ row.id }}</td>
         <td>{{ row.name }}</td>
         <td>{{ row.instructions }}</td>
@@ -207,7 +570,96 @@ def list_recipes():
     return render_template_string(html, rows=rows)
 
 
-@app.route("/add_recipe", methods=["GET", "POST"])
+@bp.route("/search")
+def search():
+    """
+    Full-text recipe search with ranked, highlighted and paginated results.
+    """
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = 20
+    results = recipe_app.search_recipes(query, page=page, per_page=per_page) if query else []
+    html = """
+    <h2>Search Recipes</h2>
+    <a href="/">Back to Main Menu</a>
+    <form method="GET">
+      <input type="text" name="q" value="{{ query }}" required>
+      <button type="submit">Search</button>
+    </form>
+    {% if query %}
+    <ol start="{{ (page - 1) * per_page + 1 }}">
+      {% for r in results %}
+      <li><b>{{ r.name }}</b>{% if r.name_es %} ({{ r.name_es }}){% endif %}<br>{{ r.snippet|safe }}</li>
+      {% else %}
+      <p>No recipes found.</p>
+      {% endfor %}
+    </ol>
+    {% if page > 1 %}<a href="{{ url_for('.search', q=query, page=page - 1) }}">Previous</a>{% endif %}
+    {% if results|length == per_page %}<a href="{{ url_for('.search', q=query, page=page + 1) }}">Next</a>{% endif %}
+    {% endif %}
+    """
+    return render_template_string(html, query=query, page=page, per_page=per_page, results=results)
+
+
+@bp.route("/categories")
+def list_categories():
+    """
+    Shows the category hierarchy as an indented list, served from the in-memory category tree.
+    """
+    try:
+        tree = recipe_app.get_category_tree()
+        entries = list(tree.walk())
+    except mysql_connector.Error as err:
+        logger.exception(f"Error loading categories: {err}")
+        entries = []
+    html = """
+    <h2>Categories</h2>
+    <a href="/">Back to Main Menu</a>
+    <ul>
+      {% for depth, category_id, name in entries %}
+      <li style="margin-left: {{ depth * 1.5 }}em">
+        <a href="{{ url_for('.category_recipes', category_id=category_id) }}">{{ name }}</a>
+      </li>
+      {% endfor %}
+    </ul>
+    """
+    return render_template_string(html, entries=entries)
+
+
+@bp.route("/categories/<int:category_id>")
+def category_recipes(category_id):
+    """
+    Breadcrumb and recipes of a category including all its subcategories, paged by ?after=<last id>.
+    """
+    after_id = request.args.get("after", type=int)
+    try:
+        breadcrumb = recipe_app.get_category_tree().breadcrumb(category_id)
+    except mysql_connector.Error as err:
+        logger.exception(f"Error loading categories: {err}")
+        breadcrumb = []
+    per_page = 50
+    rows = recipe_app.list_category_recipes(category_id, limit=per_page, after_id=after_id)
+    html = """
+    <a href="{{ url_for('.list_categories') }}">All Categories</a>
+    {% for crumb in breadcrumb %} &gt;
+      <a href="{{ url_for('.category_recipes', category_id=crumb.id) }}">{{ crumb.name }}</a>
+    {% endfor %}
+    <ul>
+      {% for row in rows %}
+      <li>{{ row.name }}</li>
+      {% else %}
+      <p>No recipes in this category.</p>
+      {% endfor %}
+    </ul>
+    {% if rows|length == per_page %}
+    <a href="{{ url_for('.category_recipes', category_id=category_id, after=rows[-1].id) }}">Next</a>
+    {% endif %}
+    """
+    return render_template_string(html, breadcrumb=breadcrumb, rows=rows, per_page=per_page,
+                                  category_id=category_id)
+
+
+@bp.route("/add_recipe", methods=["GET", "POST"])
 def add_recipe():
     """
     GET: Display a form for creating a new recipe.
@@ -224,23 +676,23 @@ def add_recipe():
         # We can add them to the form later when we have time and store them similarly.
 
         try:
-            conn = mysql.connector.connect(**db_configuration)
-            cursor = conn.cursor()
-            insert_sql = """
-                INSERT INTO recipe (name, instructions, cooking_time_minutes, difficulty, source)
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            # Convert cooking_time to int if provided
-            cooking_time_int = int(cooking_time) if cooking_time.isdigit() else None
-            cursor.execute(insert_sql, (name, instructions, cooking_time_int, difficulty, source))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with get_db_connection("mysql", recipe_app.db_config) as conn:
+                cursor = conn.cursor()
+                insert_sql = """
+                    INSERT INTO recipe (name, instructions, cooking_time_minutes, difficulty, source)
+                    VALUES (%s, %s, %s, %s, %s)
+                """
+                # Convert cooking_time to int if provided
+                cooking_time_int = int(cooking_time) if cooking_time.isdigit() else None
+                cursor.execute(insert_sql, (name, instructions, cooking_time_int, difficulty, source))
+                conn.commit()
+                cursor.close()
+            recipe_app.cache.invalidate("recipes")
             logger.info(f"Inserted new recipe: {name}")
-        except mysql.connector.Error as err:
+        except mysql_connector.Error as err:
             logger.exception(f"Error inserting new recipe: {err}")
 
-        return redirect(url_for("list_recipes"))
+        return redirect(url_for(".list_recipes"))
     else:
         # GET request: display form
         html_form = """
@@ -275,24 +727,351 @@ def add_recipe():
         return render_template_string(html_form)
 
 
-@app.route("/run_etl")
+@bp.route("/recipes/by_ingredients")
+def recipes_by_ingredients():
+    """
+    JSON ingredient search, e.g. /recipes/by_ingredients?ids=3,7&mode=cook&max_missing=1
+    mode: 'all' (every ingredient), 'any' (at least one), 'cook' (ranked by coverage).
+    """
+    try:
+        ingredient_ids = [int(i) for i in request.args.get("ids", "").split(",") if i.strip()]
+        max_missing = int(request.args.get("max_missing", 0))
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return jsonify({"error": "ids, max_missing and limit must be integers"}), 400
+    mode = request.args.get("mode", "all")
+    if mode not in ("all", "any", "cook"):
+        return jsonify({"error": f"Unsupported mode: {mode}"}), 400
+    results = recipe_app.find_recipes_by_ingredients(ingredient_ids, mode=mode, max_missing=max_missing, limit=limit)
+    return jsonify(results)
+
+
+@bp.route("/media/<kind>", methods=["POST"])
+def upload_media(kind):
+    """
+    Stores an uploaded photo or video (form field 'file') in the blob store; identical
+    files are kept once. With a 'recipe_id' form field it is linked to that recipe.
+    """
+    table = kind.rstrip("s")
+    upload = request.files.get("file")
+    if table not in MEDIA_TABLES or upload is None:
+        return jsonify({"error": "POST a 'file' to /media/photo or /media/video"}), 400
+    try:
+        blob_store = recipe_app.get_blob_store()
+        with get_db_connection("mysql", recipe_app.db_config) as conn:
+            media_id, sha256 = add_media(conn, blob_store, table, upload.stream, upload.mimetype)
+            recipe_id = request.form.get("recipe_id", type=int)
+            if recipe_id is not None:
+                cursor = conn.cursor()
+                cursor.execute(f"INSERT INTO recipe_{table} (recipe_id, {table}_id) VALUES (%s, %s)",
+                               (recipe_id, media_id))
+                conn.commit()
+                cursor.close()
+    except mysql_connector.Error as err:
+        logger.exception(f"Error storing {table}: {err}")
+        return jsonify({"error": "database error"}), 503
+    recipe_app.get_derivatives().submit(table, sha256)
+    return jsonify({"id": media_id, "sha256": sha256}), 201
+
+
+@bp.route("/media/<kind>/<int:media_id>")
+def serve_media(kind, media_id):
+    """
+    Streams a photo or video from the blob store. send_file hands the open file to the WSGI
+    server's file wrapper (sendfile where available) and answers Range requests, so video
+    players can seek. Blobs never change, so they are cacheable forever under their hash.
+    """
+    table = kind.rstrip("s")
+    if table not in MEDIA_TABLES:
+        abort(404)
+    try:
+        with get_db_connection("mysql", recipe_app.db_config) as conn:
+            media = get_media(conn, table, media_id)
+    except mysql_connector.Error as err:
+        logger.exception(f"Error looking up {table} {media_id}: {err}")
+        abort(503)
+    blob_store = recipe_app.get_blob_store()
+    if media is None or not blob_store.exists(media["sha256"]):
+        abort(404)
+    return send_file(blob_store.path(media["sha256"]),
+                     mimetype=media["content_type"] or "application/octet-stream",
+                     conditional=True, etag=media["sha256"], max_age=365 * 24 * 3600)
+
+
+@bp.route("/media/<kind>/<int:media_id>/thumb/<int:width>")
+def serve_thumbnail(kind, media_id, width):
+    """
+    The smallest rendered variant at least 'width' px wide: a thumbnail for photos, a poster
+    frame for videos. Until it has been rendered, photos fall back to the original.
+    """
+    table = kind.rstrip("s")
+    if table not in MEDIA_TABLES:
+        abort(404)
+    try:
+        with get_db_connection("mysql", recipe_app.db_config) as conn:
+            media = get_media(conn, table, media_id)
+    except mysql_connector.Error as err:
+        logger.exception(f"Error looking up {table} {media_id}: {err}")
+        abort(503)
+    if media is None:
+        abort(404)
+    path = recipe_app.get_derivatives().variant(table, media["sha256"], width)
+    if path is not None:
+        return send_file(path, mimetype="image/jpeg", conditional=True, max_age=24 * 3600)
+    if table == "photo":
+        return redirect(url_for(".serve_media", kind=kind, media_id=media_id))
+    abort(404)
+
+
+@bp.route("/stats/pool")
+def pool_stats():
+    """
+    Reports connection pool usage and checkout-wait statistics as JSON.
+    """
+    return jsonify(get_pool_stats())
+
+
+@bp.route("/stats/cache")
+def cache_stats():
+    """
+    Reports read-through cache hits and misses of this worker process as JSON.
+    """
+    return jsonify(recipe_app.cache.stats())
+
+
+# Directory the /run_etl route reads source files from; nothing outside it can be named
+ETL_SOURCE_DIR = os.environ.get("ETL_SOURCE_DIR", "data")
+
+
+@bp.route("/run_etl")
 def run_etl():
     """
-    Example route that triggers the ETL flow on a given file.
+    Triggers the ETL flow on the source named by the 'source' query parameter, relative to
+    ETL_SOURCE_DIR: a file, a subdirectory or a glob such as 'exports/*.csv'. Without it every
+    file in ETL_SOURCE_DIR is loaded; several files are spread over worker processes
+    (see etl/parallel.py).
     """
-    # For the sake of demo, let's use a static path or you could pass it as a query param
-    source_path = "data/historic_recipes.csv"
-    recipe_app.run_etl_flow(source_path, load_type="historic")
-    return """
-    <h3>ETL flow triggered.</h3>
+    root = os.path.abspath(ETL_SOURCE_DIR)
+    source_path = os.path.abspath(os.path.join(root, request.args.get("source", "")))
+    if os.path.commonpath([root, source_path]) != root:
+        abort(400)
+    stats = recipe_app.run_etl_flow(source_path, load_type="historic", streaming=True)
+    if stats is None:
+        return """
+    <h3>ETL flow failed, see the log.</h3>
     <a href="/">Back to Main Menu</a>
+    """, 500
+    return f"""
+    <h3>ETL flow finished: {stats['rows_loaded']} of {stats['rows_in']} rows loaded.</h3>
+    <a href="/">Back to Main Menu</a>
+    """
+
+
+########################
+# JSON API ROUTES
+########################
+API_MAX_PAGE = 1000
+API_EXPORT_PAGE = 500
+
+
+def json_ready(row):
+    """
+    Makes a row JSON-serializable: dates as ISO 8601, DECIMAL as strings.
+    """
+    ready = {}
+    for key, value in row.items():
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        elif isinstance(value, list):
+            value = [json_ready(item) for item in value]
+        ready[key] = value
+    return ready
+
+
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Turns an opaque ?after= token back into its values; raises ValueError if it was tampered with.
+    """
+    try:
+        return json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError) as err:
+        raise ValueError(f"Invalid cursor: {token}") from err
+
+
+def parse_api_args(allowed_fields):
+    """
+    Reads limit, after and fields from the query string; raises ValueError on bad input.
+    """
+    limit = int(request.args.get("limit", 50))
+    if not 1 <= limit <= API_MAX_PAGE:
+        raise ValueError(f"limit must be between 1 and {API_MAX_PAGE}")
+    after = decode_cursor(request.args["after"]) if request.args.get("after") else None
+    fields = None
+    if request.args.get("fields"):
+        fields = [f.strip() for f in request.args["fields"].split(",") if f.strip()]
+        unknown = set(fields) - set(allowed_fields)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return limit, after, fields
+
+
+def wants_ndjson():
+    return (request.args.get("format") == "ndjson"
+            or request.accept_mimetypes.best == "application/x-ndjson")
+
+
+def sparse(row, fields):
+    return {key: row[key] for key in fields if key in row} if fields else row
+
+
+def ndjson_response(conn, rows):
+    """
+    Streams 'rows' as newline-delimited JSON while they are read; the connection goes back
+    to the pool when the stream ends or the client disconnects.
+    """
+    def generate():
+        try:
+            for row in rows:
+                yield json.dumps(json_ready(row)) + "\n"
+        finally:
+            conn.close()
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    # A body that is never iterated (HEAD, a client gone before the first chunk) never reaches
+    # the finally above; the server closes every response, and a second close() is a no-op
+    response.call_on_close(conn.close)
+    return response
+
+
+@bp.route("/api/recipes")
+def api_recipes():
+    """
+    Recipes with their ingredients, keyset-paginated.
+      ?order=id|created_at    page order (default id)
+      ?limit=50&after=<next>  page size and the 'next' cursor of the previous page
+      ?fields=id,name,ingredients   sparse field selection
+      ?format=ndjson (or Accept: application/x-ndjson)   stream everything after the cursor
+    """
+    order_by = request.args.get("order", "id")
+    try:
+        if order_by not in ("id", "created_at"):
+            raise ValueError(f"Unsupported order: {order_by}")
+        limit, after, fields = parse_api_args(RECIPE_FETCH_COLUMNS + ("ingredients",))
+        after_created_at, after_id = None, None
+        if after and order_by == "created_at":
+            after_created_at, after_id = after
+        elif after:
+            after_id = int(after[0])
+    except (ValueError, TypeError, IndexError) as err:
+        return jsonify({"error": str(err)}), 400
+    columns = [f for f in fields if f != "ingredients"] if fields else RECIPE_FETCH_COLUMNS
+    options = {
+        "columns": columns,
+        "with_ingredients": not fields or "ingredients" in fields,
+        "order_by": order_by,
+        "after_created_at": after_created_at,
+    }
+    try:
+        conn = get_db_connection("mysql", recipe_app.db_config)
+    except mysql_connector.Error as err:
+        logger.exception(f"Error connecting for /api/recipes: {err}")
+        return jsonify({"error": "database unavailable"}), 503
+    if wants_ndjson():
+        rows = iter_recipes_with_ingredients(conn, after_id=after_id, db_type="mysql",
+                                             page_size=API_EXPORT_PAGE, **options)
+        return ndjson_response(conn, (sparse(row, fields) for row in rows))
+    try:
+        page = fetch_recipes_with_ingredients(conn, limit=limit, after_id=after_id, db_type="mysql", **options)
+    except mysql_connector.Error as err:
+        logger.exception(f"Error fetching /api/recipes: {err}")
+        return jsonify({"error": "database error"}), 503
+    finally:
+        conn.close()
+    next_cursor = None
+    if len(page) == limit:
+        last = page[-1]
+        keyset = (last["created_at"], last["id"]) if order_by == "created_at" else (last["id"],)
+        next_cursor = encode_cursor(*keyset)
+    return jsonify({"data": [json_ready(sparse(row, fields)) for row in page], "next": next_cursor})
+
+
+def api_table(table):
+    """
+    Shared handler for the flat keyset-paginated tables in KEYSET_TABLES.
+    """
+    try:
+        limit, after, fields = parse_api_args(KEYSET_TABLES[table])
+        after_id = int(after[0]) if after else None
+    except (ValueError, TypeError, IndexError) as err:
+        return jsonify({"error": str(err)}), 400
+    try:
+        conn = get_db_connection("mysql", recipe_app.db_config)
+    except mysql_connector.Error as err:
+        logger.exception(f"Error connecting for /api/{table}: {err}")
+        return jsonify({"error": "database unavailable"}), 503
+    if wants_ndjson():
+        def rows(after_id=after_id):
+            while True:
+                page = fetch_rows_after(conn, table, fields, after_id, API_EXPORT_PAGE, db_type="mysql")
+                yield from (sparse(row, fields) for row in page)
+                if len(page) < API_EXPORT_PAGE:
+                    return
+                after_id = page[-1]["id"]
+        return ndjson_response(conn, rows())
+    try:
+        page = fetch_rows_after(conn, table, fields, after_id, limit, db_type="mysql")
+    except mysql_connector.Error as err:
+        logger.exception(f"Error fetching /api/{table}: {err}")
+        return jsonify({"error": "database error"}), 503
+    finally:
+        conn.close()
+    next_cursor = encode_cursor(page[-1]["id"]) if len(page) == limit else None
+    return jsonify({"data": [json_ready(sparse(row, fields)) for row in page], "next": next_cursor})
+
+
+@bp.route("/api/ingredients")
+def api_ingredients():
+    """
+    Ingredients in id order; same limit/after/fields/format parameters as /api/recipes.
+    """
+    return api_table("ingredient")
+
+
+@bp.route("/api/categories")
+def api_categories():
+    """
+    Categories in id order; same limit/after/fields/format parameters as /api/recipes.
+    """
+    return api_table("category")
+
+
+########################
+# APP FACTORY
+########################
+def create_app(db_config=None, recipe_app=None, log_config="logging.yaml"):
+    """
+    Builds the Flask application, e.g. 'flask --app flask_main run' or
+    'gunicorn "flask_main:create_app()"'. Tests can pass their own 'recipe_app' and
+    log_config=None to leave logging alone.
     """
+    if log_config:
+        configure_logging(log_config)
+    app = Flask(__name__)
+    app.extensions["recipe_app"] = recipe_app or RecipeApp(db_config or db_configuration)
+    app.register_blueprint(bp)
+    return app
 
 
 ########################
 # MAIN EXECUTION
 ########################
 if __name__ == "__main__":
+    app = create_app()
     logger.info("Starting the Single Sauce of Truth Flask app...")
 
     # Example: If you want to do an ETL run at startup, do it here:
@@ -1,33 +1,66 @@
+from __future__ import annotations
+
 import logging.config
-import mysql.connector
 import os
-import pandas as pd
-import yaml
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING
 
 # Kivy imports
 import kivy
 
 kivy.require("2.1.0")  # or whatever version
 from kivy.app import App
+from kivy.properties import StringProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
+from kivy.uix.image import Image
 from kivy.uix.label import Label
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.uix.spinner import Spinner
 from kivy.uix.textinput import TextInput
 
+from db.cache import MemoryCacheBackend, ReadThroughCache
+from db.category_tree import CATEGORY_TREE_TTL, CategoryTree, add_category, fetch_subtree_recipes, move_category
 from db.db import db_configuration
+from db.fulltext import search_recipes
+from db.ingredient_index import INGREDIENT_INDEX_TTL, IngredientIndex
+from media.blob_store import BlobStore, get_media, get_media_many
+from media.derivatives import DerivativePipeline
+from db.get_connection import get_db_connection
+from db.lazy import lazy_import
+from sync.change_log import install_change_log
+from sync.engine import SYNC_DEVICE_ID, SyncEngine
+from ui.pager import KeysetPager
+from ui.tasks import BackgroundTasks
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# pandas (ETL only) and MySQL Connector (first database call) are not needed for the first frame,
+# and together they would take about half a second to import. pandas and the ETL modules are
+# imported where they are used; MySQL Connector loads on first attribute access (see db/lazy.py).
+mysql_connector = lazy_import("mysql.connector")
+
 
 ###############################################
 # LOGGING SETUP
 ###############################################
-try:
-    with open("logging.yaml", "r") as f:
-        config = yaml.safe_load(f)
-    logging.config.dictConfig(config)
-except FileNotFoundError:
-    logging.basicConfig(level=logging.DEBUG)
-    logging.warning("logging.yaml not found, using basicConfig at DEBUG level.")
+def configure_logging():
+    import yaml
+
+    try:
+        with open("logging.yaml", "r") as f:
+            config = yaml.safe_load(f)
+        logging.config.dictConfig(config)
+    except FileNotFoundError:
+        logging.basicConfig(level=logging.DEBUG)
+        logging.warning("logging.yaml not found, using basicConfig at DEBUG level.")
+
 
 logger = logging.getLogger("app")
 
@@ -45,6 +78,18 @@ class RecipeApp:
         self.db_config = db_config
         self.logger = logging.getLogger("app")
         self.logger.debug("Initializing RecipeApp with given DB config.")
+        self._ingredient_index = None
+        self._ingredient_index_lock = threading.Lock()
+        self._category_tree = None
+        self._category_tree_lock = threading.Lock()
+        self._ingredient_resolver = None
+        self._ingredient_resolver_lock = threading.Lock()
+        # List reads change rarely; add_* and ETL loads invalidate them (see db/cache.py)
+        self.cache = ReadThroughCache(MemoryCacheBackend())
+        # Media directories are opened with the first media access (get_blob_store, get_derivatives)
+        self._blob_store = None
+        self._derivatives = None
+        self._media_lock = threading.Lock()
         self.initialize_database()
 
     def initialize_database(self):
@@ -55,21 +100,118 @@ class RecipeApp:
     ######################
     # ETL-Related Methods
     ######################
-    def run_etl_flow(self, source_path, load_type="historic"):
+    def run_etl_flow(self, source_path, load_type="historic", streaming=False, chunk_size=None, progress=None):
+        """
+        'progress' (streaming or several files only) is called with the pipeline statistics after
+        every chunk or file; returning False from it cancels the rest of the load.
+        A directory or glob as 'source_path' runs the multi-file ETL (run_parallel_etl_flow).
+        """
+        from etl.parallel import is_multi_source
+
         self.logger.info(f"Running {load_type} ETL flow with source: {source_path}")
+        if is_multi_source(source_path):
+            return self.run_parallel_etl_flow(source_path, load_type, chunk_size, progress=progress)
+        if streaming:
+            return self.run_streaming_etl_flow(source_path, load_type, chunk_size, progress=progress)
         data = self.extract_data(source_path)
         if data is not None:
-            transformed_data = self.transform_data(data)
+            from etl.near_duplicates import NearDuplicateFilter
+
+            near_duplicates = NearDuplicateFilter()
+            transformed_data = near_duplicates.filter(self.transform_data(data))
+            self.logger.info(f"Dropped {near_duplicates.dropped} near-duplicate recipes.")
             self.load_data(transformed_data, load_type)
         else:
             self.logger.error(f"Failed to extract data from {source_path}")
 
+    def run_streaming_etl_flow(self, source_path, load_type="historic", chunk_size=None, progress=None):
+        """
+        Chunked ETL: a producer thread reads and transforms chunk N+1 while chunk N is
+        being loaded. Duplicate names and near-duplicate recipes (etl/near_duplicates.py) are
+        dropped across the whole file, not just per chunk.
+        'chunk_size' defaults to STREAM_CHUNK_SIZE (ETL_CHUNK_SIZE).
+        Every loaded chunk is checkpointed in the ETL ledger, and running the flow again after
+        a crash or failure skips the chunks completed before (see etl/ledger.py).
+        Returns the pipeline statistics, or None if the flow failed.
+        """
+        from etl.ledger import ETLLedger
+        from etl.near_duplicates import NearDuplicateFilter
+        from etl.streaming import STREAM_CHUNK_SIZE, NameDeduplicator, iter_source_chunks, run_pipeline
+        from etl.transform import RENAME_MAP
+
+        chunk_size = chunk_size or STREAM_CHUNK_SIZE
+        chunks = iter_source_chunks(source_path, chunk_size)
+        if chunks is None:
+            self.logger.error(f"Failed to extract data from {source_path}")
+            return
+        deduplicator = NameDeduplicator()
+        near_duplicates = NearDuplicateFilter()
+        ledger = ETLLedger(lambda: get_db_connection("mysql", self.db_config), os.path.abspath(source_path), chunk_size)
+        try:
+            ledger.start()
+            stats = run_pipeline(
+                # Chunks completed by an earlier attempt are skipped, but their names still count as seen
+                ledger.pending(chunks, on_skip=lambda chunk: deduplicator.remember(chunk.rename(columns=RENAME_MAP))),
+                transform=lambda chunk: near_duplicates.filter(deduplicator.filter(self.transform_data(chunk))),
+                load=lambda chunk: ledger.chunk_loaded(self.load_data(chunk, load_type)),
+                progress=progress,
+            )
+            status = ledger.finish("cancelled" if stats["cancelled"] else None)
+        except Exception as e:
+            # The run stays open in the ledger; running the flow again resumes it
+            self.logger.exception(f"Streaming ETL flow failed: {e}")
+            return None
+        stats.update(run_id=ledger.run_id, status=status, skipped_chunks=ledger.skipped)
+        self.logger.info(
+            f"Streamed {stats['rows_in']} rows in {stats['chunks']} chunks from {source_path}"
+            f"{f' (skipped {ledger.skipped} chunks completed before)' if ledger.skipped else ''}; "
+            f"loaded {stats['rows_loaded']}, dropped {deduplicator.dropped} duplicates by 'name' "
+            f"and {near_duplicates.dropped} near-duplicates "
+            f"(transform {stats['transform_s']:.1f}s, load {stats['load_s']:.1f}s)"
+            f"{' before being cancelled' if stats['cancelled'] else ''}."
+        )
+        return stats
+
+    def run_parallel_etl_flow(self, source, load_type="historic", chunk_size=None, workers=None, progress=None):
+        """
+        Multi-file ETL over a directory or glob of source files: the files are streamed chunk by
+        chunk, transform runs in a process pool ('workers' defaults to ETL_WORKERS), loads in
+        batches on pooled connections, and duplicates are dropped and ids assigned in file order
+        (see etl/parallel.py).
+        Returns the run statistics, or None if the flow failed.
+        """
+        from etl.parallel import ParallelETLRunner
+
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                resolver = self.get_ingredient_resolver(conn)
+            runner = ParallelETLRunner(lambda: get_db_connection("mysql", self.db_config), db_type="mysql",
+                                       resolver=resolver, workers=workers, chunk_size=chunk_size)
+            stats = runner.run(source, progress=progress)
+        except Exception as e:
+            self.logger.exception(f"Parallel ETL flow failed: {e}")
+            return None
+        finally:
+            # Even a partial load changes the lists
+            self.cache.invalidate("recipes", "ingredients")
+            self._ingredient_index = None
+        self.logger.info(
+            f"{load_type.capitalize()} ETL over {stats['files_done']} of {stats['files']} files from {source}: "
+            f"loaded {stats['rows_loaded']} of {stats['rows_in']} rows in {stats['batches']} batches, "
+            f"dropped {stats['duplicates']} duplicates by 'name' and "
+            f"{stats['near_duplicates'] + stats['stored_duplicates']} near-duplicates ({stats['seconds']:.1f}s)"
+            f"{' before being cancelled' if stats['cancelled'] else ''}."
+        )
+        return stats
+
     def extract_data(self, source_path):
         self.logger.debug(f"Extracting data from {source_path}...")
         if not os.path.exists(source_path):
             self.logger.error(f"File not found: {source_path}")
             return None
 
+        import pandas as pd
+
         file_ext = os.path.splitext(source_path)[1].lower()
         try:
             if file_ext == ".csv":
@@ -87,69 +229,104 @@ class RecipeApp:
         return df
 
     def transform_data(self, data: pd.DataFrame) -> pd.DataFrame:
+        from etl.transform import transform_recipes
+
         self.logger.debug("Transforming data...")
-        transformed_data = data.copy()
-
-        rename_map = {
-            "recipe_name": "name",
-            "ingredients_list": "instructions",
-            "prep_time": "cooking_time_minutes",
-        }
-        transformed_data.rename(columns=rename_map, inplace=True)
-
-        if "name" in transformed_data.columns:
-            old_count = len(transformed_data)
-            transformed_data.drop_duplicates(subset=["name"], inplace=True)
-            new_count = len(transformed_data)
-            self.logger.debug(f"Removed {old_count - new_count} duplicates by 'name'.")
+        transformed_data = transform_recipes(data)
+        self.logger.debug(f"Removed {len(data) - len(transformed_data)} duplicates by 'name'.")
         self.logger.info("Data transformation complete.")
         return transformed_data
 
     def load_data(self, data: pd.DataFrame, load_type: str):
+        from db.bulk_load import bulk_load_recipes
+        from etl.near_duplicates import drop_stored_duplicates, store_frame_signatures
+
         self.logger.info(f"Loading data into the 'recipe' table for {load_type} flow.")
         try:
-            conn = mysql.connector.connect(**self.db_config)
-            cursor = conn.cursor()
-            # Inserting only a subset of columns for demonstration
-            insert_sql = """
-                INSERT INTO recipe (name, instructions, cooking_time_minutes)
-                VALUES (%s, %s, %s)
-            """
-            count = 0
-            for _, row in data.iterrows():
-                name = row.get("name", "")
-                instructions = row.get("instructions", "")
-                cooking_time = row.get("cooking_time_minutes", None)
-                cursor.execute(insert_sql, (name, instructions, cooking_time))
-                count += 1
-            conn.commit()
-            self.logger.info(f"{load_type.capitalize()} load complete. Inserted {count} rows.")
-        except mysql.connector.Error as err:
+            conn = get_db_connection("mysql", self.db_config)
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error during data loading: {err}")
+            return
+        with_ingredients = "ingredients_info" in data.columns
+        loaded = None
+        try:
+            # Copies of recipes loaded by earlier runs; the ETL stage only knows this run
+            data, known = drop_stored_duplicates(conn, data, db_type="mysql")
+            if known:
+                self.logger.info(f"Skipped {known} near-duplicates of stored recipes.")
+            if with_ingredients:
+                self.get_ingredient_resolver(conn).resolve_chunk(conn, data)
+            result = bulk_load_recipes(conn, data, db_type="mysql")
+            store_frame_signatures(conn, result["recipe_ids"], data, db_type="mysql")
+            if with_ingredients:
+                with self._ingredient_index_lock:
+                    if self._ingredient_index is not None:
+                        self._ingredient_index.add_loaded(result["recipe_ids"], data["ingredients_info"])
+            self.logger.info(
+                f"{load_type.capitalize()} load complete. Inserted {result['rows']} rows "
+                f"via {result['method']} ({result['rows_per_second']:.0f} rows/s) "
+                f"and {result['ingredient_rows']} recipe_ingredient rows."
+            )
+            loaded = result["rows"]
+        except mysql_connector.Error as err:
             self.logger.exception(f"Error during data loading: {err}")
         finally:
-            cursor.close()
             conn.close()
+            # Even a partial load changes the recipe list
+            self.cache.invalidate("recipes")
+            if with_ingredients:
+                self.cache.invalidate("ingredients")
+                if loaded is None:
+                    # What a failed load committed is unknown: rebuild on the next query
+                    self._ingredient_index = None
+        return loaded
+
+    def get_ingredient_resolver(self, conn):
+        """
+        Returns the ingredient name resolver, loading it from the ingredient and ingredient_alias
+        tables on first use and again once it is older than RESOLVER_TTL. It lives across ETL
+        chunks and runs, so every spelling is matched only once per process.
+        """
+        from etl.ingredient_resolver import RESOLVER_TTL, IngredientResolver
+
+        with self._ingredient_resolver_lock:
+            resolver = self._ingredient_resolver
+            if resolver is None or time.monotonic() - resolver.built_at > RESOLVER_TTL:
+                resolver = IngredientResolver.from_db(conn)
+                self._ingredient_resolver = resolver
+                self.logger.info(f"Loaded ingredient resolver over {len(resolver)} ingredients.")
+            return resolver
 
     ######################
     # RECIPE CRUD Methods
     ######################
-    def list_recipes(self, limit=50):
-        rows = []
+    def list_recipes(self, limit=50, after_id=None):
+        """
+        Recipes in id order; pass the last id of a page as 'after_id' to get the next one
+        (keyset pagination: every page is an index range scan, however deep the user scrolls).
+        Database errors are logged and raised: an empty page would end the infinite scroll.
+        """
+        def load():
+            with get_db_connection("mysql", self.db_config) as conn:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("""
+                    SELECT id, name, name_es, instructions, cooking_time_minutes,
+                           difficulty, source, category_id, user_id, recipe_story_id,
+                           (SELECT MIN(rp.photo_id) FROM recipe_photo rp WHERE rp.recipe_id = recipe.id) AS photo_id
+                    FROM recipe
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (after_id or 0, limit))
+                rows = cursor.fetchall()
+                cursor.close()
+            return rows
+
         try:
-            conn = mysql.connector.connect(**self.db_config)
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("""
-                SELECT id, name, name_es, instructions, cooking_time_minutes,
-                       difficulty, source, category_id, user_id, recipe_story_id
-                FROM recipe
-                LIMIT %s
-            """, (limit,))
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-        except mysql.connector.Error as err:
+            return self.cache.get_or_load("recipes", (limit, after_id), load)
+        except mysql_connector.Error as err:
             self.logger.exception(f"Error fetching recipes: {err}")
-        return rows
+            raise
 
     def add_recipe(self, name, instructions, cooking_time=None, difficulty=None,
                    source=None, name_es=None, category_id=None, user_id=None,
@@ -158,80 +335,283 @@ class RecipeApp:
         Insert a new record into the 'recipe' table, respecting its columns:
           name, name_es, instructions, cooking_time_minutes, difficulty, source,
           category_id, user_id, recipe_story_id
+        Returns the new recipe's id, or None if the insert failed.
         """
+        recipe_id = None
         try:
-            conn = mysql.connector.connect(**self.db_config)
-            cursor = conn.cursor()
-            insert_sql = """
-                INSERT INTO recipe
-                (name, name_es, instructions, cooking_time_minutes,
-                 difficulty, source, category_id, user_id, recipe_story_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(insert_sql, (
-                name, name_es, instructions, cooking_time, difficulty, source,
-                category_id, user_id, recipe_story_id
-            ))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with get_db_connection("mysql", self.db_config) as conn:
+                cursor = conn.cursor()
+                insert_sql = """
+                    INSERT INTO recipe
+                    (name, name_es, instructions, cooking_time_minutes,
+                     difficulty, source, category_id, user_id, recipe_story_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """
+                cursor.execute(insert_sql, (
+                    name, name_es, instructions, cooking_time, difficulty, source,
+                    category_id, user_id, recipe_story_id
+                ))
+                conn.commit()
+                recipe_id = cursor.lastrowid
+                cursor.close()
+            self.cache.invalidate("recipes")
             self.logger.info(f"Inserted new recipe: {name}")
-        except mysql.connector.Error as err:
+        except mysql_connector.Error as err:
             self.logger.exception(f"Error inserting new recipe: {err}")
+        return recipe_id
+
+    def search_recipes(self, query, page=1, per_page=20):
+        """
+        Full-text search over recipe names and instructions (see db/fulltext.py).
+        Returns a list of {'id', 'name', 'name_es', 'score', 'snippet'} dicts, best match first;
+        'snippet' is Kivy markup with the matches in [b], for a Label with markup=True.
+        """
+        rows = []
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                rows = search_recipes(conn, query, db_type="mysql", limit=per_page, offset=(page - 1) * per_page,
+                                      markup="kivy")
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error searching recipes: {err}")
+        return rows
 
     def list_categories(self):
         """
         Returns a list of categories, each as a dict:
         [{'id': 1, 'name': 'Main Dishes'}, ...]
         """
-        rows = []
+        def load():
+            with get_db_connection("mysql", self.db_config) as conn:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("SELECT id, name FROM category")
+                rows = cursor.fetchall()
+                cursor.close()
+            return rows
+
         try:
-            conn = mysql.connector.connect(**self.db_config)
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT id, name FROM category")
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-        except mysql.connector.Error as err:
+            return self.cache.get_or_load("categories", "all", load)
+        except mysql_connector.Error as err:
             self.logger.exception(f"Error fetching categories: {err}")
+        return []
+
+    def get_category_tree(self):
+        """
+        Returns the in-memory category hierarchy (see db/category_tree.py), loaded on first
+        use and again after category writes or once older than CATEGORY_TREE_TTL.
+        """
+        with self._category_tree_lock:
+            tree = self._category_tree
+            if tree is None or time.monotonic() - tree.built_at > CATEGORY_TREE_TTL:
+                with get_db_connection("mysql", self.db_config) as conn:
+                    tree = CategoryTree.from_db(conn)
+                self._category_tree = tree
+            return tree
+
+    def add_category(self, name, parent_category_id=None):
+        """
+        Inserts a category below 'parent_category_id' (None for a top-level one) and returns its id.
+        """
+        category_id = None
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                category_id = add_category(conn, name, parent_category_id, db_type="mysql")
+            self._category_tree = None
+            self.cache.invalidate("categories")
+            self.logger.info(f"Inserted new category: {name}")
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error inserting new category: {err}")
+        return category_id
+
+    def move_category(self, category_id, new_parent_id):
+        """
+        Moves a category, with all its subcategories, below 'new_parent_id'.
+        """
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                move_category(conn, category_id, new_parent_id, db_type="mysql")
+            self._category_tree = None
+            self.cache.invalidate("categories")
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error moving category {category_id}: {err}")
+
+    def list_category_recipes(self, category_id, limit=50, after_id=None):
+        """
+        Recipes in a category or any of its subcategories, one page at a time:
+        pass the last id of the previous page as 'after_id'.
+        """
+        rows = []
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                rows = fetch_subtree_recipes(conn, category_id, limit=limit, after_id=after_id, db_type="mysql")
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error fetching recipes of category {category_id}: {err}")
         return rows
 
     ######################
     # INGREDIENT Methods
     ######################
     def list_ingredients(self, limit=50):
-        rows = []
+        def load():
+            with get_db_connection("mysql", self.db_config) as conn:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("""
+                    SELECT id, name, description, flavor_profile_id, health_data_id
+                    FROM ingredient
+                    LIMIT %s
+                """, (limit,))
+                rows = cursor.fetchall()
+                cursor.close()
+            return rows
+
         try:
-            conn = mysql.connector.connect(**self.db_config)
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("""
-                SELECT id, name, description, flavor_profile_id, health_data_id
-                FROM ingredient
-                LIMIT %s
-            """, (limit,))
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-        except mysql.connector.Error as err:
+            return self.cache.get_or_load("ingredients", limit, load)
+        except mysql_connector.Error as err:
             self.logger.exception(f"Error fetching ingredients: {err}")
-        return rows
+        return []
 
     def add_ingredient(self, name, description=None, flavor_profile_id=None, health_data_id=None):
         try:
-            conn = mysql.connector.connect(**self.db_config)
-            cursor = conn.cursor()
-            insert_sql = """
-                INSERT INTO ingredient (name, description, flavor_profile_id, health_data_id)
-                VALUES (%s, %s, %s, %s)
-            """
-            cursor.execute(insert_sql, (name, description, flavor_profile_id, health_data_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with get_db_connection("mysql", self.db_config) as conn:
+                cursor = conn.cursor()
+                insert_sql = """
+                    INSERT INTO ingredient (name, description, flavor_profile_id, health_data_id)
+                    VALUES (%s, %s, %s, %s)
+                """
+                cursor.execute(insert_sql, (name, description, flavor_profile_id, health_data_id))
+                conn.commit()
+                cursor.close()
+            self.cache.invalidate("ingredients")
             self.logger.info(f"Inserted new ingredient: {name}")
-        except mysql.connector.Error as err:
+        except mysql_connector.Error as err:
             self.logger.exception(f"Error inserting new ingredient: {err}")
 
+    ######################
+    # MEDIA Methods
+    ######################
+    def get_media_path(self, table, media_id):
+        """
+        Local file path of a photo or video, for widgets that load straight from disk
+        (e.g. Image(source=...)); the bytes never pass through the database driver.
+        """
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                media = get_media(conn, table, media_id)
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error looking up {table} {media_id}: {err}")
+            return None
+        blob_store = self.get_blob_store()
+        if media is None or not blob_store.exists(media["sha256"]):
+            return None
+        return blob_store.path(media["sha256"])
+
+    def get_thumbnail_paths(self, table, media_ids, width):
+        """
+        Paths of the smallest rendered variants at least 'width' px wide (thumbnails or poster
+        frames) for a whole page of media ids, with one query: {media_id: path}. Until a variant
+        exists, rendering is queued and photos fall back to the original file. Ids without a
+        stored file are left out.
+        """
+        try:
+            with get_db_connection("mysql", self.db_config) as conn:
+                media = get_media_many(conn, table, media_ids)
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error looking up {len(media_ids)} {table} rows: {err}")
+            return {}
+        blob_store, derivatives = self.get_blob_store(), self.get_derivatives()
+        paths = {}
+        for media_id, row in media.items():
+            path = derivatives.variant(table, row["sha256"], width)
+            if path is None and table == "photo" and blob_store.exists(row["sha256"]):
+                path = blob_store.path(row["sha256"])
+            paths[media_id] = path
+        return paths
+
+    def get_blob_store(self):
+        """
+        Returns the blob store, created with the first media access rather than at startup.
+        """
+        with self._media_lock:
+            if self._blob_store is None:
+                self._blob_store = BlobStore()
+            return self._blob_store
+
+    def get_derivatives(self):
+        """
+        Returns the thumbnail pipeline, created with the first media access rather than at
+        startup; its cache counts the derivative directory in the background (see media/derivatives.py).
+        """
+        blob_store = self.get_blob_store()
+        with self._media_lock:
+            if self._derivatives is None:
+                self._derivatives = DerivativePipeline(blob_store)
+            return self._derivatives
+
+    ######################
+    # INGREDIENT SEARCH Methods
+    ######################
+    def get_ingredient_index(self):
+        """
+        Returns the in-memory ingredient index, building it from recipe_ingredient on first
+        use and again once it is older than INGREDIENT_INDEX_TTL (other processes may insert too).
+        """
+        with self._ingredient_index_lock:
+            index = self._ingredient_index
+            if index is None or time.monotonic() - index.built_at > INGREDIENT_INDEX_TTL:
+                with get_db_connection("mysql", self.db_config) as conn:
+                    index = IngredientIndex.from_db(conn)
+                self._ingredient_index = index
+                self.logger.info(f"Built ingredient index over {len(index)} ingredients.")
+            return index
+
+    def find_recipes_by_ingredients(self, ingredient_ids, mode="all", max_missing=0, limit=50):
+        """
+        mode='all': ids of recipes using every given ingredient,
+        mode='any': ids of recipes using at least one of them,
+        mode='cook': recipes cookable with them, missing at most 'max_missing' ingredients,
+        ranked by coverage (see IngredientIndex.what_can_i_cook).
+        """
+        try:
+            index = self.get_ingredient_index()
+        except mysql_connector.Error as err:
+            self.logger.exception(f"Error building ingredient index: {err}")
+            return []
+        if mode == "all":
+            return index.recipes_with_all(ingredient_ids)[:limit]
+        if mode == "any":
+            return index.recipes_with_any(ingredient_ids)[:limit]
+        if mode == "cook":
+            return index.what_can_i_cook(ingredient_ids, max_missing=max_missing, limit=limit)
+        raise ValueError(f"Unsupported ingredient search mode: {mode}")
+
+    ######################
+    # SYNC Methods
+    ######################
+    def sync_now(self, conflict_policy="latest"):
+        """
+        Two-way delta sync of the local SQLite file (LOCAL_DB_PATH) with the MySQL database
+        (see sync/engine.py). Returns the sync statistics, or None if it failed.
+        """
+        local_conn = get_db_connection("sqlite", self.db_config)
+        remote_conn = None
+        try:
+            remote_conn = get_db_connection("mysql", self.db_config)
+            install_change_log(local_conn, db_type="sqlite", local=True)
+            install_change_log(remote_conn, db_type="mysql")
+            engine = SyncEngine(local_conn, remote_conn, SYNC_DEVICE_ID, conflict_policy=conflict_policy)
+            stats = engine.sync()
+            self.logger.info(f"Sync finished: {stats}")
+            return stats
+        except (mysql_connector.Error, sqlite3.Error) as err:
+            self.logger.exception(f"Error syncing with the remote database: {err}")
+            return None
+        finally:
+            if remote_conn is not None:
+                remote_conn.close()
+            local_conn.close()
+            self.cache.invalidate("recipes", "ingredients", "categories")
+            self._category_tree = None
+            self._ingredient_index = None
+
 
 ###############################################
 # KIVY UI: SCREENS & APP
@@ -244,14 +624,21 @@ class MainMenuScreen(Screen):
         layout.add_widget(Label(text="Single Sauce of Truth (Kivy)", font_size=24))
         btn_list = Button(text="List Recipes")
         btn_add = Button(text="Add Recipe")
-        btn_etl = Button(text="Run ETL Flow (Example)")
+        self.btn_etl = Button(text="Run ETL Flow (Example)")
+        self.btn_sync = Button(text="Sync Now")
         btn_list.bind(on_press=self.goto_list_recipes)
         btn_add.bind(on_press=self.goto_add_recipe)
-        btn_etl.bind(on_press=self.run_etl_flow)
+        self.btn_etl.bind(on_press=self.run_etl_flow)
+        self.btn_sync.bind(on_press=self.sync_now)
         layout.add_widget(btn_list)
         layout.add_widget(btn_add)
-        layout.add_widget(btn_etl)
+        layout.add_widget(self.btn_etl)
+        layout.add_widget(self.btn_sync)
+        # Progress and outcome of background jobs
+        self.status_label = Label(text="", font_size=14, size_hint=(1, 0.3))
+        layout.add_widget(self.status_label)
         self.add_widget(layout)
+        self._etl_task = None
 
     def goto_list_recipes(self, instance):
         self.manager.current = "list_recipes"
@@ -262,36 +649,177 @@ class MainMenuScreen(Screen):
     def run_etl_flow(self, instance):
         # Instead of app.root_app, use App.get_running_app().recipe_app
         current_app = App.get_running_app()
-        current_app.recipe_app.run_etl_flow("data/historic_recipes.csv", "historic")
+        if self._etl_task is not None:
+            # Pressed again while running: stop after the chunk being loaded
+            self._etl_task.cancel()
+            self.btn_etl.text = "Cancelling..."
+            self.btn_etl.disabled = True
+            return
+        self.btn_etl.text = "Cancel ETL"
+        self.status_label.text = "ETL running..."
+        self._etl_task = current_app.tasks.submit(
+            lambda task: current_app.recipe_app.run_etl_flow(
+                "data/historic_recipes.csv", "historic", streaming=True, progress=task.report),
+            with_task=True,
+            on_progress=self.show_etl_progress,
+            on_done=self.show_etl_result,
+            on_error=lambda err: setattr(self.status_label, "text", f"ETL failed: {err}"),
+            on_finished=self.etl_finished,
+        )
+
+    def show_etl_progress(self, stats):
+        self.status_label.text = (f"ETL running: {stats['rows_loaded']} rows loaded "
+                                  f"in {stats['chunks']} chunks...")
+
+    def show_etl_result(self, stats):
+        if stats is None:
+            self.status_label.text = "ETL failed, see the log."
+        else:
+            self.status_label.text = f"ETL done: {stats['rows_loaded']} rows loaded."
+
+    def etl_finished(self, task):
+        if task.cancelled:
+            self.status_label.text = "ETL cancelled; chunks loaded before that were kept."
+        self._etl_task = None
+        self.btn_etl.text = "Run ETL Flow (Example)"
+        self.btn_etl.disabled = False
+
+    def sync_now(self, instance):
+        current_app = App.get_running_app()
+        self.btn_sync.disabled = True
+        self.status_label.text = "Syncing..."
+
+        def show(stats):
+            if stats is None:
+                self.status_label.text = "Sync failed, see the log."
+            else:
+                self.status_label.text = (f"Synced: {stats['pulled']['upserted']} rows in, "
+                                          f"{stats['pushed']['upserted'] + stats['pushed']['inserted']} rows out.")
+
+        current_app.tasks.submit(
+            current_app.recipe_app.sync_now,
+            on_done=show,
+            on_finished=lambda task: setattr(self.btn_sync, "disabled", False),
+        )
+
+
+class RecipeRow(RecycleDataViewBehavior, BoxLayout):
+    """
+    One row of the recipe list. RecycleView keeps only enough of these for the visible area
+    and re-binds them to other rows' data while scrolling.
+    """
+    text = StringProperty("")
+    thumbnail = StringProperty("")
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation='horizontal', spacing=5, **kwargs)
+        self.image = Image(size_hint=(None, 1), width=64, opacity=0)
+        self.label = Label(font_size=14, shorten=True, halign='left', valign='middle')
+        self.label.bind(size=self.label.setter('text_size'))
+        self.add_widget(self.image)
+        self.add_widget(self.label)
+        self.bind(text=self.label.setter('text'), thumbnail=self.show_thumbnail)
+
+    def show_thumbnail(self, instance, path):
+        self.image.source = path
+        self.image.opacity = 1 if path else 0
 
 
 class ListRecipesScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.layout = BoxLayout(orientation='vertical', spacing=10, padding=20)
-        title = Label(text="Recipe List", font_size=20)
+        title = Label(text="Recipe List", font_size=20, size_hint=(1, 0.1))
         self.layout.add_widget(title)
-        self.result_layout = BoxLayout(orientation='vertical', spacing=5, padding=10)
-        self.layout.add_widget(self.result_layout)
+        self.status_label = Label(text="", font_size=14, size_hint=(1, 0.05))
+        self.layout.add_widget(self.status_label)
+        # Virtualized list: a constant number of RecipeRow widgets, whatever the number of recipes
+        self.recycle_view = RecycleView(viewclass=RecipeRow)
+        layout_manager = RecycleBoxLayout(orientation='vertical', spacing=5, size_hint_y=None,
+                                          default_size=(None, 72), default_size_hint=(1, None))
+        layout_manager.bind(minimum_height=layout_manager.setter('height'))
+        self.recycle_view.add_widget(layout_manager)
+        self.recycle_view.bind(scroll_y=self.on_scroll)
+        self.layout.add_widget(self.recycle_view)
         btn_back = Button(text="Back to Main Menu", size_hint=(1, 0.1))
         btn_back.bind(on_press=self.goto_main_menu)
         self.layout.add_widget(btn_back)
         self.add_widget(self.layout)
+        self.pager = KeysetPager()
+        self._task = None
 
     def on_enter(self):
         # Called whenever we navigate to this screen
         self.refresh_recipes()
 
+    def on_leave(self):
+        # Results arriving after we left would only be thrown away
+        if self._task is not None:
+            self._task.cancel()
+
     def refresh_recipes(self):
-        self.result_layout.clear_widgets()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.pager.reset()
+        self.recycle_view.data = []
+        self.recycle_view.scroll_y = 1
+        self.load_more()
+
+    def on_scroll(self, instance, scroll_y):
+        # scroll_y runs from 1 (top) to 0 (bottom); translate it into the last visible row
+        rows = len(self.recycle_view.data)
+        if rows:
+            self.load_more(visible_index=int((1 - scroll_y) * rows))
+
+    def load_more(self, visible_index=None):
+        request = self.pager.next_request(visible_index)
+        if request is None:
+            return
+        generation, after_id, limit = request
         current_app = App.get_running_app()
-        recipes = current_app.recipe_app.list_recipes(limit=50)
-        for r in recipes:
-            # Display more columns, e.g. name_es, difficulty, source
-            line = (f"ID: {r['id']} | {r['name']} (ES: {r.get('name_es', '-')}) | "
-                    f"{r['instructions']} | {r.get('difficulty', '?')} | "
-                    f"{r.get('source', '?')} | {r.get('cooking_time_minutes', '?')} mins")
-            self.result_layout.add_widget(Label(text=line, font_size=14))
+        recipe_app = current_app.recipe_app
+        self.status_label.text = "Loading recipes..."
+
+        def load():
+            # Thumbnail lookups query the database too, so they run here as well
+            recipes = recipe_app.list_recipes(limit=limit, after_id=after_id)
+            photo_ids = {r['id']: r['photo_id'] for r in recipes if r.get('photo_id')}
+            # One query for the page; a 64 px slot only needs the smallest variant, not the full-size photo
+            paths = recipe_app.get_thumbnail_paths("photo", list(photo_ids.values()), 64)
+            thumbnails = {recipe_id: paths.get(photo_id) for recipe_id, photo_id in photo_ids.items()}
+            return recipes, thumbnails
+
+        self._task = current_app.tasks.submit(
+            load,
+            on_done=lambda result: self.show_page(generation, *result),
+            on_error=lambda err: setattr(self.status_label, "text", f"Could not load recipes: {err}"),
+            on_finished=lambda task: self.loading_finished(generation, task),
+        )
+
+    def show_page(self, generation, recipes, thumbnails):
+        if self.pager.page_loaded(generation, recipes) is None:
+            return
+        # Appending keeps the scroll position; only rows entering the viewport get widgets
+        self.recycle_view.data.extend(
+            {
+                # Display more columns, e.g. name_es, difficulty, source
+                "text": (f"ID: {r['id']} | {r['name']} (ES: {r.get('name_es', '-')}) | "
+                         f"{r['instructions']} | {r.get('difficulty', '?')} | "
+                         f"{r.get('source', '?')} | {r.get('cooking_time_minutes', '?')} mins"),
+                "thumbnail": thumbnails.get(r['id']) or "",
+            }
+            for r in recipes
+        )
+        self.status_label.text = "" if self.pager.rows else "No recipes yet."
+
+    def loading_finished(self, generation, task):
+        # Cancelled or failed pages may be requested again on the next scroll
+        self.pager.page_failed(generation)
+        if task is self._task:
+            self._task = None
+            if self.status_label.text == "Loading recipes...":
+                self.status_label.text = ""
 
     def goto_main_menu(self, instance):
         self.manager.current = "main_menu"
@@ -321,23 +849,13 @@ class AddRecipeScreen(Screen):
         self.source_input = TextInput(hint_text="Source (URL or reference)", multiline=False)
         self.layout.add_widget(self.source_input)
 
-        # 1. Fetch categories from the DB
-        current_app = App.get_running_app()
-        category_rows = current_app.recipe_app.list_categories()  # returns [{'id':1,'name':'Main Dishes'}, ...]
-        # 2. Create a mapping: category_name -> category_id
-        self.category_map = {cat['name']: cat['id'] for cat in category_rows}
-        # 3. Spinner with category names
-        if category_rows:
-            # Use the first category's name as default, or "Select Category"
-            default_text = "Select Category"
-            cat_names = list(self.category_map.keys())
-        else:
-            default_text = "No categories found"
-            cat_names = []
+        # Category spinner; the names are fetched in the background (see load_categories)
+        self.category_map = {}
         self.category_spinner = Spinner(
-            text=default_text,
-            values=cat_names,
-            size_hint=(1, 0.1)
+            text="Loading categories...",
+            values=[],
+            size_hint=(1, 0.1),
+            disabled=True,
         )
         self.layout.add_widget(self.category_spinner)
 
@@ -347,16 +865,36 @@ class AddRecipeScreen(Screen):
         # Recipe Story ID
         self.recipe_story_id_input = TextInput(hint_text="Recipe Story ID (int)", multiline=False)
         self.layout.add_widget(self.recipe_story_id_input)
+        # Outcome of a failed save; the form keeps the input
+        self.status_label = Label(text="", font_size=14)
+        self.layout.add_widget(self.status_label)
         # Save Button
-        btn_save = Button(text="Save Recipe")
-        btn_save.bind(on_press=self.save_recipe)
-        self.layout.add_widget(btn_save)
+        self.btn_save = Button(text="Save Recipe")
+        self.btn_save.bind(on_press=self.save_recipe)
+        self.layout.add_widget(self.btn_save)
         # Back Button
         btn_back = Button(text="Back to Main Menu")
         btn_back.bind(on_press=self.goto_main_menu)
         self.layout.add_widget(btn_back)
         self.add_widget(self.layout)
 
+    def on_enter(self):
+        # Every visit picks up categories added in the meantime (list_categories is cached)
+        self.load_categories()
+
+    def load_categories(self):
+        current_app = App.get_running_app()
+        # returns [{'id':1,'name':'Main Dishes'}, ...]
+        current_app.tasks.submit(current_app.recipe_app.list_categories, on_done=self.show_categories)
+
+    def show_categories(self, category_rows):
+        # Mapping: category_name -> category_id
+        self.category_map = {cat['name']: cat['id'] for cat in category_rows}
+        self.category_spinner.values = list(self.category_map.keys())
+        if self.category_spinner.text not in self.category_map:
+            self.category_spinner.text = "Select Category" if category_rows else "No categories found"
+        self.category_spinner.disabled = not category_rows
+
     def save_recipe(self, instance):
         current_app = App.get_running_app()
         # Gather field data
@@ -374,11 +912,14 @@ class AddRecipeScreen(Screen):
         recipe_story_id = self.recipe_story_id_input.text.strip()
         # Convert numeric fields
         cooking_time_int = int(cooking_time) if cooking_time.isdigit() else None
-        category_id_int = int(category_id) if category_id.isdigit() else None
         user_id_int = int(user_id) if user_id.isdigit() else None
         recipe_story_id_int = int(recipe_story_id) if recipe_story_id.isdigit() else None
-        # Insert into DB
-        current_app.recipe_app.add_recipe(
+        # Insert into DB in the background; the form stays until the insert is done
+        self.btn_save.disabled = True
+        self.btn_save.text = "Saving..."
+        self.status_label.text = ""
+        current_app.tasks.submit(
+            current_app.recipe_app.add_recipe,
             name=name,
             name_es=name_es,
             instructions=instructions,
@@ -386,9 +927,17 @@ class AddRecipeScreen(Screen):
             difficulty=difficulty,
             source=source,
             category_id=category_id,
-            user_id=user_id,
-            recipe_story_id=recipe_story_id
+            user_id=user_id_int,
+            recipe_story_id=recipe_story_id_int,
+            on_done=self.recipe_saved,
+            on_error=lambda err: setattr(self.status_label, "text", f"Could not save the recipe: {err}"),
+            on_finished=self.saving_finished,
         )
+
+    def recipe_saved(self, recipe_id):
+        if recipe_id is None:
+            self.status_label.text = "Could not save the recipe, see the log."
+            return
         # Clear fields
         self.name_input.text = ""
         self.name_es_input.text = ""
@@ -396,43 +945,65 @@ class AddRecipeScreen(Screen):
         self.cooking_time_input.text = ""
         self.difficulty_input.text = ""
         self.source_input.text = ""
-        self.category_id_input.text = ""
         self.user_id_input.text = ""
         self.recipe_story_id_input.text = ""
         self.category_spinner.text = "Select Category"
         self.manager.current = "main_menu"
 
+    def saving_finished(self, task):
+        self.btn_save.disabled = False
+        self.btn_save.text = "Save Recipe"
+
     def goto_main_menu(self, instance):
         self.manager.current = "main_menu"
 
 
 class MainScreenManager(ScreenManager):
+    """
+    Only the main menu is built for the first frame; every other screen is built the first
+    time it is navigated to ('self.manager.current = name' goes through get_screen).
+    """
+
+    screen_classes = {
+        "list_recipes": ListRecipesScreen,
+        "add_recipe": AddRecipeScreen,
+    }
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.main_menu_screen = MainMenuScreen(name="main_menu")
-        self.list_recipes_screen = ListRecipesScreen(name="list_recipes")
-        self.add_recipe_screen = AddRecipeScreen(name="add_recipe")
         self.add_widget(self.main_menu_screen)
-        self.add_widget(self.list_recipes_screen)
-        self.add_widget(self.add_recipe_screen)
+
+    def get_screen(self, name):
+        if not self.has_screen(name) and name in self.screen_classes:
+            self.add_widget(self.screen_classes[name](name=name))
+        return super().get_screen(name)
 
 
 class SingleSauceKivyApp(App):
     """
     Our main Kivy application.
     We'll hold a reference to 'RecipeApp' so we can call its methods from screens.
+    Screens never call RecipeApp on the main loop directly: they go through 'tasks'
+    (ui/tasks.py), which runs the calls on worker threads and hands results back via the Clock.
     """
 
     def __init__(self, recipe_app, **kwargs):
         super().__init__(**kwargs)
         self.recipe_app = recipe_app
+        self.tasks = BackgroundTasks()
 
     def build(self):
         sm = MainScreenManager()
         return sm
 
+    def on_stop(self):
+        # Queued calls are dropped; a running ETL chunk finishes on its own
+        self.tasks.shutdown(wait=False)
+
 
 if __name__ == "__main__":
+    configure_logging()
     logger.info("Starting Single Sauce of Truth with Kivy UI...")
     # Initializing the database logic
     root_recipe_app = RecipeApp(db_configuration)
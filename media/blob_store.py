@@ -0,0 +1,274 @@
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+
+from db.db import max_rows_per_statement
+
+# Photos and videos live on disk under MEDIA_ROOT, named by the SHA-256 of their content;
+# the photo / video rows only keep the hash and metadata. Equal files are stored once.
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", "media_store")
+MEDIA_TABLES = ("photo", "video")
+CHUNK_SIZE = 1024 * 1024
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Columns added to photo / video; 'file' stays only until migrate_blobs has emptied it
+MEDIA_COLUMNS = {
+    "mysql": (("sha256", "CHAR(64)"), ("size_bytes", "BIGINT"), ("content_type", "VARCHAR(100)")),
+    "sqlite": (("sha256", "TEXT"), ("size_bytes", "INTEGER"), ("content_type", "TEXT")),
+}
+
+
+class BlobStore:
+    """
+    Content-addressed file store: root/ab/cd/abcd...(64 hex chars).
+    Writes go to a temp file in the same file system and are renamed into place,
+    so a blob is either complete or absent, and concurrent writers of equal content are harmless.
+    """
+
+    def __init__(self, root=MEDIA_ROOT):
+        self.root = os.path.abspath(root)
+        # Absolute like self.root, so that iter_hashes can tell the temp files apart
+        self._tmp = os.path.join(self.root, "tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def path(self, sha256):
+        if not _SHA256_RE.match(sha256 or ""):
+            raise ValueError(f"Not a SHA-256 hex digest: {sha256!r}")
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def _commit(self, tmp_path, target):
+        """
+        Moves a fully written temp file to 'target', or drops it if the blob is stored already.
+        A deduplicated blob gets a fresh mtime: the row about to reference it is not written yet,
+        and collect_garbage keeps blobs younger than its grace period.
+        """
+        try:
+            os.utime(target)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+        else:
+            os.remove(tmp_path)
+
+    def put_stream(self, stream):
+        """
+        Stores everything readable from 'stream', hashing while copying. Returns (sha256, size).
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            self._commit(tmp_path, self.path(sha256))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return sha256, size
+
+    def put_bytes(self, data):
+        sha256 = hashlib.sha256(data).hexdigest()
+        target = self.path(sha256)
+        try:
+            # Deduplicated: refreshed like in _commit
+            os.utime(target)
+        except FileNotFoundError:
+            fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            self._commit(tmp_path, target)
+        return sha256, len(data)
+
+    def open(self, sha256):
+        return open(self.path(sha256), "rb")
+
+    @contextmanager
+    def mmap(self, sha256):
+        """
+        Read-only memory map of a blob: bytes are paged in from the OS cache on access, not copied up front.
+        """
+        with self.open(sha256) as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def remove(self, sha256):
+        try:
+            os.remove(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def iter_hashes(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            if dirpath.startswith(self._tmp):
+                continue
+            for name in filenames:
+                if _SHA256_RE.match(name):
+                    yield name
+
+
+def ensure_media_columns(conn, db_type="mysql"):
+    """
+    Adds sha256 / size_bytes / content_type (and an index on sha256) to photo and video if missing.
+    """
+    cursor = conn.cursor()
+    for table in MEDIA_TABLES:
+        if db_type == "mysql":
+            cursor.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = DATABASE() AND table_name = %s
+            """, (table,))
+        else:
+            cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[0] if db_type == "mysql" else row[1] for row in cursor.fetchall()}
+        for column, column_type in MEDIA_COLUMNS[db_type]:
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        if db_type == "mysql":
+            cursor.execute("""
+                SELECT COUNT(*) FROM information_schema.statistics
+                WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            """, (table, f"idx_{table}_sha256"))
+            if cursor.fetchall()[0][0] == 0:
+                cursor.execute(f"CREATE INDEX idx_{table}_sha256 ON {table} (sha256)")
+        else:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_sha256 ON {table} (sha256)")
+    conn.commit()
+    cursor.close()
+
+
+def add_media(conn, store, table, stream, content_type, db_type="mysql"):
+    """
+    Stores the file on disk and inserts its photo / video row. Returns (id, sha256).
+    """
+    if table not in MEDIA_TABLES:
+        raise ValueError(f"Unknown media table: {table}")
+    p = "%s" if db_type == "mysql" else "?"
+    sha256, size = store.put_stream(stream)
+    cursor = conn.cursor()
+    cursor.execute(f"INSERT INTO {table} (sha256, size_bytes, content_type) VALUES ({p}, {p}, {p})",
+                   (sha256, size, content_type))
+    media_id = cursor.lastrowid
+    conn.commit()
+    cursor.close()
+    return media_id, sha256
+
+
+def get_media(conn, table, media_id, db_type="mysql"):
+    """
+    Metadata of one photo / video: {'id', 'sha256', 'size_bytes', 'content_type'}, or None.
+    Never reads the legacy 'file' column.
+    """
+    if table not in MEDIA_TABLES:
+        raise ValueError(f"Unknown media table: {table}")
+    p = "%s" if db_type == "mysql" else "?"
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id, sha256, size_bytes, content_type FROM {table} WHERE id = {p}", (media_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows or rows[0][1] is None:
+        return None
+    return dict(zip(("id", "sha256", "size_bytes", "content_type"), rows[0]))
+
+
+def get_media_many(conn, table, media_ids, db_type="mysql"):
+    """
+    Metadata of several photos / videos at once, as {id: get_media(...) result}; ids without
+    a stored blob are left out. One query per few thousand ids instead of one per id.
+    """
+    if table not in MEDIA_TABLES:
+        raise ValueError(f"Unknown media table: {table}")
+    p = "%s" if db_type == "mysql" else "?"
+    distinct = sorted(set(media_ids))
+    step = max_rows_per_statement(db_type, 1)
+    media = {}
+    cursor = conn.cursor()
+    for start in range(0, len(distinct), step):
+        batch = distinct[start:start + step]
+        cursor.execute(f"SELECT id, sha256, size_bytes, content_type FROM {table} "
+                       f"WHERE id IN ({', '.join([p] * len(batch))}) AND sha256 IS NOT NULL", batch)
+        media.update((row[0], dict(zip(("id", "sha256", "size_bytes", "content_type"), row)))
+                     for row in cursor.fetchall())
+    cursor.close()
+    return media
+
+
+def migrate_blobs(conn, store, table, db_type="mysql", batch_size=50, sniff=None):
+    """
+    Moves BLOBs of 'table' into the store in batches and empties the 'file' column.
+    Only rows without sha256 are touched, so an interrupted run can simply be restarted.
+    'sniff(first_bytes)' may return a content type for rows that have none.
+    Returns (rows migrated, bytes moved).
+    """
+    if table not in MEDIA_TABLES:
+        raise ValueError(f"Unknown media table: {table}")
+    p = "%s" if db_type == "mysql" else "?"
+    cursor = conn.cursor()
+    migrated = moved = 0
+    after_id = 0
+    while True:
+        # Ids first, then the blobs one row at a time: memory holds one file, not one batch
+        cursor.execute(f"""
+            SELECT id FROM {table}
+            WHERE id > {p} AND sha256 IS NULL AND file IS NOT NULL
+            ORDER BY id LIMIT {p}
+        """, (after_id, batch_size))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            break
+        updates = []
+        for media_id in ids:
+            cursor.execute(f"SELECT file, content_type FROM {table} WHERE id = {p}", (media_id,))
+            data, content_type = cursor.fetchall()[0]
+            data = bytes(data)
+            sha256, size = store.put_bytes(data)
+            if content_type is None and sniff is not None:
+                content_type = sniff(data[:262])
+            updates.append((sha256, size, content_type, media_id))
+            moved += size
+        cursor.executemany(
+            f"UPDATE {table} SET sha256 = {p}, size_bytes = {p}, content_type = {p}, file = NULL WHERE id = {p}",
+            updates)
+        conn.commit()
+        migrated += len(updates)
+        after_id = ids[-1]
+    cursor.close()
+    return migrated, moved
+
+
+def collect_garbage(conn, store, grace_seconds=3600):
+    """
+    Deletes blobs that no photo / video row references any more. Returns the number removed.
+    Blobs younger than 'grace_seconds' are kept: add_media writes the file before its row.
+    """
+    cursor = conn.cursor()
+    referenced = set()
+    for table in MEDIA_TABLES:
+        cursor.execute(f"SELECT DISTINCT sha256 FROM {table} WHERE sha256 IS NOT NULL")
+        referenced.update(row[0] for row in cursor.fetchall())
+    cursor.close()
+    removed = 0
+    cutoff = time.time() - grace_seconds
+    for sha256 in list(store.iter_hashes()):
+        if sha256 not in referenced and os.path.getmtime(store.path(sha256)) < cutoff:
+            store.remove(sha256)
+            removed += 1
+    return removed
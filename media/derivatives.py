@@ -0,0 +1,245 @@
+import io
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from media.blob_store import MEDIA_ROOT
+
+# Downscaled variants for list views: photo thumbnails and video poster frames, each
+# rendered at every width in DERIVATIVE_SIZES (longest edge, px) as JPEG.
+# Rendering runs in a process pool, off the request path; the files are a cache that
+# can always be regenerated, bounded by DERIVATIVE_CACHE_BYTES.
+DERIVATIVE_SIZES = (64, 160, 320, 640)
+DERIVATIVE_ROOT = os.environ.get("MEDIA_DERIVATIVE_ROOT", os.path.join(MEDIA_ROOT, "derivatives"))
+DERIVATIVE_CACHE_BYTES = int(os.environ.get("MEDIA_DERIVATIVE_CACHE_BYTES", str(512 * 1024 * 1024)))
+DERIVATIVE_WORKERS = int(os.environ.get("MEDIA_DERIVATIVE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+POSTER_AT_SECONDS = 1.0
+JPEG_QUALITY = 82
+
+logger = logging.getLogger("app")
+
+
+def _save_variants(image, targets):
+    """
+    Writes 'image' downscaled to each {size: path} in 'targets', largest first so every step
+    shrinks an already smaller image. Files are renamed into place when complete.
+    """
+    from PIL import Image
+
+    image = image.convert("RGB")
+    for size in sorted(targets, reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        path = targets[size]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp:
+            image.save(tmp, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+    return sorted(targets)
+
+
+def render_photo_variants(source_path, targets):
+    """
+    Process-pool task: thumbnails of one photo. Returns the sizes written.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        # JPEG decoders can downscale by 1/2..1/8 while decoding, far cheaper than a full decode
+        image.draft("RGB", (max(targets), max(targets)))
+        image = ImageOps.exif_transpose(image)
+        return _save_variants(image, targets)
+
+
+def render_video_variants(source_path, targets, at_seconds=POSTER_AT_SECONDS):
+    """
+    Process-pool task: poster frames of one video, grabbed with ffmpeg. Returns the sizes written.
+    Videos shorter than 'at_seconds' fall back to their first frame.
+    """
+    from PIL import Image
+
+    for seek in (at_seconds, 0):
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-ss", str(seek), "-i", source_path,
+             "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"],
+            capture_output=True, timeout=60,
+        )
+        if result.returncode == 0 and result.stdout:
+            with Image.open(io.BytesIO(result.stdout)) as frame:
+                return _save_variants(frame, targets)
+    raise RuntimeError(f"ffmpeg found no frame in {source_path}: {result.stderr.decode(errors='replace')[-200:]}")
+
+
+class DerivativeCache:
+    """
+    Size-bounded directory of derivative files: root/ab/<sha256>_<size>.jpg.
+    Serving a variant refreshes its mtime; once the total passes 'max_bytes' the least
+    recently used files are deleted until it is back under 90% of the limit.
+    The files already there are counted on a background thread, so creating the cache does not
+    walk the directory; until that count is in, total_bytes holds only what was added since.
+    """
+
+    def __init__(self, root=DERIVATIVE_ROOT, max_bytes=DERIVATIVE_CACHE_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        # Files added while the first count runs, path -> bytes, so that the walk does not count them twice;
+        # None once the total is complete
+        self._added_uncounted = {}
+        self.counted = threading.Event()
+        threading.Thread(target=self._count, name="derivative-cache-count", daemon=True).start()
+
+    def _count(self):
+        files = {path: size for path, _, size in self._files()}
+        with self._lock:
+            # An eviction in the meantime has counted everything already
+            if self._added_uncounted is not None:
+                added = sum(size for path, size in self._added_uncounted.items() if path not in files)
+                self.total_bytes = sum(files.values()) + added
+                self._added_uncounted = None
+                if self.total_bytes > self.max_bytes:
+                    self.evict()
+        self.counted.set()
+
+    def path(self, sha256, size):
+        return os.path.join(self.root, sha256[:2], f"{sha256}_{size}.jpg")
+
+    def _files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".jpg"):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+
+    def variant(self, sha256, wanted):
+        """
+        Path of the smallest variant at least 'wanted' px wide, else the largest one there is;
+        None if nothing has been rendered yet.
+        """
+        available = [size for size in DERIVATIVE_SIZES if os.path.exists(self.path(sha256, size))]
+        if not available:
+            return None
+        size = next((s for s in available if s >= wanted), available[-1])
+        path = self.path(sha256, size)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def missing_sizes(self, sha256):
+        return {size: self.path(sha256, size) for size in DERIVATIVE_SIZES
+                if not os.path.exists(self.path(sha256, size))}
+
+    def added(self, sha256, sizes):
+        """
+        Accounts for freshly rendered files and evicts if the cache grew past its limit.
+        """
+        with self._lock:
+            for size in sizes:
+                path = self.path(sha256, size)
+                try:
+                    nbytes = os.path.getsize(path)
+                except FileNotFoundError:
+                    continue
+                self.total_bytes += nbytes
+                if self._added_uncounted is not None:
+                    self._added_uncounted[path] = nbytes
+            # Before the first count is in, the total is low, so this never evicts too early
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # A fresh scan also corrects the running total for files other processes added or removed,
+        # and stands in for the first count if that is still running
+        files = sorted(self._files(), key=lambda f: f[1])
+        total = sum(size for _, _, size in files)
+        target = self.max_bytes * 0.9
+        for path, _, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self.total_bytes = total
+        self._added_uncounted = None
+
+
+class DerivativePipeline:
+    """
+    Schedules derivative rendering in a process pool (started on first use). A blob with
+    rendering already in flight is not queued twice. Without Pillow (or ffmpeg, for videos)
+    nothing is rendered and views keep serving the originals.
+    """
+
+    def __init__(self, blob_store, cache=None, max_workers=DERIVATIVE_WORKERS):
+        self.blob_store = blob_store
+        self.cache = cache or DerivativeCache()
+        self.max_workers = max_workers
+        self._executor = None
+        self._pending = {}
+        # Blobs whose rendering failed are not retried until restart
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, kind, sha256):
+        """
+        Queues the missing variants of a photo ('photo') or video ('video'). Returns a Future, or None
+        if every variant exists already.
+        """
+        targets = self.cache.missing_sizes(sha256)
+        if not targets:
+            return None
+        task = render_photo_variants if kind == "photo" else render_video_variants
+        with self._lock:
+            if sha256 in self._failed:
+                return None
+            future = self._pending.get(sha256)
+            if future is not None:
+                return future
+            future = self._pool().submit(task, self.blob_store.path(sha256), targets)
+            self._pending[sha256] = future
+        future.add_done_callback(lambda f: self._done(sha256, f))
+        return future
+
+    def _done(self, sha256, future):
+        error = future.exception()
+        with self._lock:
+            self._pending.pop(sha256, None)
+            if error is not None:
+                self._failed.add(sha256)
+        if error is not None:
+            logger.warning(f"Could not render derivatives of {sha256}: {error}")
+            return
+        self.cache.added(sha256, future.result())
+
+    def variant(self, kind, sha256, wanted):
+        """
+        The best cached variant for a 'wanted' px wide slot; queues rendering and returns None
+        if there is none yet, so the caller can fall back to the original this once.
+        """
+        path = self.cache.variant(sha256, wanted)
+        if path is None:
+            self.submit(kind, sha256)
+        return path
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
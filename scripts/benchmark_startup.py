@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures the Kivy app's cold start: a fresh interpreter per run, timed from before
+# 'import kivy_main' until the first frame has been drawn, and reports which of the deferred
+# dependencies were loaded by then. Usage: python -m scripts.benchmark_startup --runs 5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Imported on first use (ETL, database calls, logging setup), never before the first frame
+DEFERRED_MODULES = ("pandas", "mysql.connector", "yaml")
+# Cold start budget for the regression test (tests/test_ui.py, StartupTestCase), in seconds
+STARTUP_BUDGET = float(os.environ.get("STARTUP_BUDGET_S", "3.0"))
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import kivy_main
+imported = time.perf_counter()
+from kivy.core.window import Window
+from db.lazy import is_loaded
+
+def first_frame(*args):
+    Window.unbind(on_flip=first_frame)
+    print(json.dumps({
+        "import_s": imported - started,
+        "first_frame_s": time.perf_counter() - started,
+        "loaded": [name for name in %r if is_loaded(name)],
+    }))
+    app.stop()
+
+Window.bind(on_flip=first_frame)
+app = kivy_main.SingleSauceKivyApp(recipe_app=kivy_main.RecipeApp(kivy_main.db_configuration))
+app.run()
+"""
+
+
+def measure_startup():
+    """
+    One cold start in a new interpreter: {'import_s', 'first_frame_s', 'loaded'}.
+    """
+    env = dict(os.environ, KIVY_NO_ARGS="1", KIVY_NO_CONSOLELOG="1")
+    result = subprocess.run([sys.executable, "-c", _PROBE % (DEFERRED_MODULES,)], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True, timeout=120)
+    # Kivy may print its own lines; the measurement is the last one
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kivy app cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure_startup() for _ in range(args.runs)]
+    imports = [r["import_s"] * 1000 for r in runs]
+    frames = [r["first_frame_s"] * 1000 for r in runs]
+    print(f"{'':<22}{'median ms':>10}{'max ms':>10}")
+    print(f"{'import kivy_main':<22}{statistics.median(imports):>10.0f}{max(imports):>10.0f}")
+    print(f"{'first frame':<22}{statistics.median(frames):>10.0f}{max(frames):>10.0f}")
+    loaded = sorted({name for r in runs for name in r["loaded"]})
+    print(f"Deferred modules loaded before the first frame: {', '.join(loaded) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
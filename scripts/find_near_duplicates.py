@@ -0,0 +1,30 @@
+import argparse
+
+from db.db import db_configuration
+from db.get_connection import get_db_connection
+from etl.near_duplicates import NEAR_DUPLICATE_THRESHOLD, detect_near_duplicates
+
+# Signs the recipes added since the last run with MinHash, finds the near-duplicates among them
+# and the recipes already signed, and records them in recipe_near_duplicate.
+# Usage: python -m scripts.find_near_duplicates --db-type sqlite --threshold 0.85
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find recipes that are lightly edited copies of other recipes")
+    parser.add_argument("--db-type", choices=("mysql", "sqlite"), default="mysql")
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD,
+                        help="estimated Jaccard similarity from which two recipes count as duplicates")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="drop all stored signatures and pairs and sign every recipe again")
+    args = parser.parse_args()
+
+    conn = get_db_connection(args.db_type, db_configuration)
+    stats = detect_near_duplicates(conn, db_type=args.db_type, page_size=args.page_size,
+                                   rebuild=args.rebuild, threshold=args.threshold)
+    print(f"{stats['recipes']} recipes signed, {stats['pairs']} near-duplicates recorded in recipe_near_duplicate.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import argparse
+
+import filetype
+
+from db.db import db_configuration
+from db.get_connection import get_db_connection
+from media.blob_store import MEDIA_ROOT, MEDIA_TABLES, BlobStore, ensure_media_columns, migrate_blobs
+
+# Moves photo / video BLOBs out of the database into the content-addressed blob store.
+# Safe to interrupt and re-run: rows already moved have a sha256 and are skipped.
+# Usage: python -m scripts.migrate_media_blobs --db mysql --batch-size 50 --reclaim
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move media BLOBs into the on-disk blob store")
+    parser.add_argument("--db", choices=("mysql", "sqlite"), default="mysql")
+    parser.add_argument("--media-root", default=MEDIA_ROOT)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--tables", nargs="+", choices=MEDIA_TABLES, default=list(MEDIA_TABLES))
+    parser.add_argument("--reclaim", action="store_true",
+                        help="rebuild the tables afterwards (OPTIMIZE TABLE / VACUUM) to give the space back")
+    args = parser.parse_args()
+
+    store = BlobStore(args.media_root)
+    conn = get_db_connection(args.db, db_configuration)
+    ensure_media_columns(conn, args.db)
+    for table in args.tables:
+        rows, moved = migrate_blobs(conn, store, table, db_type=args.db, batch_size=args.batch_size,
+                                    sniff=filetype.guess_mime)
+        print(f"{table}: moved {rows} files ({moved / 1024 / 1024:.1f} MiB) to {args.media_root}")
+    if args.reclaim:
+        cursor = conn.cursor()
+        if args.db == "mysql":
+            cursor.execute(f"OPTIMIZE TABLE {', '.join(args.tables)}")
+            cursor.fetchall()
+        else:
+            conn.commit()
+            cursor.execute("VACUUM")
+        cursor.close()
+        print("Database files compacted.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import json
+
+# Tables kept in sync between the local SQLite file and the remote MySQL database, parents
+# before children: (table, primary key columns). category_closure is derived from category
+# and rebuilt after syncing instead of being synced itself.
+SYNC_TABLES = [
+    ("role", ("id",)),
+    ("user", ("id",)),
+    ("category", ("id",)),
+    ("recipe", ("id",)),
+    ("ingredient", ("id",)),
+    ("recipe_ingredient", ("recipe_id", "ingredient_id")),
+    ("cohort", ("id",)),
+    ("user_cohort", ("user_id", "cohort_id")),
+    ("cohort_recipe", ("cohort_id", "recipe_id")),
+    ("review", ("id",)),
+    ("photo", ("id",)),
+    ("recipe_photo", ("recipe_id", "photo_id")),
+    ("video", ("id",)),
+    ("recipe_video", ("recipe_id", "video_id")),
+]
+# Legacy BLOB columns stay behind; media files travel through the blob store, not the sync.
+# recipe.content_hash is the ETL's upsert key of the database that loaded the row (see etl/ledger.py)
+EXCLUDED_COLUMNS = {"photo": {"file"}, "video": {"file"}, "recipe": {"content_hash"}}
+# Rows created offline get ids from this value up, far above anything the remote hands out,
+# and are renumbered to their remote id once pushed
+LOCAL_ID_BASE = 1 << 40
+
+mysql_statements = [
+    """
+    CREATE TABLE IF NOT EXISTS sync_change_log (
+        seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+        table_name VARCHAR(64) NOT NULL,
+        row_pk VARCHAR(255) NOT NULL,
+        op CHAR(1) NOT NULL,
+        origin VARCHAR(64) NOT NULL DEFAULT '',
+        changed_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+        INDEX idx_sync_change_log_table (table_name, seq)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_checkpoint (
+        peer VARCHAR(64) NOT NULL,
+        direction VARCHAR(8) NOT NULL,
+        last_seq BIGINT NOT NULL,
+        PRIMARY KEY (peer, direction)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_device (
+        device_id VARCHAR(64) PRIMARY KEY,
+        pulled_seq BIGINT NOT NULL,
+        last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_push_receipt (
+        device_id VARCHAR(64) NOT NULL,
+        table_name VARCHAR(64) NOT NULL,
+        local_id BIGINT NOT NULL,
+        remote_id BIGINT NOT NULL,
+        PRIMARY KEY (device_id, table_name, local_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_conflict (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        table_name VARCHAR(64) NOT NULL,
+        row_pk VARCHAR(255) NOT NULL,
+        local_row TEXT,
+        remote_row TEXT,
+        resolution VARCHAR(16) NOT NULL,
+        detected_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+]
+
+sqlite_statements = [
+    """
+    CREATE TABLE IF NOT EXISTS sync_change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_pk TEXT NOT NULL,
+        op TEXT NOT NULL,
+        origin TEXT NOT NULL DEFAULT '',
+        changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+    );
+    """,
+    # A table's newest entry in one index descent (see db.db.table_fingerprint)
+    "CREATE INDEX IF NOT EXISTS idx_sync_change_log_table ON sync_change_log (table_name, seq);",
+    # Who is writing right now: '' for the app, otherwise the sync engine. SQLite has no
+    # session variables, so the engine sets this single row inside its own transaction.
+    """
+    CREATE TABLE IF NOT EXISTS sync_session (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        origin TEXT NOT NULL DEFAULT ''
+    );
+    """,
+    "INSERT OR IGNORE INTO sync_session (id, origin) VALUES (1, '');",
+    """
+    CREATE TABLE IF NOT EXISTS sync_checkpoint (
+        peer TEXT NOT NULL,
+        direction TEXT NOT NULL,
+        last_seq INTEGER NOT NULL,
+        PRIMARY KEY (peer, direction)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_device (
+        device_id TEXT PRIMARY KEY,
+        pulled_seq INTEGER NOT NULL,
+        last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_push_receipt (
+        device_id TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        local_id INTEGER NOT NULL,
+        remote_id INTEGER NOT NULL,
+        PRIMARY KEY (device_id, table_name, local_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_conflict (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_pk TEXT NOT NULL,
+        local_row TEXT,
+        remote_row TEXT,
+        resolution TEXT NOT NULL,
+        detected_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+]
+
+
+def encode_pk(values):
+    """
+    Primary key values as stored in sync_change_log.row_pk, e.g. '[5]' or '[1,2]'.
+    """
+    return json.dumps(list(values), separators=(",", ":"))
+
+
+def decode_pk(row_pk):
+    # MySQL's JSON_ARRAY() writes '[1, 2]', SQLite's json_array() '[1,2]'; both parse the same
+    return tuple(json.loads(row_pk))
+
+
+def _trigger_statements(table, pk_columns, db_type):
+    """
+    AFTER INSERT / UPDATE / DELETE triggers appending the row key to sync_change_log.
+    Only keys are logged: the engine reads the current row when it syncs, so any number
+    of edits to one row between two syncs travel as a single upsert.
+    """
+    if db_type == "mysql":
+        origin = "COALESCE(@sync_origin, '')"
+        key = lambda alias: f"JSON_ARRAY({', '.join(f'{alias}.{c}' for c in pk_columns)})"
+        log = f"INSERT INTO sync_change_log (table_name, row_pk, op, origin) VALUES ('{table}', {{key}}, '{{op}}', {origin})"
+        return [
+            f"CREATE TRIGGER {table}_sync_ai AFTER INSERT ON `{table}` FOR EACH ROW "
+            + log.format(key=key("NEW"), op="I"),
+            f"CREATE TRIGGER {table}_sync_au AFTER UPDATE ON `{table}` FOR EACH ROW BEGIN "
+            f"IF NOT ({' AND '.join(f'OLD.{c} <=> NEW.{c}' for c in pk_columns)}) THEN "
+            + log.format(key=key("OLD"), op="D") + "; END IF; "
+            + log.format(key=key("NEW"), op="U") + "; END",
+            f"CREATE TRIGGER {table}_sync_ad AFTER DELETE ON `{table}` FOR EACH ROW "
+            + log.format(key=key("OLD"), op="D"),
+        ]
+    key = lambda alias: f"json_array({', '.join(f'{alias}.{c}' for c in pk_columns)})"
+    log = (f"INSERT INTO sync_change_log (table_name, row_pk, op, origin) "
+           f"SELECT '{table}', {{key}}, '{{op}}', origin FROM sync_session {{where}};")
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_ai AFTER INSERT ON \"{table}\" BEGIN "
+        + log.format(key=key("NEW"), op="I", where="") + " END;",
+        # A changed primary key is logged as a delete of the old key plus an update of the new one
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_au AFTER UPDATE ON \"{table}\" BEGIN "
+        + log.format(key=key("OLD"), op="D", where=f"WHERE {key('OLD')} <> {key('NEW')}") + " "
+        + log.format(key=key("NEW"), op="U", where="") + " END;",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_ad AFTER DELETE ON \"{table}\" BEGIN "
+        + log.format(key=key("OLD"), op="D", where="") + " END;",
+    ]
+
+
+def install_change_log(conn, db_type="mysql", local=False):
+    """
+    Creates the sync bookkeeping tables and the change-log triggers on every table in SYNC_TABLES.
+    Safe to run repeatedly. With local=True (the device's SQLite file) the autoincrement
+    counters are also moved up to LOCAL_ID_BASE, so offline inserts never collide with remote ids.
+    On MySQL with binary logging, creating triggers needs log_bin_trust_function_creators or SUPER.
+    """
+    cursor = conn.cursor()
+    existing = set()
+    if db_type == "mysql":
+        for statement in mysql_statements:
+            cursor.execute(statement.strip())
+        # Logs created before the index existed
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'sync_change_log'
+              AND index_name = 'idx_sync_change_log_table'
+        """)
+        if cursor.fetchall()[0][0] == 0:
+            cursor.execute("CREATE INDEX idx_sync_change_log_table ON sync_change_log (table_name, seq)")
+        cursor.execute("SELECT trigger_name FROM information_schema.triggers WHERE trigger_schema = DATABASE()")
+        existing = {row[0] for row in cursor.fetchall()}
+    else:
+        for statement in sqlite_statements:
+            cursor.execute(statement.strip())
+    for table, pk_columns in SYNC_TABLES:
+        for statement in _trigger_statements(table, pk_columns, db_type):
+            # MySQL before 8.0.29 has no CREATE TRIGGER IF NOT EXISTS
+            if db_type == "mysql" and statement.split()[2] in existing:
+                continue
+            cursor.execute(statement)
+    if local and db_type == "sqlite":
+        for table, pk_columns in SYNC_TABLES:
+            if pk_columns != ("id",):
+                continue
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, LOCAL_ID_BASE))
+            elif row[0] < LOCAL_ID_BASE:
+                cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (LOCAL_ID_BASE, table))
+    conn.commit()
+    cursor.close()
+
+
+def prune_change_log(conn, db_type="mysql"):
+    """
+    Deletes remote log entries every known device has pulled already. Returns the number removed.
+    Devices that stop syncing hold the log back; drop them from sync_device to release it.
+    """
+    p = "%s" if db_type == "mysql" else "?"
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(pulled_seq) FROM sync_device")
+    low = cursor.fetchall()[0][0]
+    removed = 0
+    if low is not None:
+        cursor.execute(f"DELETE FROM sync_change_log WHERE seq <= {p}", (low,))
+        removed = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return removed
@@ -0,0 +1,514 @@
+import json
+import logging
+import os
+import socket
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from db.category_tree import rebuild_category_closure
+from db.db import max_rows_per_statement
+from sync.change_log import EXCLUDED_COLUMNS, LOCAL_ID_BASE, SYNC_TABLES, decode_pk, encode_pk
+
+# Rows (and change-log entries) handled per round trip and per transaction
+SYNC_BATCH_SIZE = int(os.environ.get("SYNC_BATCH_SIZE", "500"))
+# What wins when a row changed on both sides since the last sync:
+#   latest - the side whose change-log entry is newer (ties go to the remote)
+#   remote / local - always that side
+CONFLICT_POLICIES = ("latest", "remote", "local")
+# Identifies this device's writes in the remote change log, so they are not pulled back
+SYNC_DEVICE_ID = os.environ.get("SYNC_DEVICE_ID", socket.gethostname())
+# change-log origin of writes made by the engine itself on the local side
+SYNC_ORIGIN = "sync"
+
+logger = logging.getLogger("app")
+
+
+def _to_sqlite(value):
+    """
+    MySQL row values in the form SQLite stores them (timestamps as text, like CURRENT_TIMESTAMP does).
+    """
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytearray):
+        return bytes(value)
+    return value
+
+
+def _epoch(value):
+    # SQLite logs UTC text, MySQL reads are done through UNIX_TIMESTAMP()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+    return float(value)
+
+
+class SyncEngine:
+    """
+    Two-way delta sync between the device's SQLite file ('local_conn') and the shared remote
+    database ('remote_conn', MySQL in production; any SQLite file works as a stand-in).
+    Both sides need install_change_log() first (local=True for the device). A sync pulls,
+    then pushes:
+      - pull: remote change-log entries after the stored checkpoint, except the ones this
+        device caused, are applied batch by batch; each batch commits together with its checkpoint.
+        The first pull copies the whole remote database.
+      - push: rows named in the local change log are upserted remotely; rows created offline
+        are inserted without their local id and renumbered locally (with all references)
+        to the id the remote assigned. Interrupted pushes are simply repeated.
+    A row changed on both sides is a conflict: it is settled by 'conflict_policy' and
+    recorded in the local sync_conflict table together with both versions.
+    """
+
+    def __init__(self, local_conn, remote_conn, device_id, remote_db_type="mysql", batch_size=SYNC_BATCH_SIZE,
+                 conflict_policy="latest", peer="remote"):
+        if conflict_policy not in CONFLICT_POLICIES:
+            raise ValueError(f"Unknown conflict policy: {conflict_policy}")
+        self.local = local_conn
+        self.remote = remote_conn
+        self.device_id = device_id
+        self.remote_db_type = remote_db_type
+        self.batch_size = batch_size
+        self.conflict_policy = conflict_policy
+        self.peer = peer
+        self._pk = dict(SYNC_TABLES)
+        self._order = [table for table, _ in SYNC_TABLES]
+        self._columns = {table: self._local_columns(table) for table in self._order}
+        self._references = self._local_references()
+        self._id_step = None
+
+    def _p(self, db_type):
+        return "%s" if db_type == "mysql" else "?"
+
+    def _local_columns(self, table):
+        cursor = self.local.cursor()
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in cursor.fetchall() if row[1] not in EXCLUDED_COLUMNS.get(table, ())]
+        cursor.close()
+        return columns
+
+    def _local_references(self):
+        """
+        {parent table: [(child table, column), ...]} from the local foreign keys, for renumbering.
+        """
+        cursor = self.local.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        references = {}
+        for (child,) in cursor.fetchall():
+            cursor.execute(f"PRAGMA foreign_key_list({child})")
+            for row in cursor.fetchall():
+                references.setdefault(row[2], []).append((child, row[3]))
+        cursor.close()
+        return references
+
+    @contextmanager
+    def _writing(self, conn, db_type, origin):
+        """
+        One transaction on 'conn' whose writes the change-log triggers attribute to 'origin'.
+        """
+        cursor = conn.cursor()
+        try:
+            if db_type == "mysql":
+                cursor.execute("SET @sync_origin = %s", (origin,))
+            else:
+                if not conn.in_transaction:
+                    cursor.execute("BEGIN IMMEDIATE")
+                # Children may arrive before their parents within a batch; checked at commit instead
+                cursor.execute("PRAGMA defer_foreign_keys = ON")
+                cursor.execute("UPDATE sync_session SET origin = ? WHERE id = 1", (origin,))
+            yield cursor
+            if db_type == "sqlite":
+                if conn is self.local:
+                    # Locally only the app's own changes need to be remembered
+                    cursor.execute("DELETE FROM sync_change_log WHERE origin <> ''")
+                cursor.execute("UPDATE sync_session SET origin = '' WHERE id = 1")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if db_type == "mysql":
+                # Pooled connections must not keep attributing writes to the sync
+                cursor.execute("SET @sync_origin = NULL")
+            cursor.close()
+
+    ######################
+    # Row access
+    ######################
+    def _fetch_rows(self, conn, db_type, table, keys):
+        """
+        Current rows for the given primary keys: {key tuple: row tuple in self._columns order}.
+        """
+        p = self._p(db_type)
+        columns = self._columns[table]
+        pk = self._pk[table]
+        positions = [columns.index(c) for c in pk]
+        keys = list(keys)
+        rows = {}
+        cursor = conn.cursor()
+        for start in range(0, len(keys), self.batch_size):
+            chunk = keys[start:start + self.batch_size]
+            if len(pk) == 1:
+                where = f"{pk[0]} IN ({', '.join([p] * len(chunk))})"
+            else:
+                where = " OR ".join([f"({' AND '.join(f'{c} = {p}' for c in pk)})"] * len(chunk))
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {where}",
+                           [value for key in chunk for value in key])
+            for row in cursor.fetchall():
+                rows[tuple(row[i] for i in positions)] = tuple(row)
+        cursor.close()
+        return rows
+
+    def _fetch_page(self, conn, db_type, table, after=None):
+        """
+        Next batch of rows in primary key order after the key 'after' (keyset pagination).
+        """
+        p = self._p(db_type)
+        pk = self._pk[table]
+        if after is None:
+            where, params = "", []
+        elif len(pk) == 1:
+            where, params = f"WHERE {pk[0]} > {p}", [after[0]]
+        else:
+            where, params = f"WHERE {pk[0]} > {p} OR ({pk[0]} = {p} AND {pk[1]} > {p})", [after[0], *after]
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(self._columns[table])} FROM {table} {where} "
+                       f"ORDER BY {', '.join(pk)} LIMIT {p}", (*params, self.batch_size))
+        rows = [tuple(row) for row in cursor.fetchall()]
+        cursor.close()
+        return rows
+
+    def _key(self, table, row):
+        columns = self._columns[table]
+        return tuple(row[columns.index(c)] for c in self._pk[table])
+
+    def _upsert(self, cursor, db_type, table, rows):
+        p = self._p(db_type)
+        columns = self._columns[table]
+        pk = self._pk[table]
+        others = [c for c in columns if c not in pk]
+        if db_type == "mysql":
+            update = ", ".join(f"{c} = VALUES({c})" for c in others) or f"{pk[0]} = {pk[0]}"
+            conflict = f"ON DUPLICATE KEY UPDATE {update}"
+        else:
+            update = ", ".join(f"{c} = excluded.{c}" for c in others)
+            conflict = f"ON CONFLICT ({', '.join(pk)}) " + (f"DO UPDATE SET {update}" if others else "DO NOTHING")
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([p] * len(columns))}) {conflict}", rows)
+
+    def _delete(self, cursor, db_type, table, keys):
+        p = self._p(db_type)
+        where = " AND ".join(f"{c} = {p}" for c in self._pk[table])
+        cursor.executemany(f"DELETE FROM {table} WHERE {where}", keys)
+
+    ######################
+    # Checkpoints and conflicts
+    ######################
+    def checkpoint(self, direction="pull"):
+        cursor = self.local.cursor()
+        cursor.execute("SELECT last_seq FROM sync_checkpoint WHERE peer = ? AND direction = ?", (self.peer, direction))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def _set_checkpoint(self, cursor, direction, last_seq):
+        cursor.execute("""
+            INSERT INTO sync_checkpoint (peer, direction, last_seq) VALUES (?, ?, ?)
+            ON CONFLICT (peer, direction) DO UPDATE SET last_seq = excluded.last_seq
+        """, (self.peer, direction, last_seq))
+
+    def _pending_local(self):
+        """
+        Keys changed locally and not pushed yet: {(table, key): time of the latest change}.
+        """
+        cursor = self.local.cursor()
+        cursor.execute("""
+            SELECT table_name, row_pk, MAX(changed_at) FROM sync_change_log
+            WHERE origin = '' GROUP BY table_name, row_pk
+        """)
+        pending = {(table, decode_pk(row_pk)): _epoch(changed_at) for table, row_pk, changed_at in cursor.fetchall()}
+        cursor.close()
+        return pending
+
+    def _resolve(self, local_changed_at, remote_changed_at):
+        if self.conflict_policy == "latest":
+            return "local" if local_changed_at > remote_changed_at else "remote"
+        return self.conflict_policy
+
+    def _record_conflict(self, cursor, table, key, local_row, remote_row, resolution):
+        columns = self._columns[table]
+        image = lambda row: None if row is None else json.dumps(dict(zip(columns, row)), default=str)
+        cursor.execute("""
+            INSERT INTO sync_conflict (table_name, row_pk, local_row, remote_row, resolution)
+            VALUES (?, ?, ?, ?, ?)
+        """, (table, encode_pk(key), image(local_row), image(remote_row), resolution))
+
+    def _mark_device(self, last_seq):
+        p = self._p(self.remote_db_type)
+        if self.remote_db_type == "mysql":
+            statement = f"""
+                INSERT INTO sync_device (device_id, pulled_seq) VALUES ({p}, {p})
+                ON DUPLICATE KEY UPDATE pulled_seq = VALUES(pulled_seq), last_seen = CURRENT_TIMESTAMP
+            """
+        else:
+            statement = """
+                INSERT INTO sync_device (device_id, pulled_seq) VALUES (?, ?)
+                ON CONFLICT (device_id) DO UPDATE SET pulled_seq = excluded.pulled_seq, last_seen = CURRENT_TIMESTAMP
+            """
+        cursor = self.remote.cursor()
+        cursor.execute(statement, (self.device_id, last_seq))
+        self.remote.commit()
+        cursor.close()
+
+    ######################
+    # Pull
+    ######################
+    def pull(self):
+        """
+        Applies remote changes locally. Returns {'upserted', 'deleted', 'conflicts'}.
+        """
+        last_seq = self.checkpoint("pull")
+        if last_seq is None:
+            return self._bootstrap()
+        stats = {"upserted": 0, "deleted": 0, "conflicts": 0}
+        p = self._p(self.remote_db_type)
+        changed_at = "UNIX_TIMESTAMP(changed_at)" if self.remote_db_type == "mysql" else "changed_at"
+        pending = self._pending_local()
+        categories_changed = False
+        while True:
+            cursor = self.remote.cursor()
+            cursor.execute(f"""
+                SELECT seq, table_name, row_pk, origin, {changed_at} FROM sync_change_log
+                WHERE seq > {p} ORDER BY seq LIMIT {p}
+            """, (last_seq, self.batch_size))
+            entries = cursor.fetchall()
+            cursor.close()
+            if not entries:
+                break
+            changed = {}
+            for _, table, row_pk, origin, when in entries:
+                if origin != self.device_id and table in self._pk:
+                    changed.setdefault(table, {})[decode_pk(row_pk)] = _epoch(when)
+            upserts, deletes, conflicts = {}, {}, []
+            for table, keys in changed.items():
+                rows = self._fetch_rows(self.remote, self.remote_db_type, table, keys)
+                for key, when in keys.items():
+                    row = rows.get(key)
+                    if (table, key) in pending:
+                        resolution = self._resolve(pending[(table, key)], when)
+                        local_row = self._fetch_rows(self.local, "sqlite", table, [key]).get(key)
+                        conflicts.append((table, key, local_row, row, resolution))
+                        if resolution == "local":
+                            continue
+                        del pending[(table, key)]
+                    if row is None:
+                        deletes.setdefault(table, []).append(key)
+                    else:
+                        upserts.setdefault(table, []).append(tuple(_to_sqlite(v) for v in row))
+            with self._writing(self.local, "sqlite", SYNC_ORIGIN) as cursor:
+                for table in self._order:
+                    if table in upserts:
+                        self._upsert(cursor, "sqlite", table, upserts[table])
+                for table in reversed(self._order):
+                    if table in deletes:
+                        if table == "category":
+                            cursor.executemany("DELETE FROM category_closure WHERE ancestor_id = ? OR descendant_id = ?",
+                                               [(key[0], key[0]) for key in deletes[table]])
+                        self._delete(cursor, "sqlite", table, deletes[table])
+                for table, key, local_row, remote_row, resolution in conflicts:
+                    self._record_conflict(cursor, table, key, local_row, remote_row, resolution)
+                    if resolution == "remote":
+                        # The local edit is overwritten, so it must not be pushed any more
+                        cursor.execute("DELETE FROM sync_change_log WHERE origin = '' AND table_name = ? AND row_pk = ?",
+                                       (table, encode_pk(key)))
+                last_seq = entries[-1][0]
+                self._set_checkpoint(cursor, "pull", last_seq)
+            self._mark_device(last_seq)
+            categories_changed = categories_changed or "category" in upserts or "category" in deletes
+            stats["upserted"] += sum(len(rows) for rows in upserts.values())
+            stats["deleted"] += sum(len(keys) for keys in deletes.values())
+            stats["conflicts"] += len(conflicts)
+            if len(entries) < self.batch_size:
+                break
+        if categories_changed:
+            rebuild_category_closure(self.local, "sqlite")
+        return stats
+
+    def _bootstrap(self):
+        """
+        First pull: copies every synced table, then continues from the log position read beforehand.
+        Changes made during the copy are pulled again next time; upserts make that harmless.
+        """
+        cursor = self.remote.cursor()
+        cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM sync_change_log")
+        high = cursor.fetchall()[0][0]
+        cursor.close()
+        copied = 0
+        for table in self._order:
+            after = None
+            while True:
+                rows = self._fetch_page(self.remote, self.remote_db_type, table, after)
+                if not rows:
+                    break
+                with self._writing(self.local, "sqlite", SYNC_ORIGIN) as cursor:
+                    self._upsert(cursor, "sqlite", table, [tuple(_to_sqlite(v) for v in row) for row in rows])
+                copied += len(rows)
+                after = self._key(table, rows[-1])
+                if len(rows) < self.batch_size:
+                    break
+        with self._writing(self.local, "sqlite", SYNC_ORIGIN) as cursor:
+            self._set_checkpoint(cursor, "pull", high)
+        self._mark_device(high)
+        rebuild_category_closure(self.local, "sqlite")
+        logger.info(f"Initial sync copied {copied} rows from {self.peer}")
+        return {"upserted": copied, "deleted": 0, "conflicts": 0}
+
+    ######################
+    # Push
+    ######################
+    def push(self):
+        """
+        Sends local changes to the remote. Returns {'upserted', 'inserted', 'deleted'}.
+        """
+        stats = {"upserted": 0, "inserted": 0, "deleted": 0}
+        cursor = self.local.cursor()
+        cursor.execute("SELECT MAX(seq) FROM sync_change_log WHERE origin = ''")
+        high = cursor.fetchone()[0]
+        if high is None:
+            cursor.close()
+            return stats
+        cursor.execute("SELECT DISTINCT table_name, row_pk FROM sync_change_log WHERE origin = '' AND seq <= ?", (high,))
+        pending = {}
+        for table, row_pk in cursor.fetchall():
+            if table in self._pk:
+                pending.setdefault(table, set()).add(decode_pk(row_pk))
+        cursor.close()
+        deletes = {}
+        for table in self._order:
+            # Renumbering a parent rewrites the keys of its pending children, so read them only now
+            keys = sorted(pending.get(table, ()))
+            for start in range(0, len(keys), self.batch_size):
+                chunk = keys[start:start + self.batch_size]
+                rows = self._fetch_rows(self.local, "sqlite", table, chunk)
+                # Deleted before it was ever pushed: nothing to do remotely
+                deletes.setdefault(table, []).extend(
+                    key for key in chunk if key not in rows and all(v < LOCAL_ID_BASE for v in key))
+                if rows:
+                    upserted, inserted = self._push_rows(table, list(rows.values()), pending)
+                    stats["upserted"] += upserted
+                    stats["inserted"] += inserted
+        for table in reversed(self._order):
+            if deletes.get(table):
+                with self._writing(self.remote, self.remote_db_type, self.device_id) as cursor:
+                    self._delete(cursor, self.remote_db_type, table, deletes[table])
+                stats["deleted"] += len(deletes[table])
+        with self._writing(self.local, "sqlite", SYNC_ORIGIN) as cursor:
+            cursor.execute("DELETE FROM sync_change_log WHERE origin = '' AND seq <= ?", (high,))
+        if pending.get("category"):
+            rebuild_category_closure(self.remote, self.remote_db_type)
+        return stats
+
+    def _push_rows(self, table, rows, pending):
+        """
+        Upserts rows that exist remotely already and inserts the ones created offline.
+        Returns (upserted, inserted).
+        """
+        if self._pk[table] != ("id",):
+            with self._writing(self.remote, self.remote_db_type, self.device_id) as cursor:
+                self._upsert(cursor, self.remote_db_type, table, rows)
+            return len(rows), 0
+        id_position = self._columns[table].index("id")
+        existing = [row for row in rows if row[id_position] < LOCAL_ID_BASE]
+        new = [row for row in rows if row[id_position] >= LOCAL_ID_BASE]
+        if existing:
+            with self._writing(self.remote, self.remote_db_type, self.device_id) as cursor:
+                self._upsert(cursor, self.remote_db_type, table, existing)
+        inserted = len(new)
+        # Self references (category.parent_category_id): parents go in an earlier round than their children
+        self_references = [self._columns[table].index(c) for child, c in self._references.get(table, ())
+                           if child == table]
+        while new:
+            new_ids = {row[id_position] for row in new}
+            ready = [row for row in new if not any(row[i] in new_ids for i in self_references)] or new
+            mapping = self._insert_new(table, ready)
+            self._renumber(table, mapping, pending)
+            new = [tuple(mapping.get(v, v) if i in self_references else v for i, v in enumerate(row))
+                   for row in new if row[id_position] not in mapping]
+        return len(existing), inserted
+
+    def _insert_new(self, table, rows):
+        """
+        Inserts offline-created rows remotely, letting the remote assign ids. Returns {local id: remote id}.
+        The mapping is stored remotely in the same transaction (sync_push_receipt), so a push that
+        failed before the local renumbering updates those rows instead of inserting them twice.
+        """
+        db_type = self.remote_db_type
+        p = self._p(db_type)
+        columns = self._columns[table]
+        id_position = columns.index("id")
+        values_at = [i for i, c in enumerate(columns) if c != "id"]
+        mapping = {}
+        with self._writing(self.remote, db_type, self.device_id) as cursor:
+            local_ids = [row[id_position] for row in rows]
+            cursor.execute(f"""
+                SELECT local_id, remote_id FROM sync_push_receipt
+                WHERE device_id = {p} AND table_name = {p} AND local_id IN ({', '.join([p] * len(local_ids))})
+            """, (self.device_id, table, *local_ids))
+            known = dict(cursor.fetchall())
+            if known:
+                self._upsert(cursor, db_type, table, [
+                    tuple(known[row[id_position]] if i == id_position else v for i, v in enumerate(row))
+                    for row in rows if row[id_position] in known])
+                mapping.update(known)
+            fresh = [row for row in rows if row[id_position] not in known]
+            if self._id_step is None:
+                self._id_step = 1
+                if db_type == "mysql":
+                    cursor.execute("SELECT @@auto_increment_increment")
+                    self._id_step = int(cursor.fetchall()[0][0])
+            row_placeholders = "(" + ", ".join([p] * len(values_at)) + ")"
+            max_rows = min(self.batch_size, max_rows_per_statement(db_type, len(values_at)))
+            for start in range(0, len(fresh), max_rows):
+                batch = fresh[start:start + max_rows]
+                # A multi-row INSERT ... VALUES is a "simple insert": InnoDB reserves its whole id range
+                # at once and SQLite assigns ids in VALUES order under the write lock, so they are consecutive
+                cursor.execute(
+                    f"INSERT INTO {table} ({', '.join(columns[i] for i in values_at)}) VALUES "
+                    + ", ".join([row_placeholders] * len(batch)),
+                    [row[i] for row in batch for i in values_at])
+                if db_type == "mysql":
+                    first_id = cursor.lastrowid
+                else:
+                    first_id = cursor.lastrowid - (len(batch) - 1) * self._id_step
+                for n, row in enumerate(batch):
+                    mapping[row[id_position]] = first_id + n * self._id_step
+            cursor.executemany(
+                f"INSERT INTO sync_push_receipt (device_id, table_name, local_id, remote_id) VALUES ({p}, {p}, {p}, {p})",
+                [(self.device_id, table, row[id_position], mapping[row[id_position]]) for row in fresh])
+        return mapping
+
+    def _renumber(self, table, mapping, pending):
+        """
+        Gives pushed rows their remote ids locally and rewrites every foreign key pointing at them.
+        """
+        pairs = [(remote_id, local_id) for local_id, remote_id in mapping.items()]
+        with self._writing(self.local, "sqlite", SYNC_ORIGIN) as cursor:
+            cursor.executemany(f"UPDATE {table} SET id = ? WHERE id = ?", pairs)
+            for child, column in self._references.get(table, ()):
+                cursor.executemany(f"UPDATE {child} SET {column} = ? WHERE {column} = ?", pairs)
+        for child, column in self._references.get(table, ()):
+            if child in pending and column in self._pk[child]:
+                position = self._pk[child].index(column)
+                pending[child] = {tuple(mapping.get(v, v) if i == position else v for i, v in enumerate(key))
+                                  for key in pending[child]}
+
+    def sync(self):
+        """
+        Pull, then push. Returns {'pulled': pull stats, 'pushed': push stats}.
+        """
+        pulled = self.pull()
+        pushed = self.push()
+        logger.info(f"Synced with {self.peer}: pulled {pulled}, pushed {pushed}")
+        return {"pulled": pulled, "pushed": pushed}
@@ -0,0 +1,188 @@
+import hashlib
+import os
+
+from db.category_tree import rebuild_category_closure
+from sync.change_log import LOCAL_ID_BASE
+from sync.engine import SYNC_ORIGIN, _to_sqlite
+
+# Merkle trees over primary-key ranges: a leaf covers RECONCILE_LEAF_SPAN consecutive values of
+# the first key column, every inner node RECONCILE_FANOUT children. Node hashes are computed by
+# the databases themselves (XOR of per-row hashes, plus a row count), so only hashes travel
+# until a differing leaf is found.
+RECONCILE_LEAF_SPAN = int(os.environ.get("RECONCILE_LEAF_SPAN", "64"))
+RECONCILE_FANOUT = int(os.environ.get("RECONCILE_FANOUT", "16"))
+# Stand-in for NULL inside the hashed text; columns are separated by char 31
+_NULL = "~"
+
+
+def _row_hash(text):
+    # First 60 bits of the MD5, so the value fits a signed SQLite integer; MySQL computes the same
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:15], 16)
+
+
+class _XorAggregate:
+    def __init__(self):
+        self.value = 0
+
+    def step(self, value):
+        if value is not None:
+            self.value ^= value
+
+    def finalize(self):
+        return self.value
+
+
+def register_sqlite_functions(conn):
+    """
+    SQLite lacks MD5 and BIT_XOR; these Python versions hash exactly like the MySQL expressions below.
+    """
+    conn.create_function("sync_row_hash", 1, _row_hash, deterministic=True)
+    conn.create_aggregate("sync_bit_xor", 1, _XorAggregate)
+
+
+class Reconciler:
+    """
+    Finds and repairs rows that differ between the two databases of a SyncEngine, e.g. after
+    an outage or a restore. Per table it compares the Merkle trees level by level, descending
+    only into ranges whose hashes differ, and fetches rows only for the differing leaves:
+    queries, transferred data and writes grow with the drift, not with the table.
+    direction='pull' makes the remote the reference and repairs the local file ('push' the other
+    way round). Rows created offline (ids from LOCAL_ID_BASE) and keys with unpushed local changes
+    are left alone; those are the sync engine's business.
+    """
+
+    def __init__(self, engine, leaf_span=RECONCILE_LEAF_SPAN, fanout=RECONCILE_FANOUT):
+        self.engine = engine
+        self.leaf_span = leaf_span
+        self.fanout = fanout
+        register_sqlite_functions(engine.local)
+        if engine.remote_db_type == "sqlite":
+            register_sqlite_functions(engine.remote)
+
+    def _hash_expression(self, table, db_type):
+        columns = self.engine._columns[table]
+        if db_type == "mysql":
+            text = f"CONCAT_WS(CHAR(31), {', '.join(f'COALESCE(CAST({c} AS CHAR), {_NULL!r})' for c in columns)})"
+            return f"BIT_XOR(CONV(SUBSTRING(MD5({text}), 1, 15), 16, 10))"
+        text = " || char(31) || ".join(f"COALESCE(CAST({c} AS TEXT), {_NULL!r})" for c in columns)
+        return f"sync_bit_xor(sync_row_hash({text}))"
+
+    def _level(self, conn, db_type, table, span, low, high):
+        """
+        {node: (row count, hash)} for the nodes of width 'span' inside [low, high).
+        """
+        p = "%s" if db_type == "mysql" else "?"
+        first = self.engine._pk[table][0]
+        node = f"{first} DIV {span}" if db_type == "mysql" else f"{first} / {span}"
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {node}, COUNT(*), {self._hash_expression(table, db_type)}
+            FROM {table}
+            WHERE {first} >= {p} AND {first} < {p}
+            GROUP BY {node}
+        """, (low, high))
+        nodes = {int(n): (int(count), int(digest)) for n, count, digest in cursor.fetchall()}
+        cursor.close()
+        return nodes
+
+    def _max_key(self, conn, db_type, table):
+        p = "%s" if db_type == "mysql" else "?"
+        first = self.engine._pk[table][0]
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT MAX({first}) FROM {table} WHERE {first} < {p}", (LOCAL_ID_BASE,))
+        value = cursor.fetchall()[0][0]
+        cursor.close()
+        return value or 0
+
+    def differing_ranges(self, table):
+        """
+        Walks both trees from the top and returns ([(low, high) of differing leaves], nodes compared).
+        """
+        engine = self.engine
+        sides = ((engine.local, "sqlite"), (engine.remote, engine.remote_db_type))
+        max_key = max(self._max_key(conn, db_type, table) for conn, db_type in sides)
+        span = self.leaf_span
+        while span * self.fanout <= max_key:
+            span *= self.fanout
+        # The top level is a single query over the whole key range, yielding at most 'fanout' nodes
+        ranges = [(0, min(span * self.fanout, LOCAL_ID_BASE))]
+        compared = 0
+        while True:
+            differing = []
+            for low, high in ranges:
+                local_nodes, remote_nodes = (self._level(conn, db_type, table, span, low, high)
+                                             for conn, db_type in sides)
+                for node in sorted(local_nodes.keys() | remote_nodes.keys()):
+                    compared += 1
+                    if local_nodes.get(node) != remote_nodes.get(node):
+                        differing.append((node * span, (node + 1) * span))
+            if span == self.leaf_span or not differing:
+                return differing, compared
+            ranges = differing
+            span //= self.fanout
+
+    def _rows_in(self, conn, db_type, table, low, high):
+        p = "%s" if db_type == "mysql" else "?"
+        first = self.engine._pk[table][0]
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(self.engine._columns[table])} FROM {table} "
+                       f"WHERE {first} >= {p} AND {first} < {p}", (low, high))
+        rows = {self.engine._key(table, row): tuple(_to_sqlite(v) for v in row) for row in cursor.fetchall()}
+        cursor.close()
+        return rows
+
+    def reconcile(self, direction="pull", dry_run=False):
+        """
+        Compares every synced table and, unless 'dry_run', repairs the differences.
+        Returns {table: {'nodes_compared', 'leaf_ranges', 'upserted', 'deleted'}}.
+        """
+        if direction not in ("pull", "push"):
+            raise ValueError(f"Unknown reconcile direction: {direction}")
+        engine = self.engine
+        pending = set(engine._pending_local())
+        report, upserts, deletes = {}, {}, {}
+        for table in engine._order:
+            ranges, compared = self.differing_ranges(table)
+            report[table] = {"nodes_compared": compared, "leaf_ranges": len(ranges), "upserted": 0, "deleted": 0}
+            for low, high in ranges:
+                local_rows = self._rows_in(engine.local, "sqlite", table, low, high)
+                remote_rows = self._rows_in(engine.remote, engine.remote_db_type, table, low, high)
+                source, target = (remote_rows, local_rows) if direction == "pull" else (local_rows, remote_rows)
+                for key in source.keys() | target.keys():
+                    if (table, key) in pending or any(v >= LOCAL_ID_BASE for v in key):
+                        continue
+                    if key not in source:
+                        deletes.setdefault(table, []).append(key)
+                    elif source[key] != target.get(key):
+                        upserts.setdefault(table, []).append(source[key])
+            report[table]["upserted"] = len(upserts.get(table, ()))
+            report[table]["deleted"] = len(deletes.get(table, ()))
+        if dry_run or not (upserts or deletes):
+            return report
+        if direction == "pull":
+            conn, db_type, origin = engine.local, "sqlite", SYNC_ORIGIN
+        else:
+            conn, db_type, origin = engine.remote, engine.remote_db_type, engine.device_id
+        with engine._writing(conn, db_type, origin) as cursor:
+            for table in engine._order:
+                if table in upserts:
+                    engine._upsert(cursor, db_type, table, upserts[table])
+            for table in reversed(engine._order):
+                if table in deletes:
+                    if table == "category":
+                        p = "%s" if db_type == "mysql" else "?"
+                        cursor.executemany(
+                            f"DELETE FROM category_closure WHERE ancestor_id = {p} OR descendant_id = {p}",
+                            [(key[0], key[0]) for key in deletes[table]])
+                    engine._delete(cursor, db_type, table, deletes[table])
+        if "category" in upserts or "category" in deletes:
+            rebuild_category_closure(conn, db_type)
+        return report
+
+
+def format_report(report):
+    """
+    One line per table that needed repairs, for logs and the command line tool.
+    """
+    return [f"{table}: {r['leaf_ranges']} differing ranges, {r['upserted']} upserted, {r['deleted']} deleted "
+            f"({r['nodes_compared']} nodes compared)" for table, r in report.items() if r["leaf_ranges"]]
@@ -1,4 +1,25 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
 import unittest
+from datetime import datetime
+
+import mysql.connector
+import pandas as pd
+
+from db.app_tables import create_app_tables
+from db.bulk_load import bulk_load_recipes, spool_for_load_data
+from db.cache import MemoryCacheBackend, ReadThroughCache, SQLiteCacheBackend
+from db.category_tree import (CategoryTree, add_category, fetch_breadcrumb, fetch_subtree_recipe_counts,
+                              fetch_subtree_recipes, move_category, rebuild_category_closure)
+from db.db import (AdaptiveBatchSizer, bulk_insert_recipes_with_ingredients, fetch_recipes_with_ingredients,
+                   fetch_rows_after, iter_recipes_with_ingredients, table_fingerprint)
+from db.fulltext import search_recipes
+from db.ingredient_index import IngredientIndex
+from db.get_connection import MySQLConnectionPool, SQLiteConnectionManager
+from sync.change_log import install_change_log
 
 
 class MyTestCase(unittest.TestCase):
@@ -6,5 +27,426 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(True, False)
 
 
+class FakeMySQLConnection:
+    def __init__(self, **kwargs):
+        self.connected = True
+        self.in_transaction = False
+
+    def is_connected(self):
+        return self.connected
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        self.connected = False
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def test_mysql_pool_reuses_and_times_out(self):
+        pool = MySQLConnectionPool({}, pool_size=1, max_overflow=0, timeout=0.05,
+                                   connect=FakeMySQLConnection)
+        conn = pool.acquire()
+        raw = conn._raw
+        with self.assertRaises(mysql.connector.errors.PoolError):
+            pool.acquire()
+        conn.close()
+        again = pool.acquire()
+        self.assertIs(again._raw, raw)
+        stats = pool.stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["in_use"], 1)
+
+    def test_mysql_pool_recycles_old_and_dead_connections(self):
+        pool = MySQLConnectionPool({}, pool_size=1, max_overflow=0, max_lifetime=0,
+                                   ping_after=0, connect=FakeMySQLConnection)
+        first = pool.acquire()
+        raw = first._raw
+        first.close()
+        second = pool.acquire()
+        self.assertIsNot(second._raw, raw)
+        self.assertEqual(pool.stats()["recycled"], 1)
+
+    def test_sqlite_connection_is_reused_per_thread(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = SQLiteConnectionManager(os.path.join(tmp, "pool.sqlite"))
+            first = manager.acquire()
+            raw = first._raw
+            first.close()
+            self.assertIs(manager.acquire()._raw, raw)
+            seen = []
+            thread = threading.Thread(target=lambda: seen.append(manager.acquire()._raw))
+            thread.start()
+            thread.join()
+            self.assertIsNot(seen[0], raw)
+            self.assertEqual(manager.stats()["open"], 2)
+            manager.close()
+
+    def test_closed_connection_raises_the_driver_error(self):
+        pool = MySQLConnectionPool({}, connect=FakeMySQLConnection)
+        conn = pool.acquire()
+        conn.close()
+        conn.close()
+        with self.assertRaises(mysql.connector.errors.OperationalError):
+            conn.cursor()
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = SQLiteConnectionManager(os.path.join(tmp, "pool.sqlite"))
+            conn = manager.acquire()
+            conn.close()
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+            manager.close()
+
+    def test_dropped_connection_goes_back_to_the_pool(self):
+        pool = MySQLConnectionPool({}, pool_size=1, max_overflow=0, timeout=0.05,
+                                   connect=FakeMySQLConnection)
+        conn = pool.acquire()
+        raw = conn._raw
+        with self.assertLogs("data", "WARNING"):
+            del conn
+        self.assertEqual(pool.stats()["in_use"], 0)
+        self.assertIs(pool.acquire()._raw, raw)
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = SQLiteConnectionManager(os.path.join(tmp, "pool.sqlite"))
+            with manager.acquire() as outer:
+                outer.execute("CREATE TABLE t (x INTEGER)")
+                outer.commit()
+                with self.assertLogs("data", "WARNING"):
+                    manager.acquire().execute("INSERT INTO t VALUES (1)")
+                # The leaked inner checkout does not end the outer one
+                self.assertTrue(outer.in_transaction)
+            self.assertEqual(manager.stats()["in_use"], 0)
+            with manager.acquire() as conn:
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchall(), [(0,)])
+            manager.close()
+
+    def test_inner_sqlite_release_keeps_outer_transaction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = SQLiteConnectionManager(os.path.join(tmp, "pool.sqlite"))
+            with manager.acquire() as outer:
+                outer.execute("CREATE TABLE t (x INTEGER)")
+                outer.commit()
+                outer.execute("INSERT INTO t VALUES (1)")
+                with manager.acquire() as inner:
+                    inner.execute("SELECT COUNT(*) FROM t").fetchall()
+                self.assertTrue(outer.in_transaction)
+                outer.commit()
+                outer.execute("INSERT INTO t VALUES (2)")
+            # The outermost release still discards what was left uncommitted
+            with manager.acquire() as conn:
+                self.assertEqual(conn.execute("SELECT x FROM t").fetchall(), [(1,)])
+            manager.close()
+
+
+def make_sqlite_db():
+    conn = sqlite3.connect(":memory:")
+    create_app_tables(conn, db_type="sqlite")
+    return conn
+
+
+class BulkInsertTestCase(unittest.TestCase):
+    def test_ids_map_back_to_rows_across_batches(self):
+        conn = make_sqlite_db()
+        conn.executemany("INSERT INTO ingredient (id, name) VALUES (?, ?)", [(1, "Tomato"), (2, "Basil")])
+        conn.execute("INSERT INTO recipe (name, instructions) VALUES ('existing', '-')")
+        conn.commit()
+        df = pd.DataFrame({
+            "name": [f"recipe {i}" for i in range(1200)],
+            "instructions": ["mix"] * 1200,
+            "cooking_time_minutes": [float("nan")] + [10] * 1199,
+            "ingredients_info": [[{"ingredient_id": 1 + i % 2, "quantity": str(i), "unit": "g"}]
+                                 for i in range(1200)],
+        })
+        ids = bulk_insert_recipes_with_ingredients(conn, df, db_type="sqlite", batch_size=100)
+        self.assertEqual(len(ids), 1200)
+        names = dict(conn.execute("SELECT id, name FROM recipe").fetchall())
+        self.assertEqual([names[i] for i in ids], list(df["name"]))
+        bridging = conn.execute(
+            "SELECT r.name, ri.quantity FROM recipe_ingredient ri JOIN recipe r ON r.id = ri.recipe_id"
+        ).fetchall()
+        self.assertEqual(len(bridging), 1200)
+        self.assertTrue(all(name == f"recipe {quantity}" for name, quantity in bridging))
+        self.assertIsNone(conn.execute("SELECT cooking_time_minutes FROM recipe WHERE id = ?", (ids[0],)).fetchone()[0])
+
+    def test_inserting_a_frame_again_adds_nothing(self):
+        conn = make_sqlite_db()
+        conn.executemany("INSERT INTO ingredient (id, name) VALUES (?, ?)", [(1, "Tomato"), (2, "Basil")])
+        conn.commit()
+        df = pd.DataFrame({
+            "name": ["Soup", "Salad", "Soup"],
+            "instructions": ["boil", "mix", "boil"],
+            "ingredients_info": [[{"ingredient_id": 1}], [{"ingredient_id": 1}, {"ingredient_id": 2}],
+                                 [{"ingredient_id": 1}]],
+        })
+        ids = bulk_insert_recipes_with_ingredients(conn, df, db_type="sqlite", batch_size=2, adaptive=False)
+        self.assertEqual(ids[0], ids[2])
+        self.assertEqual(bulk_insert_recipes_with_ingredients(conn, df, db_type="sqlite"), ids)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM recipe").fetchall(), [(2,)])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM recipe_ingredient").fetchall(), [(3,)])
+
+    def test_batch_size_grows_when_round_trip_dominates(self):
+        sizer = AdaptiveBatchSizer(initial=100, round_trip=0.01)
+        sizer.record(100, 0.011)
+        self.assertEqual(sizer.batch_size, 200)
+        slow = AdaptiveBatchSizer(initial=1000, round_trip=0.0001)
+        slow.record(1000, 2.0)
+        self.assertEqual(slow.batch_size, 500)
+
+
+class BulkLoadTestCase(unittest.TestCase):
+    def test_sqlite_load_uses_single_transaction_executemany(self):
+        conn = make_sqlite_db()
+        df = pd.DataFrame({"name": ["a", "b"], "instructions": ["x", None], "cooking_time_minutes": [5, None]})
+        result = bulk_load_recipes(conn, df, db_type="sqlite")
+        self.assertEqual(result["method"], "executemany")
+        self.assertEqual(result["rows"], 2)
+        self.assertEqual(conn.execute("SELECT name, instructions, cooking_time_minutes FROM recipe ORDER BY id").fetchall(),
+                         [("a", "x", 5), ("b", "", None)])
+
+    def test_spool_file_escapes_for_load_data(self):
+        df = pd.DataFrame({"name": ["a\tb\\c", None], "instructions": ["two\nlines", "ok"],
+                           "cooking_time_minutes": [12.0, float("nan")]})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = spool_for_load_data(df, ["name", "instructions", "cooking_time_minutes"], spool_dir=tmp)
+            with open(path, encoding="utf-8") as f:
+                content = f.read()
+        # A NULL name is written as '', as executemany writes it; other NULLs stay \N
+        self.assertEqual(content, "a\\tb\\\\c\ttwo\\nlines\t12\n\tok\t\\N\n")
+
+
+class FetchRecipesTestCase(unittest.TestCase):
+    def test_keyset_pages_never_split_a_recipe(self):
+        conn = make_sqlite_db()
+        conn.executemany("INSERT INTO ingredient (id, name) VALUES (?, ?)", [(i, f"ing {i}") for i in range(1, 6)])
+        for rid in range(1, 6):
+            conn.execute("INSERT INTO recipe (id, name, instructions) VALUES (?, ?, '-')", (rid, f"r{rid}"))
+            conn.executemany("INSERT INTO recipe_ingredient (recipe_id, ingredient_id, quantity) VALUES (?, ?, '1')",
+                             [(rid, i) for i in range(1, rid + 1)])
+        conn.commit()
+        first = fetch_recipes_with_ingredients(conn, limit=2, db_type="sqlite")
+        self.assertEqual([r["id"] for r in first], [1, 2])
+        self.assertEqual(len(first[1]["ingredients"]), 2)
+        rest = fetch_recipes_with_ingredients(conn, limit=10, after_id=first[-1]["id"], db_type="sqlite", fetch_size=2)
+        self.assertEqual([r["id"] for r in rest], [3, 4, 5])
+        self.assertEqual([len(r["ingredients"]) for r in rest], [3, 4, 5])
+        self.assertEqual(rest[2]["ingredients"][0]["ingredient_name"], "ing 1")
+        self.assertEqual(fetch_recipes_with_ingredients(conn, after_id=5, db_type="sqlite"), [])
+
+    def test_created_at_order_sparse_columns_and_export(self):
+        conn = make_sqlite_db()
+        conn.executemany("INSERT INTO recipe (id, name, instructions, created_at) VALUES (?, ?, '-', ?)",
+                         [(1, "a", "2024-03-01"), (2, "b", "2024-01-01"), (3, "c", "2024-01-01"), (4, "d", None)])
+        conn.commit()
+        page = fetch_recipes_with_ingredients(conn, limit=2, db_type="sqlite", order_by="created_at",
+                                              columns=("name",), with_ingredients=False)
+        self.assertEqual(page, [{"id": 2, "created_at": "2024-01-01", "name": "b"},
+                                {"id": 3, "created_at": "2024-01-01", "name": "c"}])
+        rest = fetch_recipes_with_ingredients(conn, limit=2, after_id=3, after_created_at="2024-01-01",
+                                              db_type="sqlite", order_by="created_at")
+        self.assertEqual([r["id"] for r in rest], [1])
+        exported = iter_recipes_with_ingredients(conn, db_type="sqlite", page_size=1, columns=("id",))
+        self.assertEqual([r["id"] for r in exported], [1, 2, 3, 4])
+        self.assertEqual(fetch_rows_after(conn, "category", db_type="sqlite"), [])
+        with self.assertRaises(ValueError):
+            fetch_recipes_with_ingredients(conn, columns=("password",), db_type="sqlite")
+
+
+class IngredientIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = make_sqlite_db()
+        self.conn.executemany("INSERT INTO ingredient (id, name) VALUES (?, ?)", [(i, f"i{i}") for i in range(1, 6)])
+        recipes = {1: [1, 2], 2: [1, 2, 3], 3: [3], 4: [1, 4, 5]}
+        # Plenty of recipes using ingredient 5 so that it is stored as a bitmap
+        recipes.update({rid: [5] for rid in range(10, 200)})
+        for rid, ingredient_ids in recipes.items():
+            self.conn.execute("INSERT INTO recipe (id, name, instructions) VALUES (?, ?, '-')", (rid, f"r{rid}"))
+            self.conn.executemany("INSERT INTO recipe_ingredient (recipe_id, ingredient_id) VALUES (?, ?)",
+                                  [(rid, i) for i in ingredient_ids])
+        self.conn.commit()
+        self.index = IngredientIndex.from_db(self.conn)
+
+    def test_and_or_queries(self):
+        self.assertEqual(self.index.recipes_with_all([1, 2]), [1, 2])
+        self.assertEqual(self.index.recipes_with_all([5, 1]), [4])
+        self.assertEqual(self.index.recipes_with_all([1, 99]), [])
+        self.assertEqual(self.index.recipes_with_any([2, 3, 4]), [1, 2, 3, 4])
+
+    def test_what_can_i_cook_ranks_by_coverage(self):
+        results = self.index.what_can_i_cook([1, 2], max_missing=1)
+        self.assertEqual([(r["recipe_id"], r["missing"]) for r in results], [(1, 0), (2, 1)])
+        self.assertEqual([r["recipe_id"] for r in self.index.what_can_i_cook([1, 2])], [1])
+        self.assertEqual(len(self.index.what_can_i_cook([5], max_missing=5, limit=0)), 191)
+
+    def test_incremental_adds_match_a_rebuild(self):
+        self.index.add(300, [2, 3])
+        self.index.add(2, [4])
+        self.assertEqual(self.index.recipes_with_all([2, 3]), [2, 300])
+        self.assertEqual([(r["recipe_id"], r["missing"]) for r in self.index.what_can_i_cook([2, 3])], [(3, 0), (300, 0)])
+        self.assertEqual([(r["recipe_id"], r["missing"]) for r in self.index.what_can_i_cook([1, 2, 3], max_missing=1)],
+                         [(1, 0), (3, 0), (300, 0), (2, 1)])
+
+    def test_loaded_recipes_are_added(self):
+        self.index.add_loaded([301, None, 1], [
+            [{"ingredient_id": 3}, {"ingredient_id": 4}, {"ingredient_id": None}],
+            [{"ingredient_id": 4}],
+            [{"ingredient_id": 1}, {"ingredient_id": 2}],
+        ])
+        self.assertEqual(self.index.recipes_with_all([3, 4]), [301])
+        self.assertEqual(self.index.recipes_with_any([4]), [4, 301])
+        self.assertEqual([r["recipe_id"] for r in self.index.what_can_i_cook([1, 2])], [1])
+
+
+class FullTextSearchTestCase(unittest.TestCase):
+    def test_triggers_ranking_snippets_and_pages(self):
+        conn = make_sqlite_db()
+        conn.executemany("INSERT INTO recipe (id, name, instructions) VALUES (?, ?, ?)", [
+            (1, "Tomato soup", "Simmer the tomatoes with <b>basil</b>."),
+            (2, "Pasta", "Boil pasta, add a spoon of tomato paste."),
+            (3, "Pancakes", "Whisk flour, milk and eggs."),
+        ])
+        conn.commit()
+        results = search_recipes(conn, "tomato", db_type="sqlite")
+        self.assertEqual([r["id"] for r in results], [1, 2])
+        self.assertIn("<mark>tomato</mark>", results[1]["snippet"])
+        self.assertIn("&lt;b&gt;<mark>basil</mark>", search_recipes(conn, "basil", db_type="sqlite")[0]["snippet"])
+        self.assertIn("<b>[b]basil[/b]", search_recipes(conn, "basil", db_type="sqlite", markup="kivy")[0]["snippet"])
+        self.assertEqual([r["id"] for r in search_recipes(conn, "tomato", db_type="sqlite", limit=1, offset=1)], [2])
+        conn.execute("UPDATE recipe SET instructions = 'Whisk well.' WHERE id = 2")
+        conn.execute("DELETE FROM recipe WHERE id = 1")
+        conn.commit()
+        self.assertEqual(search_recipes(conn, "tomato", db_type="sqlite"), [])
+        self.assertEqual([r["id"] for r in search_recipes(conn, "whis", db_type="sqlite")], [2, 3])
+        self.assertEqual(search_recipes(conn, '" OR *', db_type="sqlite"), [])
+
+
+class CategoryTreeTestCase(unittest.TestCase):
+    def test_closure_follows_adds_and_moves(self):
+        conn = make_sqlite_db()
+        food = add_category(conn, "Food", db_type="sqlite")
+        mains = add_category(conn, "Mains", food, db_type="sqlite")
+        pasta = add_category(conn, "Pasta", mains, db_type="sqlite")
+        desserts = add_category(conn, "Desserts", db_type="sqlite")
+        conn.executemany("INSERT INTO recipe (id, name, instructions, category_id) VALUES (?, ?, 'Cook.', ?)",
+                         [(1, "Carbonara", pasta), (2, "Stew", mains), (3, "Tiramisu", desserts)])
+        conn.commit()
+        self.assertEqual([r["id"] for r in fetch_subtree_recipes(conn, food, db_type="sqlite")], [1, 2])
+        self.assertEqual([r["id"] for r in fetch_subtree_recipes(conn, food, after_id=1, db_type="sqlite")], [2])
+        self.assertEqual([c["name"] for c in fetch_breadcrumb(conn, pasta, db_type="sqlite")],
+                         ["Food", "Mains", "Pasta"])
+
+        move_category(conn, mains, desserts, db_type="sqlite")
+        self.assertEqual([c["name"] for c in fetch_breadcrumb(conn, pasta, db_type="sqlite")],
+                         ["Desserts", "Mains", "Pasta"])
+        self.assertEqual(fetch_subtree_recipe_counts(conn, db_type="sqlite"),
+                         {desserts: 3, mains: 2, pasta: 1})
+        with self.assertRaises(ValueError):
+            move_category(conn, desserts, pasta, db_type="sqlite")
+
+        # Incremental maintenance and a full rebuild agree
+        maintained = sorted(conn.execute("SELECT * FROM category_closure").fetchall())
+        rebuild_category_closure(conn, db_type="sqlite")
+        self.assertEqual(sorted(conn.execute("SELECT * FROM category_closure").fetchall()), maintained)
+
+        tree = CategoryTree.from_db(conn)
+        self.assertEqual([c["id"] for c in tree.breadcrumb(pasta)], [desserts, mains, pasta])
+        self.assertEqual(sorted(tree.subtree_ids(desserts)), sorted([desserts, mains, pasta]))
+        self.assertEqual([(depth, name) for depth, _, name in tree.walk()],
+                         [(0, "Desserts"), (1, "Mains"), (2, "Pasta"), (0, "Food")])
+
+    def test_subtree_of_a_parent_cycle_ends(self):
+        tree = CategoryTree([(1, "A", 2), (2, "B", 1), (3, "C", 2)])
+        self.assertEqual(sorted(tree.subtree_ids(1)), [1, 2, 3])
+
+
+class ReadThroughCacheTestCase(unittest.TestCase):
+    def check_backend(self, make_backend):
+        cache = ReadThroughCache(make_backend(), ttl=60)
+        loads = []
+
+        def loader(value):
+            return lambda: loads.append(value) or [value]
+
+        self.assertEqual(cache.get_or_load("recipes", 50, loader("a")), ["a"])
+        self.assertEqual(cache.get_or_load("recipes", 50, loader("b")), ["a"])
+        cache.invalidate("recipes")
+        self.assertEqual(cache.get_or_load("recipes", 50, loader("c")), ["c"])
+        self.assertEqual(loads, ["a", "c"])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 2, 1))
+
+        # A load that raced with an invalidation is returned but not stored
+        def racing_loader():
+            cache.invalidate("ingredients")
+            return ["stale"]
+
+        self.assertEqual(cache.get_or_load("ingredients", 50, racing_loader), ["stale"])
+        self.assertEqual(cache.get_or_load("ingredients", 50, loader("fresh")), ["fresh"])
+
+        # LRU: 'recipes' was used last, so the oldest entry to go is 'ingredients'
+        cache.backend.max_entries = 2
+        cache.get_or_load("recipes", 50, loader("x"))
+        cache.get_or_load("categories", "all", loader("categories"))
+        self.assertEqual(len(cache.backend), 2)
+        self.assertFalse(cache.backend.get("ingredients", 50)[0])
+        self.assertTrue(cache.backend.get("recipes", 50)[0])
+
+        cache.ttl = 0
+        cache.get_or_load("tags", 1, loader("t"))
+        self.assertFalse(cache.backend.get("tags", 1)[0])
+        return cache
+
+    def test_memory_backend(self):
+        self.check_backend(MemoryCacheBackend)
+
+    def test_sqlite_backend_is_shared_between_instances(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite")
+            self.check_backend(lambda: SQLiteCacheBackend(path, touch_interval=0))
+            worker_a = ReadThroughCache(SQLiteCacheBackend(path))
+            worker_b = ReadThroughCache(SQLiteCacheBackend(path))
+            worker_a.get_or_load("recipes", 10, lambda: [{"id": 1}])
+            self.assertEqual(worker_b.get_or_load("recipes", 10, lambda: []), [{"id": 1}])
+            worker_b.invalidate("recipes")
+            self.assertEqual(worker_a.get_or_load("recipes", 10, lambda: [{"id": 2}]), [{"id": 2}])
+
+    def test_sqlite_backend_stores_json_in_a_private_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "app", "cache.sqlite")
+            backend = SQLiteCacheBackend(path)
+            self.assertFalse(os.path.exists(os.path.dirname(path)))
+            fingerprint = (2, 7, datetime(2024, 2, 1, 12, 30))
+            backend.set("recipes", "fingerprint", fingerprint, 60, backend.generation("recipes"))
+            self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+            self.assertEqual(backend.get("recipes", "fingerprint"), (True, fingerprint))
+            stored = backend._conn().execute("SELECT value FROM cache_entry").fetchone()[0]
+            self.assertEqual(json.loads(stored)["__tuple__"][:2], [2, 7])
+
+
+class TableFingerprintTestCase(unittest.TestCase):
+    def test_fingerprint_moves_on_every_write(self):
+        conn = make_sqlite_db()
+        install_change_log(conn, db_type="sqlite")
+        self.assertEqual(table_fingerprint(conn, "recipe", db_type="sqlite"), (None, None, None))
+        seen = []
+        for statement in ["INSERT INTO recipe (id, name, instructions) VALUES (1, 'a', 'x')",
+                          "INSERT INTO recipe (id, name, instructions) VALUES (2, 'b', 'x')",
+                          "UPDATE recipe SET name = 'c' WHERE id = 1",
+                          "DELETE FROM recipe WHERE id = 1"]:
+            conn.execute(statement)
+            seen.append(table_fingerprint(conn, "recipe", db_type="sqlite"))
+        self.assertEqual(len(set(seen)), 4)
+        self.assertIsInstance(seen[-1][1], datetime)
+        # Other tables do not move it
+        conn.execute("INSERT INTO ingredient (name) VALUES ('salt')")
+        self.assertEqual(table_fingerprint(conn, "recipe", db_type="sqlite"), seen[-1])
+        # Nor does pruning the log down to nothing: MAX(id) is still there
+        conn.execute("DELETE FROM sync_change_log")
+        self.assertEqual(table_fingerprint(conn, "recipe", db_type="sqlite"), (None, None, 2))
+        # A short-lived entry next to long-lived ones
+        cache = ReadThroughCache(MemoryCacheBackend(), ttl=60)
+        cache.get_or_load("recipes", "fingerprint", lambda: seen[-1], ttl=0)
+        self.assertFalse(cache.backend.get("recipes", "fingerprint")[0])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,326 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import pandas as pd
+
+from db.app_tables import create_app_tables
+from db.bulk_load import bulk_load_recipes
+from etl.ingredient_resolver import IngredientResolver
+from etl.ingredients import add_ingredients_info, parse_ingredient_lines
+from etl.ledger import ETLLedger
+from etl.near_duplicates import (NearDuplicateFilter, detect_near_duplicates, drop_stored_duplicates,
+                                 store_frame_signatures)
+from etl.parallel import ParallelETLRunner, _in_order
+from etl.streaming import NameDeduplicator, iter_source_chunks, run_pipeline
+from etl.transform import transform_recipes
+
+
+class StreamingPipelineTestCase(unittest.TestCase):
+    def test_chunks_are_deduplicated_across_the_whole_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "recipes.csv")
+            pd.DataFrame({"name": [f"r{i % 70}" for i in range(250)], "prep_time": range(250)}).to_csv(path, index=False)
+            deduplicator = NameDeduplicator()
+            loaded = []
+            stats = run_pipeline(iter_source_chunks(path, chunk_size=40), deduplicator.filter, loaded.append)
+            names = pd.concat(loaded)["name"].tolist()
+            self.assertEqual(sorted(names), sorted(f"r{i}" for i in range(70)))
+            self.assertEqual(stats["chunks"], 7)
+            self.assertEqual(stats["rows_in"], 250)
+            self.assertEqual(deduplicator.dropped, 180)
+
+    def test_producer_errors_reach_the_caller(self):
+        def chunks():
+            yield pd.DataFrame({"name": ["a"]})
+            raise ValueError("broken source")
+
+        with self.assertRaises(ValueError):
+            run_pipeline(chunks(), lambda chunk: chunk, lambda chunk: None)
+
+    def test_unreadable_sources_give_none(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            files = {"empty.csv": "", "broken.json": '[{"recipe_name": "a"},', "empty.json": "  \n"}
+            for name, text in files.items():
+                with open(os.path.join(tmp, name), "w") as f:
+                    f.write(text)
+                self.assertIsNone(iter_source_chunks(os.path.join(tmp, name)), name)
+
+    def test_json_documents_are_not_read_as_lines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            df = pd.DataFrame({"recipe_name": ["a", "b", "c"], "prep_time": [1, 2, 3]})
+            for name, orient, indent in (("frame.json", "columns", 2), ("one_line.json", "columns", None),
+                                         ("records.jsonl", "records", None)):
+                path = os.path.join(tmp, name)
+                if orient == "records":
+                    df.to_json(path, orient="records", lines=True)
+                else:
+                    df.to_json(path, orient=orient, indent=indent)
+                chunks = list(iter_source_chunks(path, chunk_size=2))
+                self.assertEqual(pd.concat(chunks)["recipe_name"].tolist(), ["a", "b", "c"], name)
+
+
+class IngredientParserTestCase(unittest.TestCase):
+    def test_lines_are_split_into_quantity_unit_name(self):
+        lines = pd.Series(["2 tbsp chopped tomato", "1 ½ Cups flour (optional)", "a pinch of salt",
+                           "1/2 tsp. ground cumin", "2-3 cloves garlic, minced", "Salt to taste", "4 eggs"])
+        parsed = parse_ingredient_lines(lines)
+        self.assertEqual(parsed["quantity"].tolist(), ["2", "1.5", "1", "0.5", "2-3", "", "4"])
+        self.assertEqual(parsed["unit"].tolist(), ["tbsp", "cup", "pinch", "tsp", "clove", "", ""])
+        self.assertEqual(parsed["name"].tolist(), ["tomato", "flour", "salt", "cumin", "garlic", "salt", "eggs"])
+        self.assertEqual(parsed["optional"].tolist(), [False, True, False, False, False, True, False])
+
+    def test_names_starting_with_a_keep_their_first_letter(self):
+        parsed = parse_ingredient_lines(pd.Series(["apple", "anchovies", "an onion", "almonds", "a avocado"]))
+        self.assertEqual(parsed["quantity"].tolist(), ["", "", "1", "", "1"])
+        self.assertEqual(parsed["name"].tolist(), ["apple", "anchovies", "onion", "almonds", "avocado"])
+
+    def test_ingredients_info_per_recipe(self):
+        df = pd.DataFrame({
+            "recipe_name": ["soup", "toast", "water"],
+            "ingredients_list": ["1 l milk\n200 g butter; 3 onions", ["2 slices bread", "butter"], None],
+        }, index=[10, 11, 12])
+        info = add_ingredients_info(df)["ingredients_info"]
+        self.assertEqual(info.index.tolist(), [10, 11, 12])
+        self.assertEqual([[i["name"] for i in row] for row in info], [["milk", "butter", "onions"],
+                                                                       ["bread", "butter"], []])
+        self.assertEqual(info[11][0], {"ingredient_id": None, "name": "bread", "quantity": "2", "unit": "slice",
+                                       "optional": False})
+
+
+class IngredientResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        create_app_tables(self.conn, db_type="sqlite")
+        self.conn.executemany("INSERT INTO ingredient (id, name) VALUES (?, ?)",
+                              [(1, "Tomato"), (2, "Olive oil"), (3, "Oil")])
+        self.conn.commit()
+
+    def test_spellings_resolve_to_one_ingredient(self):
+        resolver = IngredientResolver.from_db(self.conn)
+        names = ["tomatoes", "Tomatoe", "roma tomato", "olive oil", "oil", "mozzarella", "Mozarella", "mozzarellas", None]
+        ids = resolver.resolve(self.conn, names, db_type="sqlite")
+        self.assertEqual(ids[:5], [1, 1, 1, 2, 3])
+        # One new ingredient for all spellings of mozzarella, inserted once
+        self.assertEqual(ids[5:], [ids[5]] * 3 + [None])
+        self.assertEqual(self.conn.execute("SELECT name FROM ingredient WHERE id = ?", (ids[5],)).fetchall(),
+                         [("mozzarella",)])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM ingredient").fetchall(), [(4,)])
+        # A later run starts from the stored aliases
+        again = IngredientResolver.from_db(self.conn)
+        self.assertEqual(again.resolve(self.conn, names[:-1], db_type="sqlite"), ids[:-1])
+        # Seven distinct spellings once plurals are folded, all known now
+        self.assertEqual(again.stats["cached"], 7)
+        self.assertNotIn("new", again.stats)
+
+    def test_new_ingredients_keep_their_spelling(self):
+        resolver = IngredientResolver.from_db(self.conn)
+        names = ["Molasses", "brownies", "Olive Oil", "7-Up", "Brownies", "Brownies"]
+        ids = resolver.resolve(self.conn, names, db_type="sqlite")
+        stored = dict(self.conn.execute("SELECT id, name FROM ingredient").fetchall())
+        # The most frequent spelling names the ingredient; 'Olive Oil' matches the stored 'Olive oil'
+        self.assertEqual([stored[i] for i in ids],
+                         ["Molasses", "Brownies", "Olive oil", "7-Up", "Brownies", "Brownies"])
+        # Matching still goes by the normalised key
+        again = IngredientResolver.from_db(self.conn)
+        self.assertEqual(again.resolve(self.conn, ["molasses", "UP"], db_type="sqlite"), [ids[0], ids[3]])
+
+    def test_load_writes_recipe_ingredients(self):
+        df = add_ingredients_info(pd.DataFrame({
+            "name": ["salad", "soup"],
+            "instructions": ["mix", "boil"],
+            "ingredients_list": ["2 tomatoes\n1 tbsp olive oil\n1 Tomato", "1 l water\n2 tomatoes"],
+        }))
+        IngredientResolver.from_db(self.conn).resolve_chunk(self.conn, df, db_type="sqlite")
+        result = bulk_load_recipes(self.conn, df, db_type="sqlite")
+        self.assertEqual(result["ingredient_rows"], 4)
+        rows = self.conn.execute("""
+            SELECT r.name, i.name, ri.quantity, ri.unit FROM recipe_ingredient ri
+            JOIN recipe r ON r.id = ri.recipe_id JOIN ingredient i ON i.id = ri.ingredient_id
+            ORDER BY r.name, i.name
+        """).fetchall()
+        self.assertEqual(rows, [("salad", "Olive oil", "1", "tbsp"), ("salad", "Tomato", "2", ""),
+                                ("soup", "Tomato", "2", ""), ("soup", "water", "1", "l")])
+
+
+LASAGNE = ("Brown the minced beef with the onion and garlic in a large pan. Add the chopped tomatoes, tomato "
+           "paste and oregano and simmer for thirty minutes. Meanwhile melt the butter, stir in the flour and "
+           "whisk in the milk until the sauce thickens. Layer the meat sauce, lasagne sheets and white sauce "
+           "in a baking dish, finishing with white sauce and grated parmesan. Bake for forty minutes at 180 "
+           "degrees until golden and bubbling, then rest for ten minutes before serving.")
+PANCAKES = ("Whisk the flour, sugar, baking powder and salt in a bowl. Beat in the eggs and milk until smooth "
+            "and leave the batter to rest. Heat a little butter in a frying pan and pour in a ladle of batter. "
+            "Cook until bubbles appear, flip and cook the other side until golden. Serve warm with maple syrup.")
+
+
+def lightly_edited(text):
+    return text.replace("thirty", "30").replace("golden and bubbling", "golden & bubbling").upper()
+
+
+class NearDuplicateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        create_app_tables(self.conn, db_type="sqlite")
+
+    def test_etl_stage_and_load_drop_edited_copies(self):
+        near_duplicates = NearDuplicateFilter()
+        first = near_duplicates.filter(pd.DataFrame({
+            "name": ["Lasagne", "Pancakes", "Nothing"], "instructions": [LASAGNE, PANCAKES, None]}))
+        # A copy from another source in a later chunk of the same run
+        second = near_duplicates.filter(pd.DataFrame({
+            "name": ["Mum's lasagne", "Porridge"], "instructions": [lightly_edited(LASAGNE), "Boil oats in milk."]}))
+        self.assertEqual(first["name"].tolist(), ["Lasagne", "Pancakes", "Nothing"])
+        self.assertEqual(second["name"].tolist(), ["Porridge"])
+        self.assertEqual(near_duplicates.dropped, 1)
+        for chunk in (first, second):
+            result = bulk_load_recipes(self.conn, chunk, db_type="sqlite")
+            store_frame_signatures(self.conn, result["recipe_ids"], chunk, db_type="sqlite")
+        self.assertEqual(self.conn.execute("SELECT COUNT(*), COUNT(signature) FROM recipe_minhash").fetchall(),
+                         [(4, 3)])
+        # A later run only finds the copy through the stored signatures
+        later = NearDuplicateFilter().filter(pd.DataFrame({
+            "name": ["Lasagne al forno", "Pancakes"], "instructions": [lightly_edited(LASAGNE), PANCAKES[::-1]]}))
+        kept, dropped = drop_stored_duplicates(self.conn, later, db_type="sqlite")
+        self.assertEqual((kept["name"].tolist(), dropped), (["Pancakes"], 1))
+
+    def test_batch_job_checks_new_recipes_only(self):
+        self.conn.executemany("INSERT INTO recipe (id, name, instructions) VALUES (?, ?, ?)",
+                              [(1, "Lasagne", LASAGNE), (2, "Pancakes", PANCAKES), (3, "Copy", lightly_edited(LASAGNE))])
+        self.conn.commit()
+        stats = detect_near_duplicates(self.conn, db_type="sqlite", page_size=2)
+        self.assertEqual((stats["recipes"], stats["pairs"]), (3, 1))
+        pairs = self.conn.execute("SELECT recipe_id, duplicate_of, similarity FROM recipe_near_duplicate").fetchall()
+        self.assertEqual(pairs[0][:2], (3, 1))
+        self.assertGreaterEqual(pairs[0][2], 0.8)
+        self.conn.execute("INSERT INTO recipe (id, name, instructions) VALUES (4, 'Crepes', ?)",
+                          (PANCAKES.replace("maple syrup", "lemon and sugar"),))
+        stats = detect_near_duplicates(self.conn, db_type="sqlite")
+        self.assertEqual((stats["recipes"], stats["pairs"]), (1, 1))
+        self.assertEqual(self.conn.execute("SELECT recipe_id, duplicate_of FROM recipe_near_duplicate "
+                                           "ORDER BY recipe_id").fetchall(), [(3, 1), (4, 2)])
+
+
+class ParallelETLTestCase(unittest.TestCase):
+    def write_sources(self, directory):
+        recipes = [(f"r{i}", f"{i % 5 + 1} tbsp spice{i % 7}\n{i} g flour", i) for i in range(60)]
+        files = {
+            "a.csv": recipes[:25],
+            # Repeats r20-r24 by name, and r0 as a copy from another source
+            "b.csv": recipes[20:45] + [("r0 again", recipes[0][1], 0)],
+            "c.json": recipes[45:],
+            "notes.txt": [],
+        }
+        for name, rows in files.items():
+            df = pd.DataFrame(rows, columns=["recipe_name", "ingredients_list", "prep_time"])
+            path = os.path.join(directory, name)
+            if name.endswith(".csv"):
+                df.to_csv(path, index=False)
+            elif name.endswith(".json"):
+                df.to_json(path, orient="records", lines=True)
+            else:
+                open(path, "w").close()
+
+    def run_etl(self, directory, db_path, **kwargs):
+        conn = sqlite3.connect(db_path)
+        create_app_tables(conn, db_type="sqlite")
+        runner = ParallelETLRunner(lambda: sqlite3.connect(db_path, timeout=30), db_type="sqlite",
+                                   resolver=IngredientResolver.from_db(conn), chunk_size=10, **kwargs)
+        stats = runner.run(directory)
+        rows = conn.execute("SELECT id, name, cooking_time_minutes FROM recipe ORDER BY id").fetchall()
+        links = conn.execute("SELECT recipe_id, ingredient_id, quantity FROM recipe_ingredient "
+                             "ORDER BY recipe_id, ingredient_id").fetchall()
+        conn.close()
+        return stats, rows, links
+
+    def test_ids_do_not_depend_on_the_number_of_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.write_sources(tmp)
+            serial = self.run_etl(tmp, os.path.join(tmp, "serial.sqlite"), workers=1, load_workers=1, batch_size=100)
+            parallel = self.run_etl(tmp, os.path.join(tmp, "parallel.sqlite"), workers=3, load_workers=3, batch_size=4)
+        stats, rows, links = parallel
+        self.assertEqual(rows, serial[1])
+        self.assertEqual(links, serial[2])
+        self.assertEqual(rows, [(i + 1, f"r{i}", i) for i in range(60)])
+        self.assertEqual(len(links), 120)
+        self.assertEqual((stats["files"], stats["rows_loaded"], stats["duplicates"], stats["near_duplicates"]),
+                         (3, 60, 5, 1))
+
+    def test_reading_runs_a_bounded_number_of_chunks_ahead(self):
+        read = []
+
+        def chunks():
+            for chunk_no in range(20):
+                read.append(chunk_no)
+                yield chunk_no
+
+        consumed = []
+        for chunk_no, _ in _in_order(chunks(), 3, lambda chunk_no: chunk_no):
+            # The chunk being consumed and at most three read after it
+            self.assertLessEqual(len(read) - chunk_no, 4)
+            consumed.append(chunk_no)
+        self.assertEqual(consumed, list(range(20)))
+
+
+class ETLLedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "etl.sqlite")
+        self.source = os.path.join(self.tmp.name, "recipes.csv")
+        pd.DataFrame({"recipe_name": [f"r{i}" for i in range(30)],
+                      "ingredients_list": [f"{i} g flour\n1 egg" for i in range(30)],
+                      "prep_time": range(30)}).to_csv(self.source, index=False)
+        self.conn = sqlite3.connect(self.db_path)
+        create_app_tables(self.conn, db_type="sqlite")
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def run_etl(self, crash_after=None):
+        ledger = ETLLedger(lambda: sqlite3.connect(self.db_path), self.source, 10, db_type="sqlite").start()
+        loaded = 0
+        for chunk in ledger.pending(iter_source_chunks(self.source, 10)):
+            loaded += 1
+            rows = bulk_load_recipes(self.conn, transform_recipes(chunk), db_type="sqlite")["rows"]
+            if loaded == crash_after:
+                # Loaded, but the process dies before the checkpoint
+                return ledger
+            ledger.chunk_loaded(rows)
+        ledger.finish()
+        return ledger
+
+    def test_same_recipes_are_loaded_once(self):
+        df = transform_recipes(next(iter_source_chunks(self.source, 10)))
+        self.assertEqual(bulk_load_recipes(self.conn, df, db_type="sqlite")["rows"], 10)
+        self.assertEqual(bulk_load_recipes(self.conn, df, db_type="sqlite")["rows"], 0)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM recipe").fetchall(), [(10,)])
+
+    def test_taken_explicit_id_fails_loudly(self):
+        df = transform_recipes(next(iter_source_chunks(self.source, 10))).assign(id=range(1, 11))
+        self.assertEqual(bulk_load_recipes(self.conn, df, db_type="sqlite", explicit_ids=True)["rows"], 10)
+        # Reloading the same recipes under the same ids is a no-op
+        self.assertEqual(bulk_load_recipes(self.conn, df, db_type="sqlite", explicit_ids=True)["rows"], 0)
+        other = transform_recipes(pd.DataFrame({"recipe_name": ["new"], "ingredients_list": ["1 egg"]})).assign(id=[5])
+        with self.assertRaises(sqlite3.IntegrityError):
+            bulk_load_recipes(self.conn, other, db_type="sqlite", explicit_ids=True)
+        self.assertEqual(self.conn.execute("SELECT name FROM recipe WHERE id = 5").fetchall(), [("r4",)])
+
+    def test_restart_skips_completed_chunks(self):
+        crashed = self.run_etl(crash_after=2)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM recipe").fetchall(), [(20,)])
+        resumed = self.run_etl()
+        self.assertEqual((resumed.run_id, resumed.resumed, resumed.skipped), (crashed.run_id, True, 1))
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM recipe").fetchall(), [(30,)])
+        # Chunk 1 went in before the crash, so the reload of it adds nothing
+        self.assertEqual(self.conn.execute("SELECT status, rows_loaded FROM etl_run").fetchall(), [("done", 20)])
+        self.assertEqual(self.conn.execute("SELECT chunk_no, rows_loaded FROM etl_chunk ORDER BY chunk_no").fetchall(),
+                         [(0, 10), (1, 0), (2, 10)])
+        # A finished run is not resumed: the next one starts over and loads nothing new
+        again = self.run_etl()
+        self.assertEqual((again.resumed, again.skipped), (False, 0))
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM recipe").fetchall(), [(30,)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1 +1,217 @@
-# Tests are coming, I can assure you.
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from db.app_tables import create_app_tables
+from db.cache import MemoryCacheBackend, ReadThroughCache
+from db.get_connection import PooledConnection
+from sync.change_log import install_change_log
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Needed only by ETL runs, database calls and the logging setup, never by 'import flask_main'
+DEFERRED_MODULES = ("pandas", "mysql.connector", "yaml", "db.bulk_load", "etl.streaming")
+# Generous: importing Flask itself takes most of it
+IMPORT_BUDGET_MS = float(os.environ.get("FLASK_IMPORT_BUDGET_MS", "1500"))
+
+
+def import_times(module):
+    """
+    Imports 'module' in a fresh interpreter under -X importtime; returns {module: cumulative microseconds}.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class FakeRecipeApp:
+    def __init__(self, db_config=None):
+        self.db_config = db_config or {"database": "test"}
+        self.cache = ReadThroughCache(MemoryCacheBackend())
+
+
+class MySQLStyleCursor(sqlite3.Cursor):
+    """
+    Lets the routes' MySQL-dialect SQL (%s placeholders) run on SQLite.
+    """
+
+    def execute(self, sql, params=()):
+        return super().execute(sql.replace("%s", "?"), params)
+
+
+class FakePool:
+    """
+    Hands out one SQLite connection and counts checkouts that were never given back.
+    """
+
+    def __init__(self):
+        self.raw = sqlite3.connect(":memory:", check_same_thread=False)
+        create_app_tables(self.raw, db_type="sqlite")
+        self.in_use = 0
+        self.configs = []
+
+    def connect(self, db_type, db_config):
+        self.configs.append(db_config)
+        self.in_use += 1
+        return PooledConnection(self.raw, self)
+
+    def release(self, raw):
+        self.in_use -= 1
+
+    def cursor(self):
+        return self.raw.cursor(MySQLStyleCursor)
+
+
+class VersionedRecipeApp(FakeRecipeApp):
+    """
+    The real recipes_version() over a FakePool; the page itself lists plain rows.
+    """
+
+    def __init__(self, pool):
+        import flask_main
+
+        super().__init__()
+        self.pool = pool
+        self.logger = flask_main.logger
+        self._change_log_installed = False
+        self.recipes_version = flask_main.RecipeApp.recipes_version.__get__(self)
+
+    def list_recipes(self, limit=50):
+        return [{"id": row[0], "name": row[1]} for row in self.pool.raw.execute("SELECT id, name FROM recipe")]
+
+
+class FlaskStartupTestCase(unittest.TestCase):
+    def test_import_defers_heavy_modules(self):
+        times = import_times("flask_main")
+        self.assertIn("flask_main", times)
+        self.assertEqual([m for m in DEFERRED_MODULES if m in times], [])
+        self.assertLess(times["flask_main"] / 1000, IMPORT_BUDGET_MS)
+
+    def test_create_app(self):
+        import flask_main
+
+        first, second = FakeRecipeApp(), FakeRecipeApp()
+        app = flask_main.create_app(recipe_app=first, log_config=None)
+        other = flask_main.create_app(recipe_app=second, log_config=None)
+        self.assertEqual(app.test_client().get("/").status_code, 200)
+        # Each application talks to its own RecipeApp
+        first.cache.get_or_load("recipes", "all", lambda: [])
+        self.assertEqual(app.test_client().get("/stats/cache").get_json()["misses"], 1)
+        self.assertEqual(other.test_client().get("/stats/cache").get_json()["misses"], 0)
+
+    def test_run_etl_stays_in_source_dir(self):
+        import flask_main
+
+        client = flask_main.create_app(recipe_app=FakeRecipeApp(), log_config=None).test_client()
+        for source in ("../secrets.csv", "/etc/passwd", "exports/../../*.csv"):
+            self.assertEqual(client.get("/run_etl", query_string={"source": source}).status_code, 400)
+
+
+class JSONAPITestCase(unittest.TestCase):
+    def setUp(self):
+        import flask_main
+
+        self.pool = FakePool()
+        self.pool.raw.executemany("INSERT INTO ingredient (id, name) VALUES (?, ?)",
+                                  [(i, f"ingredient {i}") for i in range(1, 8)])
+        self.pool.raw.executemany("INSERT INTO category (id, name) VALUES (?, ?)", [(1, "Mains"), (2, "Desserts")])
+        self.pool.raw.executemany("INSERT INTO recipe (id, name, instructions) VALUES (?, ?, '-')",
+                                  [(i, f"recipe {i}") for i in range(1, 6)])
+        self.pool.raw.executemany("INSERT INTO recipe_ingredient (recipe_id, ingredient_id) VALUES (?, ?)",
+                                  [(1, 1), (1, 2), (3, 3)])
+        self.pool.raw.commit()
+        original_cursor = PooledConnection.__getattr__
+
+        def getattr_mysql_style(conn, item):
+            return self.pool.cursor if item == "cursor" else original_cursor(conn, item)
+
+        for patcher in (mock.patch.object(flask_main, "get_db_connection", self.pool.connect),
+                        mock.patch.object(PooledConnection, "__getattr__", getattr_mysql_style)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.recipe_app = FakeRecipeApp()
+        self.client = flask_main.create_app(recipe_app=self.recipe_app, log_config=None).test_client()
+
+    def tearDown(self):
+        self.pool.raw.close()
+
+    def test_recipes_are_paged_with_cursors(self):
+        first = self.client.get("/api/recipes", query_string={"limit": 2}).get_json()
+        self.assertEqual([r["id"] for r in first["data"]], [1, 2])
+        self.assertEqual([i["ingredient_id"] for i in first["data"][0]["ingredients"]], [1, 2])
+        second = self.client.get("/api/recipes", query_string={"limit": 2, "after": first["next"]}).get_json()
+        self.assertEqual([r["id"] for r in second["data"]], [3, 4])
+        last = self.client.get("/api/recipes", query_string={"limit": 2, "after": second["next"]}).get_json()
+        self.assertEqual(([r["id"] for r in last["data"]], last["next"]), ([5], None))
+        self.assertEqual(self.pool.in_use, 0)
+        # The app's own configuration, not the module default
+        self.assertTrue(all(config is self.recipe_app.db_config for config in self.pool.configs))
+
+    def test_fields_select_columns(self):
+        page = self.client.get("/api/recipes", query_string={"fields": "id,name"}).get_json()
+        self.assertEqual(page["data"][0], {"id": 1, "name": "recipe 1"})
+        page = self.client.get("/api/categories", query_string={"fields": "name", "limit": 1}).get_json()
+        self.assertEqual(page["data"], [{"name": "Mains"}])
+        page = self.client.get("/api/categories", query_string={"fields": "name", "after": page["next"]}).get_json()
+        self.assertEqual((page["data"], page["next"]), ([{"name": "Desserts"}], None))
+
+    def test_bad_arguments_are_rejected(self):
+        for url, args in (("/api/recipes", {"limit": 0}), ("/api/recipes", {"order": "name"}),
+                          ("/api/recipes", {"after": "not a cursor"}), ("/api/recipes", {"fields": "password"}),
+                          ("/api/ingredients", {"limit": "many"}), ("/api/categories", {"fields": "id,secret"})):
+            with self.subTest(url=url, args=args):
+                response = self.client.get(url, query_string=args)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.get_json())
+        self.assertEqual(self.pool.in_use, 0)
+
+    def test_ndjson_streams_every_row(self):
+        response = self.client.get("/api/ingredients", query_string={"format": "ndjson", "fields": "id,name"})
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([r["id"] for r in rows], list(range(1, 8)))
+        response = self.client.get("/api/recipes", headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 5)
+        self.assertEqual(self.pool.in_use, 0)
+
+    def test_unread_ndjson_stream_returns_its_connection(self):
+        for url in ("/api/recipes", "/api/ingredients", "/api/categories"):
+            # The WSGI server closes every response, whether or not it read the body
+            self.client.head(url, query_string={"format": "ndjson"}).close()
+            self.client.get(url, query_string={"format": "ndjson"}, buffered=False).close()
+        self.assertEqual(self.pool.in_use, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+    def test_unchanged_recipes_are_not_modified(self):
+        import flask_main
+
+        recipe_app = VersionedRecipeApp(self.pool)
+        client = flask_main.create_app(recipe_app=recipe_app, log_config=None).test_client()
+        install = lambda conn, db_type: install_change_log(self.pool.raw, db_type="sqlite")
+        with mock.patch.object(flask_main, "install_change_log", install):
+            first = client.get("/recipes")
+            self.assertEqual(first.status_code, 200)
+            self.assertIn(b"recipe 5", first.data)
+            etag = first.headers["ETag"]
+            again = client.get("/recipes", headers={"If-None-Match": etag})
+            self.assertEqual((again.status_code, again.data), (304, b""))
+            # An edit made elsewhere, e.g. by another worker or the sync, once the cached fingerprint expires
+            self.pool.raw.execute("UPDATE recipe SET name = 'renamed' WHERE id = 2")
+            recipe_app.cache.invalidate("recipes")
+            changed = client.get("/recipes", headers={"If-None-Match": etag})
+            self.assertEqual(changed.status_code, 200)
+            self.assertNotEqual(changed.headers["ETag"], etag)
+            self.assertIn(b"renamed", changed.data)
+        self.assertEqual(self.pool.in_use, 0)
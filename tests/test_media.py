@@ -0,0 +1,136 @@
+import hashlib
+import importlib.util
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from db.app_tables import create_app_tables
+from media.blob_store import BlobStore, add_media, collect_garbage, get_media, get_media_many, migrate_blobs
+from media.derivatives import DerivativeCache, DerivativePipeline
+
+
+class BlobStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = BlobStore(os.path.join(self.tmp.name, "media"))
+        self.conn = sqlite3.connect(":memory:")
+        create_app_tables(self.conn, db_type="sqlite")
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def test_equal_content_is_stored_once(self):
+        data = b"\xff\xd8\xff" + os.urandom(3000)
+        first = add_media(self.conn, self.store, "photo", io.BytesIO(data), "image/jpeg", db_type="sqlite")
+        second = add_media(self.conn, self.store, "photo", io.BytesIO(data), "image/jpeg", db_type="sqlite")
+        self.assertNotEqual(first[0], second[0])
+        self.assertEqual(first[1], hashlib.sha256(data).hexdigest())
+        self.assertEqual(list(self.store.iter_hashes()), [first[1]])
+        self.assertEqual(get_media(self.conn, "photo", first[0], db_type="sqlite"),
+                         {"id": first[0], "sha256": first[1], "size_bytes": 3003, "content_type": "image/jpeg"})
+        self.assertEqual(get_media_many(self.conn, "photo", [second[0], first[0], 99], db_type="sqlite"),
+                         {first[0]: get_media(self.conn, "photo", first[0], db_type="sqlite"),
+                          second[0]: get_media(self.conn, "photo", second[0], db_type="sqlite")})
+        with self.store.mmap(first[1]) as mapped:
+            self.assertEqual(mapped[:3], b"\xff\xd8\xff")
+        with self.assertRaises(ValueError):
+            self.store.path("../../etc/passwd")
+
+    def test_storing_a_blob_again_protects_it_from_garbage_collection(self):
+        sha256, _ = self.store.put_stream(io.BytesIO(b"old photo"))
+        os.utime(self.store.path(sha256), (0, 0))
+        self.store.put_stream(io.BytesIO(b"old photo"))
+        self.assertEqual(collect_garbage(self.conn, self.store), 0)
+        self.assertEqual(list(self.store.iter_hashes()), [sha256])
+        self.assertEqual(os.listdir(os.path.join(self.store.root, "tmp")), [])
+
+    def test_migration_moves_blobs_and_can_resume(self):
+        blobs = [os.urandom(100) for _ in range(5)] + [b"same", b"same"]
+        self.conn.executemany("INSERT INTO video (file) VALUES (?)", [(b,) for b in blobs])
+        self.conn.commit()
+        self.assertEqual(migrate_blobs(self.conn, self.store, "video", db_type="sqlite", batch_size=2,
+                                       sniff=lambda head: "video/mp4"), (7, 508))
+        self.assertEqual(migrate_blobs(self.conn, self.store, "video", db_type="sqlite"), (0, 0))
+        rows = self.conn.execute("SELECT file, sha256, content_type FROM video ORDER BY id").fetchall()
+        self.assertTrue(all(f is None and ct == "video/mp4" for f, _, ct in rows))
+        for blob, (_, sha256, _) in zip(blobs, rows):
+            with self.store.open(sha256) as f:
+                self.assertEqual(f.read(), blob)
+        self.assertEqual(len(list(self.store.iter_hashes())), 6)
+
+        self.conn.execute("DELETE FROM video WHERE id = 1")
+        self.conn.commit()
+        self.assertEqual(collect_garbage(self.conn, self.store), 0)
+        self.assertEqual(collect_garbage(self.conn, self.store, grace_seconds=-1), 1)
+        self.assertFalse(self.store.exists(rows[0][1]))
+
+
+class DerivativeCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_variant(self, cache, sha256, size, nbytes, mtime):
+        path = cache.path(sha256, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * nbytes)
+        os.utime(path, (mtime, mtime))
+        cache.added(sha256, [size])
+
+    def test_smallest_matching_variant_and_lru_eviction(self):
+        cache = DerivativeCache(self.tmp.name, max_bytes=1000)
+        a, b = "a" * 64, "b" * 64
+        self.assertIsNone(cache.variant(a, 100))
+        self.write_variant(cache, a, 64, 100, 1000)
+        self.write_variant(cache, a, 320, 300, 1001)
+        self.assertTrue(cache.variant(a, 100).endswith("_320.jpg"))
+        self.assertTrue(cache.variant(a, 50).endswith("_64.jpg"))
+        self.assertTrue(cache.variant(a, 1000).endswith("_320.jpg"))
+        self.assertEqual(sorted(cache.missing_sizes(a)), [160, 640])
+        # Both 'a' variants were just served, so the oldest file is b's
+        self.write_variant(cache, b, 640, 500, 1002)
+        self.write_variant(cache, b, 160, 200, 1003)
+        self.assertLessEqual(cache.total_bytes, 900)
+        self.assertFalse(os.path.exists(cache.path(b, 640)))
+        self.assertTrue(os.path.exists(cache.path(a, 64)))
+
+    def test_existing_files_are_counted_in_the_background(self):
+        first = DerivativeCache(self.tmp.name, max_bytes=1000)
+        self.assertTrue(first.counted.wait(10))
+        self.write_variant(first, "a" * 64, 64, 100, 1000)
+        self.write_variant(first, "b" * 64, 64, 200, 1001)
+        cache = DerivativeCache(self.tmp.name, max_bytes=1000)
+        self.assertTrue(cache.counted.wait(10))
+        self.assertEqual(cache.total_bytes, 300)
+        # Over the limit already: the count evicts the oldest file
+        over = DerivativeCache(self.tmp.name, max_bytes=250)
+        self.assertTrue(over.counted.wait(10))
+        self.assertEqual(over.total_bytes, 200)
+        self.assertFalse(os.path.exists(over.path("a" * 64, 64)))
+
+    @unittest.skipUnless(importlib.util.find_spec("PIL"), "Pillow is needed to render thumbnails")
+    def test_pipeline_renders_every_size(self):
+        from PIL import Image
+
+        store = BlobStore(os.path.join(self.tmp.name, "media"))
+        buffer = io.BytesIO()
+        Image.new("RGB", (1200, 800), "tomato").save(buffer, "JPEG")
+        sha256, _ = store.put_bytes(buffer.getvalue())
+        pipeline = DerivativePipeline(store, DerivativeCache(os.path.join(self.tmp.name, "derivatives")),
+                                      max_workers=1)
+        try:
+            self.assertEqual(pipeline.submit("photo", sha256).result(timeout=60), [64, 160, 320, 640])
+        finally:
+            pipeline.shutdown()
+        with Image.open(pipeline.variant("photo", sha256, 100)) as thumbnail:
+            self.assertEqual(thumbnail.size, (160, 107))
+
+
+if __name__ == '__main__':
+    unittest.main()
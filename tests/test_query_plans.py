@@ -0,0 +1,101 @@
+import os
+import random
+import sqlite3
+import unittest
+
+import mysql.connector
+
+from db.app_tables import create_app_tables
+from db.category_tree import rebuild_category_closure
+from db.query_plans import HOT_QUERIES, explain, full_scans, render, uses_index
+
+SYNTHETIC_RECIPES = 50000
+SYNTHETIC_INGREDIENTS = 2000
+
+
+def load_synthetic_dataset(conn, db_type):
+    """
+    Fills the app schema with enough rows that a full scan would be clearly wrong.
+    """
+    p = "%s" if db_type == "mysql" else "?"
+    rnd = random.Random(6)
+    cursor = conn.cursor()
+    cursor.executemany(f"INSERT INTO category (id, name, parent_category_id) VALUES ({p}, {p}, {p})",
+                       [(i, f"category {i}", None if i <= 5 else rnd.randint(1, i - 1)) for i in range(1, 101)])
+    rebuild_category_closure(conn, db_type)
+    cursor.executemany(f"INSERT INTO ingredient (id, name) VALUES ({p}, {p})",
+                       [(i, f"ingredient {i}") for i in range(1, SYNTHETIC_INGREDIENTS + 1)])
+    cursor.executemany(
+        f"INSERT INTO recipe (id, name, instructions, category_id, created_at) VALUES ({p}, {p}, {p}, {p}, {p})",
+        [(i, f"recipe {i}", "stir well", rnd.randint(1, 100), f"2024-{1 + i % 12:02d}-{1 + i % 28:02d} 12:00:00")
+         for i in range(1, SYNTHETIC_RECIPES + 1)])
+    bridging = set()
+    for recipe_id in range(1, SYNTHETIC_RECIPES + 1):
+        for ingredient_id in rnd.sample(range(1, SYNTHETIC_INGREDIENTS + 1), 4):
+            bridging.add((recipe_id, ingredient_id))
+    cursor.executemany(f"INSERT INTO recipe_ingredient (recipe_id, ingredient_id, quantity) VALUES ({p}, {p}, '1')",
+                       sorted(bridging))
+    cursor.executemany(f"INSERT INTO review (recipe_id, rating) VALUES ({p}, {p})",
+                       [(rnd.randint(1, SYNTHETIC_RECIPES), rnd.randint(1, 5)) for _ in range(20000)])
+    conn.commit()
+    cursor.execute("ANALYZE TABLE recipe, ingredient, recipe_ingredient, review, category, category_closure"
+                   if db_type == "mysql" else "ANALYZE")
+    if db_type == "mysql":
+        cursor.fetchall()
+    cursor.close()
+
+
+class QueryPlanMixin:
+    db_type = None
+    conn = None
+
+    def test_hot_queries_use_an_index(self):
+        for name, (sql, params, index) in HOT_QUERIES.items():
+            with self.subTest(query=name):
+                plan = explain(self.conn, render(sql, self.db_type), params, self.db_type)
+                self.assertEqual(full_scans(plan, self.db_type), [], f"{name} plan: {plan}")
+                self.assertTrue(uses_index(plan, index, self.db_type), f"{name} does not use {index}: {plan}")
+
+
+class SQLiteQueryPlanTestCase(QueryPlanMixin, unittest.TestCase):
+    db_type = "sqlite"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = sqlite3.connect(":memory:")
+        create_app_tables(cls.conn, db_type="sqlite")
+        load_synthetic_dataset(cls.conn, "sqlite")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+
+@unittest.skipUnless(os.environ.get("MyDB_TEST_DATABASE"),
+                     "set MyDB_TEST_DATABASE to a scratch MySQL schema to run the MySQL plan checks")
+class MySQLQueryPlanTestCase(QueryPlanMixin, unittest.TestCase):
+    db_type = "mysql"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = mysql.connector.connect(
+            host=os.environ.get("MyDB_HOST", "localhost"),
+            user=os.environ.get("MyDB_USER", "singleuser"),
+            password=os.environ.get("MyDB_PASSWORD", "singlepass"),
+        )
+        cursor = cls.conn.cursor()
+        database = os.environ["MyDB_TEST_DATABASE"]
+        cursor.execute(f"DROP DATABASE IF EXISTS {database}")
+        cursor.execute(f"CREATE DATABASE {database}")
+        cursor.execute(f"USE {database}")
+        cursor.close()
+        create_app_tables(cls.conn, db_type="mysql")
+        load_synthetic_dataset(cls.conn, "mysql")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from db.app_tables import create_app_tables
+from db.category_tree import add_category
+from sync.change_log import LOCAL_ID_BASE, install_change_log, prune_change_log
+from sync.engine import SyncEngine
+from sync.reconcile import Reconciler
+
+
+def _open(path, local=False):
+    conn = sqlite3.connect(path)
+    create_app_tables(conn, db_type="sqlite")
+    install_change_log(conn, db_type="sqlite", local=local)
+    return conn
+
+
+class SyncEngineTestCase(unittest.TestCase):
+    """
+    A second SQLite file plays the remote MySQL database.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.remote = _open(os.path.join(self.tmp.name, "remote.sqlite"))
+        self.remote.execute("INSERT INTO category (name) VALUES ('Soups')")
+        self.remote.executemany("INSERT INTO ingredient (name) VALUES (?)", [("Salt",), ("Leek",)])
+        self.remote.execute("INSERT INTO recipe (name, instructions, category_id) VALUES ('Broth', 'Simmer.', 1)")
+        self.remote.execute("INSERT INTO recipe_ingredient (recipe_id, ingredient_id, quantity) VALUES (1, 1, '1 tsp')")
+        self.remote.commit()
+        self.local = _open(os.path.join(self.tmp.name, "local.sqlite"), local=True)
+
+    def tearDown(self):
+        self.local.close()
+        self.remote.close()
+        self.tmp.cleanup()
+
+    def engine(self, **kwargs):
+        return SyncEngine(self.local, self.remote, "device-1", remote_db_type="sqlite", batch_size=2, **kwargs)
+
+    def count(self, conn, sql, params=()):
+        return conn.execute(sql, params).fetchone()[0]
+
+    def test_first_pull_copies_everything_then_only_deltas(self):
+        engine = self.engine()
+        self.assertEqual(engine.pull()["upserted"], 5)
+        self.assertEqual(self.local.execute("SELECT id, name FROM recipe").fetchall(), [(1, "Broth")])
+        self.assertEqual(self.count(self.local, "SELECT COUNT(*) FROM category_closure"), 1)
+        # Another client edits and deletes on the remote
+        self.remote.execute("UPDATE recipe SET instructions = 'Simmer for an hour.' WHERE id = 1")
+        self.remote.execute("DELETE FROM recipe_ingredient")
+        self.remote.commit()
+        self.assertEqual(engine.pull(), {"upserted": 1, "deleted": 1, "conflicts": 0})
+        self.assertEqual(self.count(self.local, "SELECT instructions FROM recipe"), "Simmer for an hour.")
+        self.assertEqual(self.count(self.local, "SELECT COUNT(*) FROM recipe_ingredient"), 0)
+        self.assertEqual(engine.pull(), {"upserted": 0, "deleted": 0, "conflicts": 0})
+        # Pulled rows are not logged as local changes, so nothing goes back
+        self.assertEqual(engine.push(), {"upserted": 0, "inserted": 0, "deleted": 0})
+        self.assertEqual(prune_change_log(self.remote, db_type="sqlite"), 7)
+
+    def test_offline_rows_get_remote_ids_with_their_references(self):
+        engine = self.engine()
+        engine.pull()
+        parent = add_category(self.local, "Cold soups", 1, db_type="sqlite")
+        child = add_category(self.local, "Gazpacho", parent, db_type="sqlite")
+        self.assertGreater(child, LOCAL_ID_BASE)
+        self.local.execute("INSERT INTO recipe (name, instructions, category_id) VALUES ('Salmorejo', 'Blend.', ?)",
+                           (child,))
+        recipe_id = self.count(self.local, "SELECT MAX(id) FROM recipe")
+        self.local.executemany("INSERT INTO recipe_ingredient (recipe_id, ingredient_id) VALUES (?, ?)",
+                               [(recipe_id, 1), (recipe_id, 2)])
+        self.local.execute("UPDATE recipe SET name = 'Chicken broth' WHERE id = 1")
+        self.local.commit()
+        stats = engine.sync()
+        self.assertEqual(stats["pushed"], {"upserted": 3, "inserted": 3, "deleted": 0})
+        expected = [(1, "Chicken broth", 1), (2, "Salmorejo", 3)]
+        for conn in (self.local, self.remote):
+            self.assertEqual(conn.execute("SELECT id, name, category_id FROM recipe ORDER BY id").fetchall(), expected)
+            self.assertEqual(conn.execute("SELECT id, parent_category_id FROM category ORDER BY id").fetchall(),
+                             [(1, None), (2, 1), (3, 2)])
+            self.assertEqual(conn.execute("SELECT recipe_id, ingredient_id FROM recipe_ingredient ORDER BY 1, 2")
+                             .fetchall(), [(1, 1), (2, 1), (2, 2)])
+            self.assertEqual(self.count(conn, "SELECT COUNT(*) FROM category_closure WHERE ancestor_id = 1"), 3)
+        self.assertEqual(self.count(self.local, "SELECT rowid FROM recipe_fts WHERE recipe_fts MATCH 'salmorejo'"), 2)
+        # Our own pushes are skipped when pulling, and nothing is left to push
+        self.assertEqual(engine.sync(), {"pulled": {"upserted": 0, "deleted": 0, "conflicts": 0},
+                                         "pushed": {"upserted": 0, "inserted": 0, "deleted": 0}})
+        # Later offline inserts continue in the local id range
+        self.local.execute("INSERT INTO cohort (name) VALUES ('Family')")
+        self.assertGreater(self.count(self.local, "SELECT MAX(id) FROM cohort"), LOCAL_ID_BASE)
+
+    def test_interrupted_push_is_repeated_without_duplicates(self):
+        engine = self.engine()
+        engine.pull()
+        self.local.execute("INSERT INTO ingredient (name) VALUES ('Thyme')")
+        self.local.commit()
+        with mock.patch.object(SyncEngine, "_renumber", side_effect=RuntimeError("connection lost")):
+            with self.assertRaises(RuntimeError):
+                engine.push()
+        self.assertEqual(self.count(self.remote, "SELECT COUNT(*) FROM ingredient WHERE name = 'Thyme'"), 1)
+        self.local.execute("UPDATE ingredient SET description = 'Dried' WHERE name = 'Thyme'")
+        self.local.commit()
+        engine.push()
+        self.assertEqual(self.remote.execute("SELECT id, description FROM ingredient WHERE name = 'Thyme'").fetchall(),
+                         [(3, "Dried")])
+        self.assertEqual(self.count(self.local, "SELECT id FROM ingredient WHERE name = 'Thyme'"), 3)
+
+    def test_conflicts_follow_the_policy_and_are_recorded(self):
+        for policy, winner in (("remote", "Remote broth"), ("local", "Local broth")):
+            with self.subTest(policy=policy):
+                engine = self.engine(conflict_policy=policy)
+                engine.pull()
+                self.remote.execute("UPDATE recipe SET name = 'Remote broth' WHERE id = 1")
+                self.remote.commit()
+                self.local.execute("UPDATE recipe SET name = 'Local broth' WHERE id = 1")
+                self.local.commit()
+                self.assertEqual(engine.sync()["pulled"]["conflicts"], 1)
+                for conn in (self.local, self.remote):
+                    self.assertEqual(self.count(conn, "SELECT name FROM recipe WHERE id = 1"), winner)
+                row_pk, resolution = self.local.execute(
+                    "SELECT row_pk, resolution FROM sync_conflict ORDER BY id DESC").fetchone()
+                self.assertEqual((row_pk, resolution), ("[1]", policy))
+        with self.assertRaises(ValueError):
+            self.engine(conflict_policy="merge")
+
+
+class ReconcilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.remote = _open(os.path.join(self.tmp.name, "remote.sqlite"))
+        self.remote.executemany("INSERT INTO ingredient (name) VALUES (?)", [(f"ingredient {i}",) for i in range(3000)])
+        self.remote.executemany("INSERT INTO recipe (name, instructions) VALUES (?, 'Cook.')",
+                                [(f"recipe {i}",) for i in range(500)])
+        self.remote.executemany("INSERT INTO recipe_ingredient (recipe_id, ingredient_id) VALUES (?, ?)",
+                                [(r, i) for r in range(1, 501) for i in (1, 2)])
+        self.remote.commit()
+        self.local = _open(os.path.join(self.tmp.name, "local.sqlite"), local=True)
+        self.engine = SyncEngine(self.local, self.remote, "device-1", remote_db_type="sqlite")
+        self.engine.pull()
+        self.reconciler = Reconciler(self.engine, leaf_span=16, fanout=4)
+
+    def tearDown(self):
+        self.local.close()
+        self.remote.close()
+        self.tmp.cleanup()
+
+    def test_identical_replicas_stop_at_the_top_level(self):
+        report = self.reconciler.reconcile()
+        self.assertTrue(all(r["leaf_ranges"] == 0 for r in report.values()))
+        self.assertLessEqual(report["ingredient"]["nodes_compared"], 4)
+
+    def test_only_drifted_ranges_are_visited_and_repaired(self):
+        # Drift the local file behind the sync engine's back, as a restored backup would
+        self.local.execute("UPDATE sync_session SET origin = 'restore'")
+        self.local.execute("UPDATE ingredient SET name = 'stale' WHERE id = 2000")
+        self.local.execute("DELETE FROM recipe_ingredient WHERE recipe_id = 7 AND ingredient_id = 2")
+        self.local.execute("INSERT INTO ingredient (id, name) VALUES (5000, 'ghost')")
+        self.local.execute("UPDATE sync_session SET origin = ''")
+        self.local.execute("DELETE FROM sync_change_log")
+        self.local.commit()
+        report = self.reconciler.reconcile(dry_run=True)
+        self.assertEqual(report["ingredient"]["leaf_ranges"], 2)
+        self.assertEqual((report["ingredient"]["upserted"], report["ingredient"]["deleted"]), (1, 1))
+        self.assertEqual(report["recipe_ingredient"]["upserted"], 1)
+        self.assertEqual(report["recipe"]["leaf_ranges"], 0)
+        # Far fewer nodes than the 3000 / 16 leaves a full comparison would need
+        self.assertLess(report["ingredient"]["nodes_compared"], 40)
+        self.reconciler.reconcile()
+        self.assertEqual(self.count("SELECT name FROM ingredient WHERE id = 2000"), "ingredient 1999")
+        self.assertEqual(self.count("SELECT COUNT(*) FROM ingredient WHERE id = 5000"), 0)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM recipe_ingredient WHERE recipe_id = 7"), 2)
+        self.assertTrue(all(r["leaf_ranges"] == 0 for r in self.reconciler.reconcile().values()))
+
+    def test_unpushed_local_changes_are_left_to_the_sync(self):
+        self.local.execute("UPDATE ingredient SET name = 'edited offline' WHERE id = 1")
+        self.local.commit()
+        report = self.reconciler.reconcile()
+        self.assertEqual(report["ingredient"]["leaf_ranges"], 1)
+        self.assertEqual(report["ingredient"]["upserted"], 0)
+        self.assertEqual(self.count("SELECT name FROM ingredient WHERE id = 1"), "edited offline")
+
+    def count(self, sql):
+        return self.local.execute(sql).fetchone()[0]
+
+
+if __name__ == '__main__':
+    unittest.main()
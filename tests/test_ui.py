@@ -0,0 +1,172 @@
+import ast
+import importlib.util
+import os
+import subprocess
+import sys
+import threading
+import unittest
+
+import pandas as pd
+
+from etl.streaming import run_pipeline
+from scripts.benchmark_startup import DEFERRED_MODULES, ROOT, STARTUP_BUDGET, measure_startup
+from ui.pager import KeysetPager
+from ui.tasks import BackgroundTasks
+
+
+class FakeClock:
+    """
+    Collects scheduled callbacks; run() plays the Kivy main loop and executes them on the test thread.
+    """
+
+    def __init__(self):
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def schedule(self, callback):
+        with self.lock:
+            self.callbacks.append(callback)
+
+    def run(self):
+        with self.lock:
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class BackgroundTasksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tasks = BackgroundTasks(max_workers=2, schedule=self.clock.schedule)
+
+    def tearDown(self):
+        self.tasks.shutdown(wait=True)
+
+    def drain(self):
+        # Waits for the workers, including their done-callbacks, then plays one frame
+        self.tasks.shutdown(wait=True, cancel_pending=False)
+        self.clock.run()
+
+    def test_results_and_errors_are_delivered_on_the_ui_thread(self):
+        seen = []
+        ui_thread = threading.get_ident()
+        record = lambda kind: lambda value: seen.append((kind, value, threading.get_ident() == ui_thread))
+        done = self.tasks.submit(lambda x: x * 2, 21, on_done=record("done"), on_finished=record("finished"))
+        failed = self.tasks.submit(lambda: 1 / 0, on_error=lambda err: seen.append(("error", type(err), True)))
+        self.drain()
+        self.assertIn(("done", 42, True), seen)
+        self.assertIn(("finished", done, True), seen)
+        self.assertIn(("error", ZeroDivisionError, True), seen)
+
+    def test_cancelled_tasks_stop_and_drop_their_results(self):
+        started, release = threading.Event(), threading.Event()
+        seen = []
+
+        def work(task):
+            started.set()
+            for step in range(1000):
+                release.wait()
+                if not task.report(step):
+                    return "stopped early"
+            return "ran to the end"
+
+        task = self.tasks.submit(work, with_task=True, on_progress=seen.append, on_done=seen.append,
+                                 on_finished=lambda t: seen.append("finished"))
+        started.wait()
+        task.cancel()
+        release.set()
+        self.assertEqual(task.future.result(), "stopped early")
+        self.drain()
+        self.assertEqual(seen, ["finished"])
+
+    def test_progress_reports_are_coalesced(self):
+        seen = []
+        task = self.tasks.submit(lambda task: [task.report(i) for i in range(100)], with_task=True,
+                                 on_progress=seen.append)
+        self.drain()
+        # The UI thread was busy the whole time: it only needs the latest state
+        self.assertEqual(seen, [99])
+
+    def test_pipeline_stops_when_progress_says_so(self):
+        chunks = (pd.DataFrame({"name": [f"r{i}"]}) for i in range(10))
+        loaded = []
+        stats = run_pipeline(chunks, lambda chunk: chunk, loaded.append, progress=lambda s: s["chunks"] < 3)
+        self.assertTrue(stats["cancelled"])
+        self.assertEqual(len(loaded), 3)
+
+
+class KeysetPagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.source = [{"id": i} for i in range(1, 251)]
+        self.pager = KeysetPager(page_size=100, prefetch=30)
+
+    def fetch(self, request):
+        generation, after, limit = request
+        return generation, [row for row in self.source if row["id"] > (after or 0)][:limit]
+
+    def test_pages_are_requested_only_near_the_end(self):
+        self.pager.page_loaded(*self.fetch(self.pager.next_request()))
+        self.assertIsNone(self.pager.next_request(visible_index=20))
+        request = self.pager.next_request(visible_index=75)
+        self.assertEqual(request[1:], (100, 100))
+        # One page in flight at a time
+        self.assertIsNone(self.pager.next_request(visible_index=99))
+        self.pager.page_loaded(*self.fetch(request))
+        self.pager.page_loaded(*self.fetch(self.pager.next_request(visible_index=190)))
+        self.assertEqual([row["id"] for row in self.pager.rows], list(range(1, 251)))
+        self.assertTrue(self.pager.exhausted)
+        self.assertIsNone(self.pager.next_request(visible_index=249))
+
+    def test_pages_from_before_a_reset_are_ignored(self):
+        stale = self.pager.next_request()
+        self.pager.reset()
+        fresh = self.pager.next_request()
+        self.assertIsNone(self.pager.page_loaded(*self.fetch(stale)))
+        self.assertEqual(len(self.pager.page_loaded(*self.fetch(fresh))), 100)
+        self.assertEqual(len(self.pager), 100)
+
+    def test_failed_page_is_requested_again(self):
+        request = self.pager.next_request()
+        self.pager.page_failed(request[0])
+        self.assertFalse(self.pager.exhausted)
+        self.assertEqual(self.pager.next_request(), request)
+
+
+def loaded_in_fresh_interpreter(code):
+    """
+    Runs 'code' in a new interpreter and returns which of the deferred modules got loaded.
+    """
+    probe = f"{code}\nfrom db.lazy import is_loaded\nprint([m for m in {DEFERRED_MODULES!r} if is_loaded(m)])"
+    result = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, check=True)
+    return ast.literal_eval(result.stdout.strip().splitlines()[-1])
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_lazy_import_loads_on_first_use(self):
+        code = "from db.lazy import lazy_import\npd = lazy_import('pandas')"
+        self.assertEqual(loaded_in_fresh_interpreter(code), [])
+        self.assertEqual(loaded_in_fresh_interpreter(code + "\npd.DataFrame"), ["pandas"])
+
+    def test_lazy_import_loads_once_across_threads(self):
+        code = ("import threading\nfrom db.lazy import lazy_import\npd = lazy_import('pandas')\n"
+                "frames = []\n"
+                "threads = [threading.Thread(target=lambda: frames.append(pd.DataFrame({'a': [1]}))) for _ in range(8)]\n"
+                "[t.start() for t in threads]\n[t.join() for t in threads]\nassert len(frames) == 8")
+        self.assertEqual(loaded_in_fresh_interpreter(code), ["pandas"])
+
+    def test_startup_modules_defer_heavy_imports(self):
+        # What kivy_main imports besides Kivy itself
+        code = ("import db.cache, db.category_tree, db.db, db.fulltext, db.get_connection, db.ingredient_index, db.lazy, "
+                "media.blob_store, media.derivatives, sync.change_log, sync.engine, ui.pager, ui.tasks")
+        self.assertEqual(loaded_in_fresh_interpreter(code), [])
+
+    @unittest.skipUnless(importlib.util.find_spec("kivy") and (os.environ.get("DISPLAY") or sys.platform != "linux"),
+                         "Kivy and a display are needed to draw a frame")
+    def test_time_to_first_frame(self):
+        result = measure_startup()
+        self.assertEqual(result["loaded"], [])
+        self.assertLess(result["first_frame_s"], STARTUP_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
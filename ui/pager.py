@@ -0,0 +1,62 @@
+import os
+
+# Rows fetched per page, and how close to the end of the loaded rows the user may scroll
+# before the next page is requested
+LIST_PAGE_SIZE = int(os.environ.get("UI_LIST_PAGE_SIZE", "100"))
+LIST_PREFETCH_ROWS = int(os.environ.get("UI_LIST_PREFETCH_ROWS", "40"))
+
+
+class KeysetPager:
+    """
+    State of an infinite-scroll list over a keyset-paginated source: the rows loaded so far,
+    the key to continue after, whether a page is in flight and whether the source is exhausted.
+    It does no I/O itself: next_request() says what to fetch, page_loaded() takes the result,
+    so the fetching can happen on a worker thread (see ui/tasks.py).
+    """
+
+    def __init__(self, page_size=LIST_PAGE_SIZE, prefetch=LIST_PREFETCH_ROWS, key=lambda row: row["id"]):
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.key = key
+        self.reset()
+
+    def reset(self):
+        self.rows = []
+        self.after = None
+        self.loading = False
+        self.exhausted = False
+        # Pages requested before a reset are ignored when they arrive
+        self.generation = getattr(self, "generation", 0) + 1
+
+    def __len__(self):
+        return len(self.rows)
+
+    def next_request(self, visible_index=None):
+        """
+        Returns (generation, after_key, limit) if a page should be fetched now, else None.
+        'visible_index' is the last row on screen; without it a page is requested whenever possible.
+        """
+        if self.loading or self.exhausted:
+            return None
+        if visible_index is not None and len(self.rows) - visible_index > self.prefetch:
+            return None
+        self.loading = True
+        return self.generation, self.after, self.page_size
+
+    def page_loaded(self, generation, rows):
+        """
+        Appends a fetched page. Returns the new rows, or None if the page belongs to an earlier reset.
+        """
+        if generation != self.generation:
+            return None
+        self.loading = False
+        if len(rows) < self.page_size:
+            self.exhausted = True
+        if rows:
+            self.after = self.key(rows[-1])
+            self.rows.extend(rows)
+        return rows
+
+    def page_failed(self, generation):
+        if generation == self.generation:
+            self.loading = False
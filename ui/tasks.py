@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads for RecipeApp calls made from the Kivy UI. The calls mostly wait on the
+# database, so a handful of threads is plenty and the GIL is not a concern.
+UI_WORKERS = int(os.environ.get("UI_WORKERS", "4"))
+
+logger = logging.getLogger("app")
+
+_NOTHING = object()
+
+
+class TaskCancelled(Exception):
+    """
+    Raised by Task.check() inside a task whose cancel() was called.
+    """
+
+
+def kivy_schedule(callback):
+    """
+    Runs 'callback' on the Kivy main thread at the start of the next frame.
+    """
+    from kivy.clock import Clock
+
+    Clock.schedule_once(lambda dt: callback(), 0)
+
+
+class Task:
+    """
+    Handle of one background call. Its callbacks always run on the UI thread. on_done,
+    on_error and on_progress are dropped once the task is cancelled, so a screen never
+    receives stale results; on_finished(task) always runs when the worker is done with it,
+    which is the place to take a loading indicator down again.
+    Long-running functions get the handle as 'task' and use report() / check().
+    """
+
+    def __init__(self, schedule, on_done=None, on_error=None, on_progress=None, on_finished=None):
+        self._schedule = schedule
+        self._on_done = on_done
+        self._on_error = on_error
+        self._on_progress = on_progress
+        self._on_finished = on_finished
+        self._cancelled = threading.Event()
+        self._progress = _NOTHING
+        self._progress_lock = threading.Lock()
+        self.future = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Drops the pending callbacks. A task that has not started yet does not run at all;
+        a running one stops at its next report() / check().
+        """
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def check(self):
+        if self.cancelled:
+            raise TaskCancelled()
+
+    def report(self, progress):
+        """
+        Worker side: passes 'progress' to on_progress on the UI thread. While an earlier report
+        is still waiting for the UI thread, newer ones replace it instead of queueing up.
+        Returns False once the task was cancelled, so loops can stop (see etl.streaming.run_pipeline).
+        """
+        if self.cancelled:
+            return False
+        if self._on_progress is not None:
+            with self._progress_lock:
+                waiting = self._progress is not _NOTHING
+                self._progress = progress
+            if not waiting:
+                self._schedule(self._deliver_progress)
+        return True
+
+    def _deliver_progress(self):
+        with self._progress_lock:
+            progress, self._progress = self._progress, _NOTHING
+        if progress is not _NOTHING and not self.cancelled:
+            self._on_progress(progress)
+
+    def _finished(self, future):
+        error = None if future.cancelled() else future.exception()
+
+        def deliver():
+            if not self.cancelled and not future.cancelled():
+                if error is None:
+                    if self._on_done is not None:
+                        self._on_done(future.result())
+                elif self._on_error is not None:
+                    self._on_error(error)
+                else:
+                    logger.error(f"Background task failed: {error!r}")
+            if self._on_finished is not None:
+                self._on_finished(self)
+
+        self._schedule(deliver)
+
+
+class BackgroundTasks:
+    """
+    Runs blocking RecipeApp calls on worker threads so the Kivy main loop keeps drawing frames;
+    results come back through 'schedule' (Clock.schedule_once by default).
+    """
+
+    def __init__(self, max_workers=UI_WORKERS, schedule=kivy_schedule):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ui-task")
+        self._schedule = schedule
+
+    def submit(self, fn, *args, on_done=None, on_error=None, on_progress=None, on_finished=None, with_task=False,
+               **kwargs):
+        """
+        Calls fn(*args, **kwargs) on a worker thread and returns its Task. With with_task=True the
+        Task is passed as the 'task' keyword argument, for progress reports and cancellation checks.
+        """
+        task = Task(self._schedule, on_done, on_error, on_progress, on_finished)
+        if with_task:
+            kwargs["task"] = task
+        task.future = self._executor.submit(fn, *args, **kwargs)
+        task.future.add_done_callback(task._finished)
+        return task
+
+    def shutdown(self, wait=False, cancel_pending=True):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_pending)